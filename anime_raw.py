@@ -0,0 +1,194 @@
+# ======================================================================
+# File: anime_raw.py
+# Description: This file contains the store of raw Jikan anime payloads:
+# the whole response of every anime fetched, kept once per show so new
+# features can read fields parse_anime_info drops (genres, studios,
+# scores...) without fetching the catalog again.
+#
+# How the raw store works:
+#
+# - Payloads are written to the anime_raw table keyed by mal_id, as
+#   zlib-compressed canonical JSON with the SHA-1 of that JSON. A payload
+#   whose hash is unchanged is neither compressed nor written, so storing
+#   every fetch (refresh, season sync, imports, add-anime) is cheap.
+# - RawAnime wraps a stored row and only decompresses and parses the
+#   payload when a field is first read.
+# - Every Database connection has a zjson(payload) SQL function returning
+#   the JSON text, so SQLite's JSON functions read payloads in place:
+#   SELECT mal_id FROM anime_raw WHERE json_extract(zjson(payload), '$.score') > 8
+# - add_field() turns a JSON path into a VIRTUAL generated column of
+#   anime_raw with an index: a new field becomes indexed from local data
+#   only, building the index being the whole backfill.
+#
+# zjson is an application function: the sqlite3 shell and other clients
+# cannot read those columns or write anime_raw rows while fields exist.
+# ======================================================================
+
+import hashlib
+import json
+import re
+import time
+import zlib
+from collections import namedtuple
+from itertools import islice
+from db import BATCH_CHUNK_SIZE, RAW_PAYLOAD_FUNCTION, Database
+
+# zlib level of stored payloads
+COMPRESSION_LEVEL = 6
+
+# Names accepted for generated field columns
+FIELD_NAME_PATTERN = re.compile(r"^[a-z][a-z0-9_]*$")
+
+# Columns of anime_raw itself, which field names may not shadow
+RAW_COLUMNS = ("mal_id", "payload", "payload_hash", "raw_size", "fetched_at")
+
+# Outcome of store_many(): payloads written (new or changed) and payloads left as they were
+StoreResult = namedtuple("StoreResult", ["written", "unchanged"])
+
+def canonical_json(payload: dict) -> bytes:
+    """Serialise a payload with sorted keys, so equal payloads always hash alike."""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode()
+
+def payload_hash(raw: bytes) -> str:
+    return hashlib.sha1(raw).hexdigest()
+
+def decode_payload(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob))
+
+# ----------------------------------------------------------------------
+# Lazy Payloads
+# ----------------------------------------------------------------------
+
+class RawAnime:
+    """A stored payload, decompressed and parsed on first access."""
+    __slots__ = ("mal_id", "payload_hash", "fetched_at", "_blob", "_data")
+
+    def __init__(self, mal_id: int, blob: bytes, payload_hash: str = None, fetched_at: float = None):
+        self.mal_id = mal_id
+        self.payload_hash = payload_hash
+        self.fetched_at = fetched_at
+        self._blob = blob
+        self._data = None
+
+    @property
+    def data(self) -> dict:
+        if self._data is None:
+            self._data = decode_payload(self._blob)
+            self._blob = None
+        return self._data
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, path: str, default=None):
+        """Read a dotted path such as "studios.0.name" (list items by index); default when any step is missing."""
+        value = self.data
+        for step in path.split("."):
+            if isinstance(value, list) and step.isdigit() and int(step) < len(value):
+                value = value[int(step)]
+            elif isinstance(value, dict) and step in value:
+                value = value[step]
+            else:
+                return default
+        return value
+
+    def __repr__(self):
+        return f"RawAnime(mal_id={self.mal_id})"
+
+# ----------------------------------------------------------------------
+# Raw Payload Store
+# ----------------------------------------------------------------------
+
+class RawPayloadStore:
+    """Read and write the anime_raw table of a Database."""
+    def __init__(self, db: Database = None, clock=time.time):
+        self.db = db or Database()
+        self.clock = clock
+
+    def store_many(self, payloads) -> StoreResult:
+        """Store Jikan anime payloads (dicts with a mal_id); payloads whose hash is unchanged are not compressed or written."""
+        now = self.clock()
+        written = unchanged = 0
+        payloads = iter(payloads)
+        while chunk := list(islice(payloads, BATCH_CHUNK_SIZE)):
+            encoded = {}
+            for payload in chunk:
+                raw = canonical_json(payload)
+                encoded[payload["mal_id"]] = (raw, payload_hash(raw))
+            with self.db.transaction() as cursor:
+                cursor.execute(f"SELECT mal_id, payload_hash FROM anime_raw WHERE mal_id IN ({','.join('?' * len(encoded))})",
+                               list(encoded))
+                stored = dict(cursor.fetchall())
+                rows = [(mal_id, zlib.compress(raw, COMPRESSION_LEVEL), digest, len(raw), now)
+                        for mal_id, (raw, digest) in encoded.items() if stored.get(mal_id) != digest]
+                cursor.executemany("INSERT OR REPLACE INTO anime_raw (mal_id, payload, payload_hash, raw_size, fetched_at) "
+                                   "VALUES (?,?,?,?,?)", rows)
+            written, unchanged = written + len(rows), unchanged + len(encoded) - len(rows)
+        return StoreResult(written, unchanged)
+
+    def get(self, mal_id: int):
+        """Return the RawAnime of mal_id, or None if no payload is stored."""
+        with self.db.transaction() as cursor:
+            row = cursor.execute("SELECT mal_id, payload, payload_hash, fetched_at FROM anime_raw WHERE mal_id = ?",
+                                 (mal_id,)).fetchone()
+        return RawAnime(*row) if row else None
+
+    def iter(self, mal_ids=None):
+        """Yield a RawAnime for every stored payload (or those of mal_ids), in mal_id order, without decoding them."""
+        columns = "mal_id, payload, payload_hash, fetched_at"
+        if mal_ids is None:
+            for row in self.db.stream(f"SELECT {columns} FROM anime_raw ORDER BY mal_id"):
+                yield RawAnime(*row)
+            return
+        mal_ids = sorted(set(mal_ids))
+        for start in range(0, len(mal_ids), BATCH_CHUNK_SIZE):
+            chunk = mal_ids[start:start + BATCH_CHUNK_SIZE]
+            for row in self.db.stream(f"SELECT {columns} FROM anime_raw WHERE mal_id IN ({','.join('?' * len(chunk))}) "
+                                      "ORDER BY mal_id", chunk):
+                yield RawAnime(*row)
+
+    def fields(self) -> dict:
+        """Return {column: declared type} of the generated field columns."""
+        with self.db.transaction() as cursor:
+            # table_xinfo reports VIRTUAL generated columns as hidden = 2
+            return {name: declared for _, name, declared, _, _, _, hidden in cursor.execute("PRAGMA table_xinfo(anime_raw)")
+                    if hidden == 2}
+
+    def add_field(self, name: str, path: str, column_type: str = "", index: bool = True):
+        """Expose the JSON path (e.g. "$.score") of every payload as the generated column `name`, indexed by default.
+
+        Raises ValueError for an invalid or taken name. Creating the index reads every stored payload once.
+        """
+        if not FIELD_NAME_PATTERN.match(name) or name in RAW_COLUMNS:
+            raise ValueError(f"invalid field name: {name!r}")
+        if name in self.fields():
+            raise ValueError(f"field already exists: {name!r}")
+        if column_type not in ("", "INTEGER", "REAL", "TEXT"):
+            raise ValueError(f"unsupported column type: {column_type!r}")
+        literal = "'" + path.replace("'", "''") + "'"
+        with self.db.transaction() as cursor:
+            # DDL does not open a transaction by itself, so without BEGIN a failing CREATE INDEX would leave the
+            # column added
+            if not cursor.connection.in_transaction:
+                cursor.execute("BEGIN")
+            cursor.execute(f"ALTER TABLE anime_raw ADD COLUMN {name} {column_type} "
+                           f"GENERATED ALWAYS AS (json_extract({RAW_PAYLOAD_FUNCTION}(payload), {literal})) VIRTUAL")
+            if index:
+                cursor.execute(f"CREATE INDEX idx_anime_raw_{name} ON anime_raw({name})")
+
+    def drop_field(self, name: str):
+        """Remove a generated field column and its index."""
+        if name not in self.fields():
+            raise ValueError(f"unknown field: {name!r}")
+        with self.db.transaction() as cursor:
+            if not cursor.connection.in_transaction:
+                cursor.execute("BEGIN")
+            cursor.execute(f"DROP INDEX IF EXISTS idx_anime_raw_{name}")
+            cursor.execute(f"ALTER TABLE anime_raw DROP COLUMN {name}")
+
+    def stats(self) -> dict:
+        with self.db.transaction() as cursor:
+            entries, stored, raw = cursor.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0), COALESCE(SUM(raw_size), 0) FROM anime_raw").fetchone()
+        return {"entries": entries, "stored_bytes": stored, "raw_bytes": raw,
+                "ratio": raw / stored if stored else 0.0}
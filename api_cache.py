@@ -0,0 +1,235 @@
+# ======================================================================
+# File: api_cache.py
+# Description: This file contains an on-disk HTTP response cache for the
+# Jikan API, used by api_requests.
+#
+# How the cache works:
+#
+# - Responses are stored zlib-compressed in a small SQLite file.
+# - Fresh entries are served without touching the network. The TTL depends
+#   on the anime status (long for "Finished Airing", short for "Currently Airing").
+# - Expired entries are revalidated with If-None-Match / If-Modified-Since;
+#   a 304 answer refreshes the entry without downloading the body again.
+# - The total stored size is capped; least recently used entries are evicted.
+#   The size is kept as a running total in the counters table, changed in the
+#   same transaction as every insert and delete, so checking the cap reads one
+#   row and stays right when several processes (CLI, daemon) share the file.
+# - Hits stay reads: last_access is only rewritten once it is older than
+#   ACCESS_TOUCH_INTERVAL, and counter increments are written in batches.
+# ======================================================================
+
+import atexit
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+# Cache database file name
+CACHE_DB_NAME = "jikan_cache.db"
+
+# Maximum total size of stored (compressed) bodies before LRU eviction
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Time-to-live in seconds, by the anime "status" found in the payload
+STATUS_TTLS = {
+    "Finished Airing": 30 * 24 * 3600,
+    "Currently Airing": 6 * 3600,
+    "Not yet aired": 24 * 3600,
+}
+DEFAULT_TTL = 24 * 3600
+
+# Seconds a hit leaves last_access alone after it was last written: LRU order is only as precise as this, but a hit
+# on a recently used entry costs no disk write
+ACCESS_TOUCH_INTERVAL = 300
+
+# Seconds counter increments are kept in memory before being added to the lifetime totals in the cache file (they are
+# also written with every store, before reading lifetime totals, and at exit)
+COUNTER_FLUSH_INTERVAL = 30
+
+# Counters kept both per instance and as lifetime totals in the cache file
+COUNTERS = ("hits", "misses", "revalidated", "bytes_saved")
+
+# Row of the counters table holding the compressed size of every stored body
+STORED_BYTES = "stored_bytes"
+
+# A cached response: decoded payload, whether it is still fresh, conditional request headers and uncompressed size
+CachedResponse = namedtuple("CachedResponse", ["payload", "fresh", "validators", "size"])
+
+# ----------------------------------------------------------------------
+# Response Cache
+# ----------------------------------------------------------------------
+
+def ttl_for_payload(payload: dict) -> int:
+    """Return how long a Jikan payload may be served without revalidation."""
+    data = payload.get("data") if isinstance(payload, dict) else None
+    status = data.get("status") if isinstance(data, dict) else None
+    return STATUS_TTLS.get(status, DEFAULT_TTL)
+
+class ResponseCache:
+    """SQLite-backed cache of Jikan JSON responses keyed by URL, with hit/miss counters."""
+    def __init__(self, db_name=CACHE_DB_NAME, max_bytes=CACHE_MAX_BYTES, clock=time.time):
+        self.db_name = db_name
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.hits = 0            # served from disk without a request
+        self.misses = 0          # not cached, full download
+        self.revalidated = 0     # expired, server answered 304
+        self.bytes_saved = 0     # uncompressed body bytes not downloaded thanks to hits and 304s
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_name, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            raw_size INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            expires_at REAL NOT NULL,
+            last_access REAL NOT NULL
+        )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        # Lifetime counters, accumulated across processes
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0)")
+        self._conn.executemany("INSERT OR IGNORE INTO counters (name) VALUES (?)", [(name,) for name in COUNTERS])
+        # Running total of the stored size, counted once for files written before it was kept
+        self._conn.execute("INSERT OR IGNORE INTO counters (name, value) "
+                           "SELECT ?, COALESCE(SUM(LENGTH(body)), 0) FROM responses", (STORED_BYTES,))
+        self._conn.commit()
+        self._unsaved = {}                # counter increments not yet added to the lifetime totals
+        self._saved_at = clock()
+        atexit.register(self.flush)
+
+    def lookup(self, url: str):
+        """Return the CachedResponse for url, or None if it is not cached."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, raw_size, etag, last_modified, expires_at, last_access FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+            if row is None:
+                return None
+            body, raw_size, etag, last_modified, expires_at, last_access = row
+            now = self.clock()
+            if now - last_access >= ACCESS_TOUCH_INTERVAL:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE url = ?", (now, url))
+                self._conn.commit()
+        validators = {}
+        if etag:
+            validators["If-None-Match"] = etag
+        if last_modified:
+            validators["If-Modified-Since"] = last_modified
+        return CachedResponse(json.loads(zlib.decompress(body)), expires_at > self.clock(), validators, raw_size)
+
+    def store(self, url: str, payload: dict, headers=None):
+        """Store a freshly downloaded payload with its validators, then enforce the size cap."""
+        headers = headers or {}
+        raw = json.dumps(payload, separators=(",", ":")).encode()
+        body = zlib.compress(raw, 6)
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE counters SET value = value + ? - COALESCE((SELECT LENGTH(body) FROM responses WHERE url = ?), 0) "
+                "WHERE name = ?", (len(body), url, STORED_BYTES))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (url, body, raw_size, etag, last_modified, expires_at, last_access) VALUES (?,?,?,?,?,?,?)",
+                (url, body, len(raw), headers.get("ETag"), headers.get("Last-Modified"),
+                 now + ttl_for_payload(payload), now),
+            )
+            self._evict()
+            self._save_counters()
+            self._conn.commit()
+
+    def refresh(self, url: str, payload: dict):
+        """Extend the lifetime of an entry the server confirmed unchanged (HTTP 304)."""
+        with self._lock:
+            self._conn.execute("UPDATE responses SET expires_at = ?, last_access = ? WHERE url = ?",
+                               (self.clock() + ttl_for_payload(payload), self.clock(), url))
+            self._conn.commit()
+
+    def _stored_bytes(self) -> int:
+        """Compressed size of every stored body, including the entries other processes wrote."""
+        return self._conn.execute("SELECT value FROM counters WHERE name = ?", (STORED_BYTES,)).fetchone()[0]
+
+    def _evict(self):
+        """Delete least recently used entries until the stored size fits within max_bytes."""
+        stored = self._stored_bytes()
+        if stored <= self.max_bytes:
+            return
+        doomed, freed = [], 0
+        for url, size in self._conn.execute("SELECT url, LENGTH(body) FROM responses ORDER BY last_access"):
+            if stored - freed <= self.max_bytes:
+                break
+            doomed.append((url,))
+            freed += size
+        self._conn.executemany("DELETE FROM responses WHERE url = ?", doomed)
+        self._conn.execute("UPDATE counters SET value = value - ? WHERE name = ?", (freed, STORED_BYTES))
+
+    def _save_counters(self):
+        """Add the buffered counter increments to the lifetime totals (the caller commits)."""
+        if self._unsaved:
+            self._conn.executemany("UPDATE counters SET value = value + ? WHERE name = ?",
+                                   [(amount, name) for name, amount in self._unsaved.items()])
+            self._unsaved = {}
+        self._saved_at = self.clock()
+
+    def flush(self):
+        """Write the buffered counter increments to the cache file."""
+        with self._lock:
+            if self._unsaved:
+                self._save_counters()
+                self._conn.commit()
+
+    def _bump(self, **amounts):
+        """Add amounts to the instance counters and, every COUNTER_FLUSH_INTERVAL, to the persisted lifetime totals."""
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+                self._unsaved[name] = self._unsaved.get(name, 0) + amount
+            if self.clock() - self._saved_at >= COUNTER_FLUSH_INTERVAL:
+                self._save_counters()
+                self._conn.commit()
+
+    def record_hit(self, payload_size: int):
+        self._bump(hits=1, bytes_saved=payload_size)
+
+    def record_revalidated(self, payload_size: int):
+        self._bump(revalidated=1, bytes_saved=payload_size)
+
+    def record_miss(self):
+        self._bump(misses=1)
+
+    def stats(self, lifetime: bool = False) -> dict:
+        """Return the counters (for this instance, or lifetime totals) plus the number and size of stored entries."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            stored = self._stored_bytes()
+            if lifetime:
+                self._save_counters()
+                self._conn.commit()
+                totals = dict(self._conn.execute("SELECT name, value FROM counters"))
+                counters = {name: totals[name] for name in COUNTERS}
+            else:
+                counters = {name: getattr(self, name) for name in COUNTERS}
+        lookups = counters["hits"] + counters["misses"] + counters["revalidated"]
+        return {
+            **counters,
+            "hit_rate": (counters["hits"] + counters["revalidated"]) / lookups if lookups else 0.0,
+            "entries": entries,
+            "stored_bytes": stored,
+        }
+
+    def clear(self):
+        """Remove every cached response."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.execute("UPDATE counters SET value = 0")
+            self._conn.commit()
+            self._unsaved = {}
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        self._conn.close()
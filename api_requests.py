@@ -4,21 +4,213 @@
 # ======================================================================
 
 
-import requests
+import os
+import random
+import threading
+import time
 import json
-from rich.console import Console
+from api_cache import ResponseCache
+from lazy import DeferredConsole, lazy_import
+from metrics import percentile
+import metrics
 
-console = Console()
+# Loaded on first use, so importing this module does not pay for the HTTP stack and the event loop
+asyncio = lazy_import("asyncio")
+requests = lazy_import("requests")
+
+console = DeferredConsole()
+
+# Base URL of the Jikan API (override to point at a local stub server)
+JIKAN_BASE_URL = os.environ.get("JIKAN_BASE_URL", "https://api.jikan.moe/v4")
+
+# Seconds before a single HTTP request is abandoned
+REQUEST_TIMEOUT = 10
+
+# Jikan v4 public quotas
+JIKAN_RATE_PER_SECOND = 3
+JIKAN_RATE_PER_MINUTE = 60
+
+# Retry policy for throttled (429) and transient server (5xx) responses
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Set JIKAN_CACHE=0 to bypass the on-disk response cache
+CACHE_ENABLED = os.environ.get("JIKAN_CACHE", "1") != "0"
+
+# Record every Jikan exchange to a .jsonl.gz log, or serve Jikan offline from a log or mirror database (see replay.py)
+JIKAN_RECORD = os.environ.get("JIKAN_RECORD") or None
+JIKAN_REPLAY = os.environ.get("JIKAN_REPLAY") or None
+
+# ----------------------------------------------------------------------
+# HTTP Session and Rate Limiting
+# ----------------------------------------------------------------------
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the shared pooled HTTP session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            if JIKAN_RECORD or JIKAN_REPLAY:
+                import replay
+                replay.install(_session, JIKAN_BASE_URL, record=JIKAN_RECORD, replay=JIKAN_REPLAY)
+        return _session
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per `per` seconds, with bursts up to `burst` (default `rate`)."""
+    def __init__(self, rate: float, per: float, burst: float = None, clock=time.monotonic):
+        self.capacity = burst or rate
+        self.fill_rate = rate / per
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Return how many seconds until a token is available (0 if one is available now)."""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.fill_rate
+
+    def consume(self):
+        self.tokens -= 1
+
+class RateLimiter:
+    """Rate limiter enforcing several token buckets at once (Jikan's per-second and per-minute quotas)."""
+    def __init__(self, per_second: float = JIKAN_RATE_PER_SECOND, per_minute: float = JIKAN_RATE_PER_MINUTE):
+        # No burst on the per-second bucket: requests are spaced evenly so no 1s window exceeds the quota
+        self.buckets = [TokenBucket(per_second, 1.0, burst=1), TokenBucket(per_minute, 60.0)]
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token from every bucket if all have one; otherwise return the time to wait."""
+        with self._lock:
+            wait = max(bucket.wait_time() for bucket in self.buckets)
+            if wait == 0:
+                for bucket in self.buckets:
+                    bucket.consume()
+            return wait
+
+    def acquire_sync(self):
+        """Block the calling thread until a request may be sent."""
+        while (wait := self._reserve()) > 0:
+            time.sleep(wait)
+
+    async def acquire(self):
+        """Wait without blocking the event loop until a request may be sent."""
+        while (wait := self._reserve()) > 0:
+            await asyncio.sleep(wait)
+
+class NoRateLimit:
+    """Stand-in for RateLimiter that never waits, for replayed traffic that never reaches Jikan."""
+    def acquire_sync(self):
+        pass
+
+    async def acquire(self):
+        pass
+
+# Process-wide limiter shared by every Jikan call
+limiter = NoRateLimit() if JIKAN_REPLAY else RateLimiter()
+
+_cache = None
+
+def get_cache():
+    """Return the shared on-disk response cache, or None when caching is disabled."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    with _session_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+def _cache_lookup(url: str):
+    """Return (cached entry, extra request headers) for url; the entry is None on a miss."""
+    cache = get_cache()
+    cached = cache.lookup(url) if cache else None
+    return cached, (cached.validators if cached else {})
+
+def _cache_result(url: str, response, cached):
+    """Turn a final response into a payload, updating the cache; returns None for non-cacheable failures."""
+    cache = get_cache()
+    if response.status_code == 304 and cached is not None:
+        cache.refresh(url, cached.payload)
+        cache.record_revalidated(cached.size)
+        return cached.payload
+    if response.status_code != 200:
+        return None
+    payload = response.json()
+    if cache:
+        cache.store(url, payload, response.headers)
+        cache.record_miss()
+    return payload
+
+def _backoff_delay(attempt: int, response) -> float:
+    """Exponential backoff with jitter, honouring a Retry-After header when the server sends one."""
+    delay = BACKOFF_BASE * (2 ** attempt) * (1 + random.random() * 0.25)
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, float(retry_after))
+    return delay
+
+def _record_request(url: str, elapsed: float, response, error: Exception = None):
+    """Time an HTTP attempt into jikan.<endpoint> and count its status code (or its exception type)."""
+    endpoint = url[len(JIKAN_BASE_URL):].strip("/").split("/", 1)[0] or "root"
+    metrics.observe(f"jikan.{endpoint}", elapsed)
+    if error is not None:
+        metrics.record_error(f"jikan.{endpoint}", error)
+    else:
+        metrics.increment(f"jikan.status.{response.status_code}")
 
 # ----------------------------------------------------------------------
 # Jikan API Functions
 # ----------------------------------------------------------------------
 
+def get_json(path: str, rate_limiter=None) -> dict:
+    """GET a Jikan endpoint through the response cache, with the shared session, rate limiter (or rate_limiter), timeout and retries."""
+    url = f"{JIKAN_BASE_URL}{path}"
+    cached, headers = _cache_lookup(url)
+    if cached is not None and cached.fresh:
+        get_cache().record_hit(cached.size)
+        metrics.increment("jikan.cache_hits")
+        return cached.payload
+    response = None
+    rate_limiter = rate_limiter or limiter
+    for attempt in range(MAX_RETRIES + 1):
+        rate_limiter.acquire_sync()
+        start = time.perf_counter()
+        try:
+            response = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            _record_request(url, time.perf_counter() - start, None, e)
+            if attempt == MAX_RETRIES:
+                raise
+            time.sleep(_backoff_delay(attempt, None))
+            continue
+        _record_request(url, time.perf_counter() - start, response)
+        if response.status_code not in RETRY_STATUSES or attempt == MAX_RETRIES:
+            break
+        time.sleep(_backoff_delay(attempt, response))
+    payload = _cache_result(url, response, cached)
+    if payload is None:
+        response.raise_for_status()
+    return payload
+
 def get_full_anime_info(mal_id: int) -> json:
     """Get full anime information from the Jikan API."""
-    url = f"https://api.jikan.moe/v4/anime/{mal_id}"
-    response = requests.get(url)
-    return response.json()["data"]
+    return get_json(f"/anime/{mal_id}")["data"]
 
 def parse_anime_info(anime_info: json) -> dict:
     """Filter the anime information to only include the relevant fields."""
@@ -31,8 +223,100 @@ def parse_anime_info(anime_info: json) -> dict:
         "aired_from": anime_info["aired"]["from"],
         "aired_to": anime_info["aired"]["to"],
         "broadcast": anime_info["broadcast"]["string"],
+        "alt_titles": "\n".join(_alt_titles(anime_info)) or None,
     }
 
+def _alt_titles(anime_info: json) -> list:
+    """English, Japanese and synonym titles of an anime, without duplicates of the main title."""
+    titles = [entry.get("title") for entry in anime_info.get("titles") or []]
+    if not titles:
+        titles = [anime_info.get("title_english"), anime_info.get("title_japanese"), *(anime_info.get("title_synonyms") or [])]
+    seen = {anime_info["title"]}
+    return [title for title in titles if title and not (title in seen or seen.add(title))]
+
+# ----------------------------------------------------------------------
+# Concurrent Batch Fetching
+# ----------------------------------------------------------------------
+
+class FetchReport:
+    """Results and performance figures of a fetch_anime_many run."""
+    def __init__(self):
+        self.results = {}      # mal_id -> anime data
+        self.errors = {}       # mal_id -> error message
+        self.latencies = []    # seconds per HTTP request, retries included
+        self.requests = 0
+        self.retries = 0
+        self.elapsed = 0.0
+
+    @property
+    def requests_per_sec(self) -> float:
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def summary(self) -> dict:
+        """Return the headline numbers as a flat dict."""
+        return {
+            "fetched": len(self.results),
+            "failed": len(self.errors),
+            "requests": self.requests,
+            "retries": self.retries,
+            "elapsed_sec": self.elapsed,
+            "requests_per_sec": self.requests_per_sec,
+            "latency_p50_ms": percentile(self.latencies, 50) * 1000,
+            "latency_p95_ms": percentile(self.latencies, 95) * 1000,
+            "latency_p99_ms": percentile(self.latencies, 99) * 1000,
+        }
+
+async def _fetch_one(mal_id: int, session, rate_limiter, semaphore, report: FetchReport):
+    """Fetch a single anime, retrying throttled and failed requests with exponential backoff."""
+    url = f"{JIKAN_BASE_URL}/anime/{mal_id}"
+    cached, headers = await asyncio.to_thread(_cache_lookup, url)
+    if cached is not None and cached.fresh:
+        get_cache().record_hit(cached.size)
+        metrics.increment("jikan.cache_hits")
+        report.results[mal_id] = cached.payload["data"]
+        return
+    async with semaphore:
+        for attempt in range(MAX_RETRIES + 1):
+            await rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = await asyncio.to_thread(session.get, url, headers=headers, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                response, exception, error = None, e, str(e)
+            else:
+                exception, error = None, f"HTTP {response.status_code}"
+            elapsed = time.perf_counter() - start
+            report.latencies.append(elapsed)
+            _record_request(url, elapsed, response, exception)
+            report.requests += 1
+
+            if response is not None and response.status_code in (200, 304):
+                payload = await asyncio.to_thread(_cache_result, url, response, cached)
+                if payload is not None:
+                    report.results[mal_id] = payload["data"]
+                    return
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                break
+            if attempt < MAX_RETRIES:
+                report.retries += 1
+                await asyncio.sleep(_backoff_delay(attempt, response))
+        report.errors[mal_id] = error
+
+async def fetch_anime_many(mal_ids, concurrency: int = 3, rate_limiter: RateLimiter = None) -> FetchReport:
+    """Fetch full info for many MAL ids concurrently within Jikan's rate limits.
+
+    Requests share the pooled session, at most `concurrency` are in flight and
+    every attempt (including retries) takes a token from the rate limiter.
+    """
+    report = FetchReport()
+    session = get_session()
+    rate_limiter = rate_limiter or limiter
+    semaphore = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(_fetch_one(mal_id, session, rate_limiter, semaphore, report) for mal_id in dict.fromkeys(mal_ids)))
+    report.elapsed = time.perf_counter() - start
+    return report
+
 
 if __name__ == "__main__":
     print(parse_anime_info(get_full_anime_info(1)))
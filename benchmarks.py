@@ -0,0 +1,1024 @@
+# ======================================================================
+# File: benchmarks.py
+# Description: This file contains micro-benchmarks for the hot paths of the
+# anime watchlist (database access, API fetching, release sweeps).
+#
+# Run one or more scenarios with:
+#   python benchmarks.py --scenario db-pool --ops 5000
+#   python benchmarks.py -s ingest -s sweep -s fanout -s search --output runs.jsonl
+#
+# --ops overrides the scenario's default size. --output appends one JSON
+# record per scenario (results plus commit, Python/SQLite versions and CPU
+# count) so runs can be compared over time; --compare shows the change
+# against the latest record of each scenario in such a file, and --json
+# prints the records instead of tables. Databases are built with datagen.py
+# and Jikan is replaced by stub_jikan.py, whose latency and 429 rate are set
+# with --stub-latency and --stub-throttle-rate.
+# ======================================================================
+
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import click
+from rich.console import Console
+from rich.table import Table
+import api_requests
+import datagen
+import metrics
+import notifications
+from anime_raw import RawPayloadStore
+from api_cache import ResponseCache
+from catalog_cache import CatalogCache
+from db import WATCHLIST_SORTS, Database
+from notifications import NotificationWorker, Outbox, WebhookBackend
+from daemon import Daemon
+from datagen import TITLE_WORDS
+from refresh import AnimeRefresher
+from season_sync import SeasonSync
+from recommend import FeatureMatrix, Recommender
+from releases_checker import ReleaseScheduler, SimulatedClock
+from sharding import ShardedDatabase
+from search import search
+from stub_jikan import StubJikanServer, fake_anime
+from watching_stats import StatsEngine
+
+console = Console()
+
+# Size of the synthetic catalog searched by the search scenario
+SEARCH_CATALOG_SIZE = 50000
+
+# Airing shows and watchlist entries per user generated by the fan-out scenario
+FANOUT_SHOWS = 1000
+FANOUT_WATCHLIST_PER_USER = 10
+
+# Shard counts compared by the shards scenario, and concurrent writer processes
+SHARD_COUNTS = (1, 2, 4, 8)
+SHARD_WRITERS = 8
+
+# Seconds the daemon scenario leaves the daemon idle while measuring CPU usage
+DAEMON_IDLE_SECONDS = 5.0
+
+# Lookups timed per kind by the catalog-cache scenario
+CACHE_LOOKUPS = 20000
+
+# Import time (ms, after interpreter start-up) allowed for `cli.py --help` by the startup scenario
+STARTUP_IMPORT_BUDGET_MS = 100
+
+# Hot queries the query-plans scenario expects to be answered from an index (migration 1 and later), with their
+# parameters
+QUERY_PLAN_CHECKS = {
+    "watchlist_by_user": ("SELECT * FROM watchlist WHERE user_id = ?", (1,)),
+    "watchlist_entry": ("SELECT id FROM watchlist WHERE user_id = ? AND anime_id = ?", (1, 1)),
+    "releases_by_date": ("SELECT anime_id, episode_number FROM releases WHERE release_date BETWEEN ? AND ?",
+                         ("2024-01-01 00:00:00", "2024-01-01 01:00:00")),
+    "release_by_episode": ("SELECT id FROM releases WHERE anime_id = ? AND episode_number = ?", (1, 1)),
+    "airing_by_slot": ("SELECT id FROM anime WHERE status = 'Currently Airing' AND broadcast_utc_minute BETWEEN ? AND ?",
+                       (0, 60)),
+}
+
+# Latency allowed (ms, p95) for one watchlist page of the watchlist scenario's user
+WATCHLIST_PAGE_BUDGET_MS = 50
+
+# Latency allowed (ms, p95) for reading one user's statistics in the watching-stats scenario, whatever the list size
+WATCHING_STATS_BUDGET_MS = 1
+
+# Latency allowed (ms, p95) for ranking the catalog for one user in the recommend scenario, matrix already up to date
+RECOMMEND_BUDGET_MS = 100
+
+# Anime changed between the recommend scenario's full build and its incremental refresh
+RECOMMEND_CHANGED_ANIME = 100
+
+# Modules the startup scenario expects plain commands not to import
+DEFERRED_MODULES = ("requests", "asyncio", "rich", "mal_import", "daemon", "notifications", "releases_checker")
+
+# Separate cli.py processes timed by the startup scenario (the --batch run executes all ops commands)
+STARTUP_PROCESS_RUNS = 20
+
+# Default behaviour of the stub Jikan server: seconds of latency per request and share of requests answered 429
+STUB_LATENCY = 0.02
+STUB_THROTTLE_RATE = 0.05
+
+# Simulated days the sweep scenario runs the release checker for
+SWEEP_DAYS = 7
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cli.py")
+
+# ----------------------------------------------------------------------
+# Helpers
+# ----------------------------------------------------------------------
+
+def _temp_db_path() -> str:
+    """Return a path to a fresh database file inside a temporary directory."""
+    return os.path.join(tempfile.mkdtemp(prefix="aninotif-bench-"), "bench.db")
+
+def _run_cli(args, cwd: str, stdin: str = None, importtime: bool = False):
+    """Run cli.py in a child interpreter and return the CompletedProcess."""
+    flags = ["-X", "importtime"] if importtime else []
+    return subprocess.run([sys.executable, *flags, CLI_PATH, *args], cwd=cwd, input=stdin, capture_output=True, text=True)
+
+def _import_profile(args, cwd: str) -> tuple:
+    """Run cli.py under -X importtime. Returns (ms spent importing after interpreter start-up, imported module names)."""
+    total, modules, started = 0, set(), False
+    for line in _run_cli(args, cwd, importtime=True).stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].strip()
+        if started:
+            total += int(fields[0])
+            modules.add(name)
+        elif name == "site":
+            # Everything imported before site completes is interpreter start-up
+            started = True
+    return total / 1000, modules
+
+def _timed(fn, ops: int) -> float:
+    """Run fn() and return the achieved operations per second."""
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return ops / elapsed if elapsed else float("inf")
+
+# ----------------------------------------------------------------------
+# Scenarios
+# ----------------------------------------------------------------------
+
+def bench_db_pool(ops: int = 5000) -> dict:
+    """Compare connect-per-call writes/reads with the pooled connection layer."""
+    db = Database(_temp_db_path())
+    db.init_db()
+    db.create_user("bench")
+
+    def legacy_writes():
+        # Mirrors the old behaviour: a fresh connection and commit per call
+        for i in range(ops):
+            conn = sqlite3.connect(db.db_name)
+            conn.execute("INSERT INTO watchlist (user_id, anime_id, last_watched_episode) VALUES (?,?,?)", (1, i, 0))
+            conn.commit()
+            conn.close()
+
+    def legacy_reads():
+        for _ in range(ops):
+            conn = sqlite3.connect(db.db_name)
+            conn.execute("SELECT * FROM users WHERE id = ?", (1,)).fetchone()
+            conn.close()
+
+    def pooled_writes():
+        for i in range(ops):
+            db.add_to_watchlist(1, i, 0)
+
+    def pooled_batched_writes():
+        with db.transaction():
+            for i in range(ops):
+                db.add_to_watchlist(1, i, 0)
+
+    def pooled_reads():
+        for _ in range(ops):
+            db.get_user(1)
+
+    results = {
+        "legacy_writes_ops_per_sec": _timed(legacy_writes, ops),
+        "pooled_writes_ops_per_sec": _timed(pooled_writes, ops),
+        "pooled_transaction_writes_ops_per_sec": _timed(pooled_batched_writes, ops),
+        "legacy_reads_ops_per_sec": _timed(legacy_reads, ops),
+        "pooled_reads_ops_per_sec": _timed(pooled_reads, ops),
+    }
+    db.close()
+    return results
+
+def bench_db_batch(ops: int = 10000) -> dict:
+    """Measure batch insert/update/delete throughput against a transaction-wrapped per-row loop."""
+    db = Database(_temp_db_path())
+    db.init_db()
+    anime = [(i, f"Anime {i}", None, 12, "Finished Airing", None, None, None) for i in range(ops)]
+
+    def per_row_inserts():
+        with db.transaction():
+            for row in anime:
+                db.create_anime(*row)
+
+    results = {"per_row_insert_rows_per_sec": _timed(per_row_inserts, ops)}
+    db.delete_anime_many(range(1, ops + 1))
+    db.close()
+
+    db = Database(_temp_db_path())
+    db.init_db()
+    results["batch_insert_rows_per_sec"] = _timed(lambda: db.create_anime_many(anime), ops)
+    # Re-inserting the same rows must report every one of them as a mal_id conflict
+    start = time.perf_counter()
+    outcome = db.create_anime_many(anime[: ops // 10])
+    results["conflict_replay_rows_per_sec"] = (ops // 10) / (time.perf_counter() - start)
+    results["conflicts_reported"] = len(outcome.conflicts)
+    results["batch_update_rows_per_sec"] = _timed(lambda: db.update_anime_many(range(1, ops + 1), status="Currently Airing"), ops)
+    results["batch_delete_rows_per_sec"] = _timed(lambda: db.delete_anime_many(range(1, ops + 1)), ops)
+    db.close()
+    return results
+
+def bench_api_fetch(ops: int = 200) -> dict:
+    """Fetch ops anime from a local stub (STUB_LATENCY, STUB_THROTTLE_RATE random 429s) with fetch_anime_many."""
+    with StubJikanServer(latency=STUB_LATENCY, throttle_rate=STUB_THROTTLE_RATE) as server:
+        api_requests.JIKAN_BASE_URL = server.base_url
+        api_requests.CACHE_ENABLED = False
+        # The stub is not quota-limited like Jikan, so lift the limiter to measure the client itself
+        rate_limiter = api_requests.RateLimiter(per_second=1000, per_minute=60000)
+        report = asyncio.run(api_requests.fetch_anime_many(range(1, ops + 1), concurrency=8, rate_limiter=rate_limiter))
+    return report.summary()
+
+def bench_api_cache(ops: int = 200) -> dict:
+    """Fetch ops anime three times (cold, warm, after expiry) and report the cache counters and stub traffic."""
+    now = [time.time()]
+    with StubJikanServer(latency=0.02) as server:
+        api_requests.JIKAN_BASE_URL = server.base_url
+        api_requests.CACHE_ENABLED = True
+        api_requests._cache = ResponseCache(_temp_db_path(), clock=lambda: now[0])
+        rate_limiter = api_requests.RateLimiter(per_second=1000, per_minute=60000)
+        results = {}
+        for phase in ("cold", "warm", "expired"):
+            if phase == "expired":
+                now[0] += 60 * 24 * 3600
+            before = server.request_count
+            report = asyncio.run(api_requests.fetch_anime_many(range(1, ops + 1), concurrency=8, rate_limiter=rate_limiter))
+            results[f"{phase}_elapsed_sec"] = report.elapsed
+            results[f"{phase}_http_requests"] = server.request_count - before
+        results["not_modified_responses"] = server.not_modified_count
+        results.update(api_requests._cache.stats())
+    return results
+
+def bench_ingest(ops: int = 1000) -> dict:
+    """Ingest ops anime from the stub into an empty catalog: concurrent fetch, parse, batch insert."""
+    db = Database(_temp_db_path())
+    db.init_db()
+    with StubJikanServer(latency=STUB_LATENCY, throttle_rate=STUB_THROTTLE_RATE) as server:
+        api_requests.JIKAN_BASE_URL = server.base_url
+        api_requests.CACHE_ENABLED = False
+        rate_limiter = api_requests.RateLimiter(per_second=1000, per_minute=60000)
+        start = time.perf_counter()
+        report = asyncio.run(api_requests.fetch_anime_many(range(1, ops + 1), concurrency=8, rate_limiter=rate_limiter))
+        fetched = time.perf_counter()
+        parsed = [api_requests.parse_anime_info(data) for data in report.results.values()]
+        parsed_at = time.perf_counter()
+        inserted = db.create_anime_many(parsed).inserted
+        end = time.perf_counter()
+    results = {
+        "fetched": len(report.results),
+        "failed": len(report.errors),
+        "http_requests": report.requests,
+        "retries": report.retries,
+        "fetch_sec": fetched - start,
+        "fetch_p95_ms": metrics.percentile(report.latencies, 95) * 1000,
+        "parse_ms": (parsed_at - fetched) * 1000,
+        "insert_ms": (end - parsed_at) * 1000,
+        "inserted": inserted,
+        "anime_per_sec": inserted / (end - start),
+    }
+    # Ingesting the same payloads again must be rejected row by row, not duplicated
+    results["reingest_conflicts"] = len(db.create_anime_many(parsed).conflicts)
+    db.close()
+    return results
+
+def bench_season_sync(ops: int = 300) -> dict:
+    """Load an ops-title season (plus continuing shows) from the stub: per-id ingest against the listing sync."""
+    api_requests.CACHE_ENABLED = False
+    rate_limiter = api_requests.RateLimiter(per_second=1000, per_minute=60000)
+    results = {}
+    with StubJikanServer(latency=STUB_LATENCY, throttle_rate=STUB_THROTTLE_RATE, season_size=ops) as server:
+        api_requests.JIKAN_BASE_URL = server.base_url
+        db = Database(_temp_db_path())
+        db.init_db()
+        start = time.perf_counter()
+        report = asyncio.run(api_requests.fetch_anime_many(sorted(server.airing_ids), concurrency=8, rate_limiter=rate_limiter))
+        inserted = db.create_anime_many(api_requests.parse_anime_info(data) for data in report.results.values()).inserted
+        results["per_id_elapsed_sec"] = time.perf_counter() - start
+        results["per_id_requests"] = server.request_count
+        results["per_id_inserted"] = inserted
+        db.close()
+
+        db = Database(_temp_db_path())
+        db.init_db()
+        server.request_count = 0
+        sync = SeasonSync(db, concurrency=8, rate_limiter=rate_limiter, seed=0)
+        first = sync.sync()
+        results["sync_elapsed_sec"] = first.elapsed
+        results["sync_requests"] = server.request_count
+        results["sync_pages"] = first.pages
+        results["sync_full_fetches"] = first.full_fetches
+        results["sync_inserted"] = first.inserted
+        server.request_count = 0
+        second = sync.sync()
+        results["resync_elapsed_sec"] = second.elapsed
+        results["resync_unchanged"] = second.unchanged
+        db.close()
+    # Wall time the same requests would take at Jikan's published rate limit
+    for phase in ("per_id", "sync"):
+        results[f"{phase}_quota_sec"] = results[f"{phase}_requests"] / api_requests.JIKAN_RATE_PER_SECOND
+    results["request_reduction"] = results["per_id_requests"] / results["sync_requests"]
+    return results
+
+def bench_replay(ops: int = 500) -> dict:
+    """Fetch ops anime from the stub while recording, then again from the recorded log and from the mirror table."""
+    import replay
+    import requests
+    directory = os.path.dirname(_temp_db_path())
+    log_path = os.path.join(directory, "traffic.jsonl.gz")
+    api_requests.CACHE_ENABLED = False
+    results = {}
+
+    def fetch(phase, rate_limiter, **source):
+        session = requests.Session()
+        api_requests._session = session
+        adapter = replay.install(session, api_requests.JIKAN_BASE_URL, **source)
+        report = asyncio.run(api_requests.fetch_anime_many(range(1, ops + 1), concurrency=8, rate_limiter=rate_limiter))
+        results[f"{phase}_fetched"] = len(report.results)
+        results[f"{phase}_elapsed_sec"] = report.elapsed
+        results[f"{phase}_anime_per_sec"] = len(report.results) / report.elapsed
+        session.close()
+        api_requests._session = None
+        return adapter
+
+    with StubJikanServer(latency=STUB_LATENCY, throttle_rate=STUB_THROTTLE_RATE) as server:
+        api_requests.JIKAN_BASE_URL = server.base_url
+        fetch("record", api_requests.RateLimiter(per_second=1000, per_minute=60000), record=log_path)
+        results["recorded_requests"] = server.request_count
+    results["log_kb"] = os.path.getsize(log_path) / 1024
+    fetch("replay_log", api_requests.NoRateLimit(), replay=log_path)
+    mirror_path = os.path.join(directory, "mirror.db")
+    mirror = replay.MirrorStore(mirror_path)
+    start = time.perf_counter()
+    mirror.load_log(log_path)
+    results["mirror_load_ms"] = (time.perf_counter() - start) * 1000
+    mirror.close()
+    adapter = fetch("replay_mirror", api_requests.NoRateLimit(), replay=mirror_path)
+    results["replay_missing"] = adapter.missing
+    return results
+
+def bench_notify(ops: int = 2000) -> dict:
+    """Enqueue ops release notifications (4 episodes per show) and drain them to a local webhook stub."""
+    db = Database(_temp_db_path())
+    db.init_db()
+    outbox = Outbox(db)
+    notifications = [(i // 4, f"Anime {i // 4}", i % 4 + 1, "2026-01-01 15:00 UTC", None) for i in range(ops)]
+    start = time.perf_counter()
+    queued = outbox.enqueue_many(notifications)
+    results = {"enqueue_per_sec": ops / (time.perf_counter() - start)}
+    # A restarted checker re-enqueueing the same releases must not add anything
+    results["duplicates_queued"] = outbox.enqueue_many(notifications)
+    with StubJikanServer() as server:
+        worker = NotificationWorker(outbox, WebhookBackend(server.webhook_url))
+        worker.drain_once()
+        results.update(worker.metrics())
+        results["webhook_requests"] = len(server.webhook_payloads)
+    results["queued"] = queued
+    db.close()
+    return results
+
+def bench_search(ops: int = 1000) -> dict:
+    """Search a 50k-title synthetic catalog with exact, prefix and misspelled queries; report latency percentiles."""
+    rng = random.Random(0)
+    db = Database(_temp_db_path())
+    db.init_db()
+    titles = [" ".join(rng.sample(TITLE_WORDS, rng.randint(2, 4))) + f" {i}" for i in range(SEARCH_CATALOG_SIZE)]
+    anime = [(i, title.title(), f"Synopsis of {title}.", 12, "Finished Airing", None, None, None, title.upper())
+             for i, title in enumerate(titles, 1)]
+    results = {"catalog_titles": SEARCH_CATALOG_SIZE,
+               "index_build_rows_per_sec": _timed(lambda: db.create_anime_many(anime), SEARCH_CATALOG_SIZE)}
+
+    def misspell(word):
+        index = rng.randrange(1, len(word) - 1)
+        return word[:index] + word[index + 1] + word[index] + word[index + 2:]
+
+    queries = {
+        "exact": [" ".join(rng.sample(TITLE_WORDS, 2)) for _ in range(ops)],
+        "prefix": [" ".join(word[:3] for word in rng.sample(TITLE_WORDS, 2)) for _ in range(ops)],
+        "fuzzy": [misspell(rng.choice([word for word in TITLE_WORDS if len(word) > 4])) for _ in range(ops)],
+    }
+    for kind, batch in queries.items():
+        latencies, hits = [], 0
+        for query in batch:
+            start = time.perf_counter()
+            hits += bool(search(db, query, online=False))
+            latencies.append(time.perf_counter() - start)
+        results[f"{kind}_p50_ms"] = metrics.percentile(latencies, 50) * 1000
+        results[f"{kind}_p95_ms"] = metrics.percentile(latencies, 95) * 1000
+        results[f"{kind}_p99_ms"] = metrics.percentile(latencies, 99) * 1000
+        results[f"{kind}_hit_rate_pct"] = 100.0 * hits / len(batch)
+    db.close()
+    return results
+
+def bench_refresh(ops: int = 1000) -> dict:
+    """Refresh an ops-row catalog from a local stub: first pass, 7 hours later, then 40 days later with 1% edited rows."""
+    now = [time.time()]
+    db = Database(_temp_db_path())
+    db.init_db()
+    db.create_anime_many((i, f"Anime {i}", None, None, "Currently Airing", None, None, None) for i in range(1, ops + 1))
+    with StubJikanServer() as server:
+        api_requests.JIKAN_BASE_URL = server.base_url
+        api_requests.CACHE_ENABLED = True
+        api_requests._cache = ResponseCache(_temp_db_path(), clock=lambda: now[0])
+        rate_limiter = api_requests.RateLimiter(per_second=1000, per_minute=60000)
+        refresher = AnimeRefresher(db, clock=lambda: now[0], concurrency=8, rate_limiter=rate_limiter, seed=0)
+        results = {}
+        for phase, advance in (("first", 0), ("after_7h", 7 * 3600), ("after_40d", 40 * 24 * 3600)):
+            now[0] += advance
+            if phase == "after_40d":
+                db.update_anime_many(range(1, ops + 1, 100), episodes=0)
+            before = server.request_count
+            report = refresher.refresh_due(batch_size=200)
+            results[f"{phase}_checked"] = report.checked
+            results[f"{phase}_changed"] = report.changed
+            results[f"{phase}_columns_written"] = report.columns_written
+            results[f"{phase}_http_requests"] = server.request_count - before
+            results[f"{phase}_elapsed_sec"] = report.elapsed
+        results["not_modified_responses"] = server.not_modified_count
+    db.close()
+    return results
+
+def bench_daemon(ops: int = 1000) -> dict:
+    """Start the daemon on ops airing anime; measure startup-to-first-check, idle CPU and hot-reload latency."""
+    path = _temp_db_path()
+    db = Database(path)
+    db.init_db()
+    db.create_anime_many((i, f"Anime {i}", None, None, "Currently Airing", "2026-01-01T00:00:00+00:00", None,
+                          f"{('Mondays', 'Thursdays', 'Saturdays')[i % 3]} at {i % 24:02d}:00 (JST)") for i in range(1, ops + 1))
+
+    async def scenario():
+        with StubJikanServer() as server:
+            daemon = Daemon(Database(path), WebhookBackend(server.webhook_url), refresh=False,
+                            pid_file=os.path.join(os.path.dirname(path), "bench.pid"))
+            start = time.perf_counter()
+            task = asyncio.create_task(daemon.run_async())
+            while daemon.startup_to_first_check is None:
+                await asyncio.sleep(0.001)
+            results = {"airing_anime": ops, "startup_to_first_check_ms": daemon.startup_to_first_check * 1000,
+                       "startup_wall_ms": (time.perf_counter() - start) * 1000}
+            await asyncio.sleep(0.5)
+            cpu, wall = time.process_time(), time.perf_counter()
+            await asyncio.sleep(DAEMON_IDLE_SECONDS)
+            results["idle_cpu_percent"] = 100.0 * (time.process_time() - cpu) / (time.perf_counter() - wall)
+            # A write from another connection (like a CLI command) must be picked up without a restart
+            reloads, changed_at = daemon.reloads, time.perf_counter()
+            db.create_anime(ops + 1, "Late Addition", None, None, "Currently Airing", "2026-01-01T00:00:00+00:00", None,
+                            "Sundays at 12:00 (JST)")
+            while daemon.reloads == reloads:
+                await asyncio.sleep(0.01)
+            results["hot_reload_latency_ms"] = (time.perf_counter() - changed_at) * 1000
+            daemon.stop()
+            await task
+        return results
+
+    results = asyncio.run(scenario())
+    db.close()
+    return results
+
+def bench_sweep(ops: int = 5000) -> dict:
+    """Run the release checker for SWEEP_DAYS simulated days over a generated catalog of ops anime (ops // 5 users)."""
+    from datetime import timedelta
+    db = Database(_temp_db_path())
+    db.init_db()
+    start = time.perf_counter()
+    generated = datagen.populate(db, anime=ops, users=max(1, ops // 5))
+    results = {"anime": generated.anime, "airing": generated.airing, "past_releases": generated.releases,
+               "generate_sec": time.perf_counter() - start}
+
+    released = []
+    clock = SimulatedClock(datagen.REFERENCE_TIME)
+    scheduler = ReleaseScheduler(db, clock=clock, on_release=released.append)
+    start = time.perf_counter()
+    results["scheduled_shows"] = scheduler.load()
+    results["load_ms"] = (time.perf_counter() - start) * 1000
+    metrics.snapshot(reset=True)
+    cpu, start = time.process_time(), time.perf_counter()
+    scheduler.run(until=clock.now() + timedelta(days=SWEEP_DAYS))
+    results["sweep_sec"] = time.perf_counter() - start
+    results["sweep_cpu_sec"] = time.process_time() - cpu
+    cycles = metrics.snapshot()["histograms"]["release.cycle"]
+    results["releases"] = len(released)
+    results["cycles"] = cycles.count
+    results["cycle_p50_ms"] = cycles.percentile(50) * 1000
+    results["cycle_p99_ms"] = cycles.percentile(99) * 1000
+    results["releases_per_sec"] = len(released) / results["sweep_sec"]
+    db.close()
+    return results
+
+def bench_fanout(ops: int = 100000) -> dict:
+    """Fan releases out to ops users watching 10 of 1000 airing shows each: a 10-release tick, then all 1000 at once."""
+    from datetime import datetime, timezone
+    from releases_checker import Release
+    rng = random.Random(0)
+    db = Database(_temp_db_path())
+    db.init_db()
+    start = time.perf_counter()
+    db.create_anime_many((i, f"Anime {i}", None, 12, "Currently Airing", None, None, None) for i in range(1, FANOUT_SHOWS + 1))
+    with db.transaction() as cursor:
+        cursor.executemany("INSERT INTO users (mal_user_id) VALUES (?)", ((f"user{i}",) for i in range(ops)))
+    db.add_to_watchlist_many((user, show, rng.randrange(0, 8)) for user in range(1, ops + 1)
+                             for show in rng.sample(range(1, FANOUT_SHOWS + 1), FANOUT_WATCHLIST_PER_USER))
+    results = {"users": ops, "airing_shows": FANOUT_SHOWS, "watchlist_rows": ops * FANOUT_WATCHLIST_PER_USER,
+               "generate_sec": time.perf_counter() - start}
+
+    outbox = Outbox(db)
+    air_time = datetime(2026, 1, 1, 15, tzinfo=timezone.utc)
+    releases = [Release(show, f"Anime {show}", 5, air_time, None) for show in range(1, FANOUT_SHOWS + 1)]
+    with db.transaction() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + notifications.FANOUT_QUERY, (outbox._release_batch(releases[:1]),))
+        results["uses_progress_index"] = float(any("idx_watchlist_anime_progress" in row[-1] for row in cursor.fetchall()))
+
+    start = time.perf_counter()
+    recipients = outbox.recipients(releases[:10])
+    results["tick_10_recipients_ms"] = (time.perf_counter() - start) * 1000
+    results["tick_10_recipients"] = len(recipients)
+    start = time.perf_counter()
+    results["tick_10_queued"] = outbox.fan_out(releases[:10])
+    results["tick_10_fan_out_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    queued = outbox.fan_out(releases)
+    elapsed = time.perf_counter() - start
+    results["full_1000_queued"] = queued
+    results["full_1000_fan_out_sec"] = elapsed
+    results["full_1000_rows_per_sec"] = queued / elapsed
+    start = time.perf_counter()
+    results["rerun_queued"] = outbox.fan_out(releases)
+    results["rerun_sec"] = time.perf_counter() - start
+    db.close()
+    return results
+
+def bench_watchlist(ops: int = 5000) -> dict:
+    """Page through a user's ops-entry watchlist with every sort, against WATCHLIST_PAGE_BUDGET_MS, and the N+1 view.
+
+    over_budget is 1 (and the run exits with status 1) when a sort's p95 page latency exceeds the budget.
+    """
+    db = Database(_temp_db_path())
+    db.init_db()
+    datagen.populate(db, anime=max(4 * ops, 1000), users=1, watchlist_per_user=ops)
+    now = datagen.REFERENCE_TIME
+    results = {"entries": len(db.get_watchlist(1)), "page_budget_ms": WATCHLIST_PAGE_BUDGET_MS}
+    over_budget = False
+    for sort in WATCHLIST_SORTS:
+        latencies, seen, after = [], 0, None
+        while True:
+            start = time.perf_counter()
+            page = db.get_watchlist_page(1, sort, after, now=now)
+            latencies.append(time.perf_counter() - start)
+            seen += len(page.entries)
+            if page.after is None:
+                break
+            after = page.after
+        results[f"{sort}_pages"] = len(latencies)
+        results[f"{sort}_first_page_ms"] = latencies[0] * 1000
+        results[f"{sort}_p95_ms"] = metrics.percentile(latencies, 95) * 1000
+        results[f"{sort}_max_ms"] = max(latencies) * 1000
+        results[f"{sort}_complete"] = float(seen == results["entries"])
+        over_budget = over_budget or results[f"{sort}_p95_ms"] > WATCHLIST_PAGE_BUDGET_MS
+    # The view the menu could build before: raw watchlist rows, then one get_anime call per row
+    start = time.perf_counter()
+    for row in db.get_watchlist(1):
+        db.get_anime(row[2])
+    results["n_plus_1_full_ms"] = (time.perf_counter() - start) * 1000
+    results["over_budget"] = int(over_budget)
+    db.close()
+    return results
+
+def bench_watching_stats(ops: int = 20000) -> dict:
+    """Read the statistics of 10-entry users and of one ops-entry user from the maintained aggregates, against a
+    rescan and WATCHING_STATS_BUDGET_MS, and time the writes that keep them up to date.
+
+    over_budget is 1 (and the run exits with status 1) when a maintained read's p95 latency exceeds the budget.
+    """
+    db = Database(_temp_db_path())
+    db.init_db()
+    start = time.perf_counter()
+    data = datagen.populate(db, anime=max(4 * ops, 5000), users=1000, watchlist_per_user=10)
+    with db.transaction() as cursor:
+        anime_ids = [row[0] for row in cursor.execute("SELECT id FROM anime ORDER BY id")]
+    heavy = data.users + 1
+    db.add_to_watchlist_many((heavy, anime_id, episode) for _, anime_id, episode
+                             in datagen.watchlist_rows(1, anime_ids, ops, seed=1))
+    results = {"populate_s": time.perf_counter() - start, "heavy_entries": min(ops, len(anime_ids))}
+    engine = StatsEngine(db)
+    rng = random.Random(0)
+    over_budget = False
+    for name, users in (("small", [rng.randrange(1, data.users + 1) for _ in range(1000)]), ("heavy", [heavy] * 1000)):
+        latencies = []
+        for user_id in users:
+            start = time.perf_counter()
+            engine.user(user_id)
+            latencies.append(time.perf_counter() - start)
+        results[f"{name}_read_p95_us"] = metrics.percentile(latencies, 95) * 1e6
+        over_budget = over_budget or results[f"{name}_read_p95_us"] > WATCHING_STATS_BUDGET_MS * 1000
+        latencies = []
+        for user_id in users[:20]:
+            start = time.perf_counter()
+            engine.scan(user_id)
+            latencies.append(time.perf_counter() - start)
+        results[f"{name}_scan_p95_ms"] = metrics.percentile(latencies, 95) * 1000
+    results["matches_scan"] = float(all(engine.user(user_id) == engine.scan(user_id) for user_id in (1, 2, 3, heavy)))
+    start = time.perf_counter()
+    engine.overall()
+    results["overall_read_us"] = (time.perf_counter() - start) * 1e6
+    # Writes: single-commit progress updates, then announcing the next episode of the most watched airing show
+    with db.transaction() as cursor:
+        entries = cursor.execute("SELECT id, last_watched_episode FROM watchlist WHERE user_id = ? LIMIT 1000",
+                                 (heavy,)).fetchall()
+        anime_id, watchers = cursor.execute('''
+        SELECT w.anime_id, COUNT(*) FROM watchlist w JOIN anime a ON a.id = w.anime_id
+        WHERE a.status = 'Currently Airing' GROUP BY w.anime_id ORDER BY COUNT(*) DESC LIMIT 1
+        ''').fetchone()
+        episode = cursor.execute("SELECT COALESCE(MAX(episode_number), 0) + 1 FROM releases WHERE anime_id = ?",
+                                 (anime_id,)).fetchone()[0]
+    results["progress_updates_per_sec"] = _timed(
+        lambda: [db.update_watchlist(entry_id, watched + 1) for entry_id, watched in entries], len(entries))
+    announced_on = datagen.format_release_date(datagen.REFERENCE_TIME)
+    db.add_release(anime_id, episode, announced_on, None)
+    start = time.perf_counter()
+    db.mark_releases_announced([(anime_id, episode)], announced_on)
+    results["announce_ms"] = (time.perf_counter() - start) * 1000
+    results["announce_watchers"] = watchers
+    report = engine.rebuild()
+    results["rebuild_s"] = report.elapsed
+    results["drifted"] = report.drifted
+    results["over_budget"] = int(over_budget)
+    db.close()
+    return results
+
+def _shard_writer(args) -> None:
+    """Process body of the shards scenario: insert rows one commit at a time through its own ShardedDatabase."""
+    root, shards, rows = args
+    with ShardedDatabase(root, shards) as storage:
+        for user_id, anime_id, episode in rows:
+            storage.add_to_watchlist(user_id, anime_id, episode)
+
+def bench_shards(ops: int = 200000) -> dict:
+    """For 1, 2, 4 and 8 shards: ops // 10 single-row commits from 8 writer processes, an ops-row batch insert
+    over 100k users and a fan-out of 1000 releases."""
+    from datetime import datetime, timezone
+    from multiprocessing import Pool
+    from releases_checker import Release
+    rng = random.Random(0)
+    rows = [(rng.randrange(1, 100001), rng.randrange(1, FANOUT_SHOWS + 1), rng.randrange(0, 8)) for _ in range(ops)]
+    single_rows = rows[: ops // 10]
+    air_time = datetime(2026, 1, 1, 15, tzinfo=timezone.utc)
+    releases = [Release(show, f"Anime {show}", 5, air_time, None) for show in range(1, FANOUT_SHOWS + 1)]
+    results = {"cpu_count": os.cpu_count()}
+    for shards in SHARD_COUNTS:
+        root = os.path.dirname(_temp_db_path())
+        with ShardedDatabase(root, shards) as storage:
+            storage.init_db()
+            storage.catalog.create_anime_many((i, f"Anime {i}", None, 12, "Currently Airing", None, None, None)
+                                              for i in range(1, FANOUT_SHOWS + 1))
+            with storage.catalog.transaction() as cursor:
+                cursor.executemany("INSERT INTO users (mal_user_id) VALUES (?)", ((f"user{i}",) for i in range(100000)))
+        start = time.perf_counter()
+        with Pool(SHARD_WRITERS) as pool:
+            pool.map(_shard_writer, [(root, shards, single_rows[writer::SHARD_WRITERS]) for writer in range(SHARD_WRITERS)])
+        results[f"{shards}_shards_commit_per_row_rows_per_sec"] = len(single_rows) / (time.perf_counter() - start)
+        with ShardedDatabase(root, shards) as storage:
+            results[f"{shards}_shards_batch_rows_per_sec"] = _timed(lambda: storage.add_to_watchlist_many(rows), ops)
+            start = time.perf_counter()
+            queued = storage.fan_out(releases)
+            results[f"{shards}_shards_fan_out_rows_per_sec"] = queued / (time.perf_counter() - start)
+    return results
+
+def bench_raw_store(ops: int = 10000) -> dict:
+    """Store ops stub payloads in anime_raw: size per 10k anime, then index a new field from local data only."""
+    db = Database(_temp_db_path())
+    db.init_db()
+    store = RawPayloadStore(db)
+    payloads = [fake_anime(mal_id) for mal_id in range(1, ops + 1)]
+    results = {"store_per_sec": _timed(lambda: store.store_many(payloads), ops)}
+    results["restore_unchanged_per_sec"] = _timed(lambda: store.store_many(payloads), ops)
+    stats = store.stats()
+
+    def table_bytes():
+        with db.transaction() as cursor:
+            return cursor.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = 'anime_raw' "
+                                  "OR name LIKE 'idx_anime_raw_%'").fetchone()[0]
+
+    per_10k = 10000 / ops
+    results["raw_mb_per_10k"] = stats["raw_bytes"] * per_10k / 1e6
+    results["compressed_mb_per_10k"] = stats["stored_bytes"] * per_10k / 1e6
+    results["on_disk_mb_per_10k"] = table_bytes() * per_10k / 1e6
+    results["compression_ratio"] = stats["ratio"]
+    for name, path, column_type in (("score", "$.score", "REAL"), ("studio", "$.studios[0].name", "TEXT")):
+        start = time.perf_counter()
+        store.add_field(name, path, column_type)
+        results[f"backfill_{name}_sec"] = time.perf_counter() - start
+    results["on_disk_mb_per_10k_with_fields"] = table_bytes() * per_10k / 1e6
+    with db.transaction() as cursor:
+        start = time.perf_counter()
+        top = cursor.execute("SELECT mal_id FROM anime_raw WHERE score >= 9 ORDER BY score DESC").fetchall()
+        results["indexed_query_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    scanned = [raw.mal_id for raw in store.iter() if raw["score"] >= 9]
+    results["decode_scan_ms"] = (time.perf_counter() - start) * 1000
+    results["matches"] = len(top)
+    results["matches_agree"] = sorted(mal_id for mal_id, in top) == scanned
+    start = time.perf_counter()
+    for raw in store.iter():
+        raw.mal_id
+    results["lazy_iter_ms"] = (time.perf_counter() - start) * 1000
+    db.close()
+    return results
+
+def bench_catalog_cache(ops: int = 100000) -> dict:
+    """Cache an ops-anime catalog: memory per 100k anime against fetched rows, and lookup latency against SQLite."""
+    from datetime import datetime, timezone
+    rng = random.Random(0)
+    db = Database(_temp_db_path())
+    db.init_db()
+    days = ("Mondays", "Tuesdays", "Wednesdays", "Thursdays", "Fridays", "Saturdays", "Sundays")
+    db.create_anime_many(
+        (i, " ".join(rng.sample(TITLE_WORDS, 3)).title(), None, rng.randint(1, 26),
+         "Currently Airing" if i % 5 == 0 else "Finished Airing", None, None,
+         f"{rng.choice(days)} at {rng.randint(0, 23):02d}:{rng.choice((0, 30)):02d} (JST)")
+        for i in range(1, ops + 1))
+    scale = 100000 / ops
+
+    tracemalloc.start()
+    with db.transaction() as cursor:
+        rows = cursor.execute("SELECT * FROM anime").fetchall()
+    results = {"sqlite_rows_mb_per_100k": tracemalloc.get_traced_memory()[0] * scale / 2**20}
+    del rows
+    tracemalloc.stop()
+    cache = CatalogCache(db)
+    start = time.perf_counter()
+    cache.snapshot()
+    results["cache_load_ms"] = (time.perf_counter() - start) * 1000
+    cache.invalidate()
+    tracemalloc.start()
+    cache.snapshot()
+    results["cache_mb_per_100k"] = tracemalloc.get_traced_memory()[0] * scale / 2**20
+    tracemalloc.stop()
+    results["cache_reported_mb_per_100k"] = cache.memory_bytes() * scale / 2**20
+
+    def latency_us(fn, keys):
+        start = time.perf_counter()
+        for key in keys:
+            fn(key)
+        return (time.perf_counter() - start) / len(keys) * 1e6
+
+    def sqlite_by_mal_id(mal_id):
+        with db.transaction() as cursor:
+            return cursor.execute("SELECT * FROM anime WHERE mal_id = ?", (mal_id,)).fetchone()
+
+    keys = [rng.randint(1, ops) for _ in range(CACHE_LOOKUPS)]
+    results["by_id_sqlite_us"] = latency_us(db.get_anime, keys)
+    results["by_id_cache_us"] = latency_us(cache.get_anime, keys)
+    results["by_mal_id_sqlite_us"] = latency_us(sqlite_by_mal_id, keys)
+    results["by_mal_id_cache_us"] = latency_us(cache.get_anime_by_mal_id, keys)
+    starts = [datetime.fromtimestamp(1.7e9 + rng.randrange(7 * 86400), timezone.utc) for _ in range(200)]
+    results["airing_24h_sqlite_us"] = latency_us(db.get_anime_airing_within, starts)
+    results["airing_24h_cache_us"] = latency_us(cache.get_anime_airing_within, starts)
+
+    # A write through the Database methods followed by a lookup: the row is patched in, not reloaded
+    edits = keys[:200]
+    results["update_then_lookup_cache_us"] = latency_us(
+        lambda anime_id: (db.update_anime(anime_id, episodes=0), cache.get_anime(anime_id)), edits)
+    results["cache_reloads"] = cache.loads
+    results["cache_patched_rows"] = cache.patched
+    cache.close()
+    db.close()
+    return results
+
+def bench_startup(ops: int = 1000) -> dict:
+    """Profile cli.py imports against STARTUP_IMPORT_BUDGET_MS; compare the per-command cost of separate processes
+    with one --batch process running ops commands.
+
+    over_budget is 1 (and the run exits with status 1) when `--help` imports
+    exceed the budget or load one of DEFERRED_MODULES, or when the --batch run fails.
+    """
+    workdir = os.path.dirname(_temp_db_path())
+    db = Database(os.path.join(workdir, "anime_watchlist.db"))
+    db.init_db()
+    db.create_anime(1, "Bench", None, 12, "Currently Airing", None, None, None)
+    db.create_user("bench")
+    db.close()
+
+    results = {"import_budget_ms": STARTUP_IMPORT_BUDGET_MS}
+    commands = {"help": ["--help"], "add_to_watchlist": ["add-to-watchlist", "--user_id", "1", "--anime_id", "1",
+                                                         "--last_watched_episode", "0"]}
+    help_ok = True
+    for name, args in commands.items():
+        profiles = [_import_profile(args, workdir) for _ in range(5)]
+        import_ms = statistics.median(ms for ms, _ in profiles)
+        loaded = [module for module in DEFERRED_MODULES if any(module in modules for _, modules in profiles)]
+        results[f"{name}_import_ms"] = import_ms
+        results[f"{name}_deferred_modules_loaded"] = len(loaded)
+        if name == "help":
+            help_ok = import_ms <= STARTUP_IMPORT_BUDGET_MS and not loaded
+            if loaded:
+                console.print(f"[red]cli.py --help imported {', '.join(loaded)}[/red]")
+            if import_ms > STARTUP_IMPORT_BUDGET_MS:
+                console.print(f"[red]cli.py --help imports took {import_ms:.1f} ms (budget {STARTUP_IMPORT_BUDGET_MS} ms)[/red]")
+
+    start = time.perf_counter()
+    for i in range(STARTUP_PROCESS_RUNS):
+        _run_cli(["add-user", "--mal_user_id", f"user{i}"], workdir)
+    results["separate_runs_ms_per_command"] = (time.perf_counter() - start) * 1000 / STARTUP_PROCESS_RUNS
+    start = time.perf_counter()
+    batch = _run_cli(["--batch"], workdir, stdin="\n".join(f"add-user --mal_user_id batch{i}" for i in range(ops)))
+    results["batch_ms_per_command"] = (time.perf_counter() - start) * 1000 / ops
+    results["batch_exit_status"] = batch.returncode
+    if batch.returncode:
+        console.print(f"[red]cli.py --batch exited with status {batch.returncode}[/red]")
+    results["over_budget"] = int(not help_ok or batch.returncode != 0)
+    return results
+
+def bench_metrics(ops: int = 100000) -> dict:
+    """Per-call cost of the db.<method> timers on Database.get_anime, plus histogram percentile accuracy."""
+    db = Database(_temp_db_path())
+    db.init_db()
+    db.create_anime(1, "Metrics", None, 12, "Finished Airing", None, None, None)
+    plain = Database.get_anime.__wrapped__
+    results = {
+        "get_anime_plain_us": 1e6 / _timed(lambda: [plain(db, 1) for _ in range(ops)], ops),
+        "get_anime_timed_us": 1e6 / _timed(lambda: [db.get_anime(1) for _ in range(ops)], ops),
+        "observe_us": 1e6 / _timed(lambda: [metrics.observe("bench.observe", 0.001) for _ in range(ops)], ops),
+    }
+    results["timer_overhead_us"] = results["get_anime_timed_us"] - results["get_anime_plain_us"]
+
+    rng = random.Random(0)
+    samples = [rng.lognormvariate(-6, 1.5) for _ in range(ops)]
+    histogram = metrics.Histogram()
+    for sample in samples:
+        histogram.observe(sample)
+    for pct in (50, 95, 99):
+        exact = metrics.percentile(samples, pct)
+        results[f"p{pct}_histogram_error_pct"] = (histogram.percentile(pct) - exact) / exact * 100
+    db.close()
+    return results
+
+def bench_recommend(ops: int = 20000) -> dict:
+    """Build the feature matrix of an ops-anime catalog with raw payloads, refresh it after RECOMMEND_CHANGED_ANIME
+    anime change, and time recommendations for 10-entry users against RECOMMEND_BUDGET_MS.
+
+    over_budget is 1 (and the run exits with status 1) when the p95 latency of a recommendation exceeds the budget.
+    """
+    db = Database(_temp_db_path())
+    db.init_db()
+    data = datagen.populate(db, anime=ops, users=200, watchlist_per_user=10)
+    with db.transaction() as cursor:
+        anime = cursor.execute("SELECT id, mal_id FROM anime ORDER BY id").fetchall()
+    start = time.perf_counter()
+    RawPayloadStore(db).store_many(fake_anime(mal_id) for _, mal_id in anime)
+    results = {"store_payloads_s": time.perf_counter() - start}
+    recommender = Recommender(db)
+    update = recommender.build()
+    results["build_s"] = update.elapsed
+    results["matrix_mb"] = os.path.getsize(recommender.path) / 2**20
+    recommender.close()
+    start = time.perf_counter()
+    matrix = FeatureMatrix(recommender.path)
+    results["load_ms"] = (time.perf_counter() - start) * 1000
+    results["features"], results["values"] = matrix.features, matrix.values
+    matrix.close()
+    rng = random.Random(0)
+    for anime_id, _ in rng.sample(anime, RECOMMEND_CHANGED_ANIME):
+        db.update_anime(anime_id, title=f"{rng.choice(TITLE_WORDS)} {rng.choice(TITLE_WORDS)}")
+    update = recommender.refresh()
+    results["refresh_ms"], results["refreshed_rows"] = update.elapsed * 1000, update.changed
+    latencies = []
+    for user_id in range(1, data.users + 1):
+        start = time.perf_counter()
+        recommender.recommend(user_id)
+        latencies.append(time.perf_counter() - start)
+    results["recommend_p50_ms"] = metrics.percentile(latencies, 50) * 1000
+    results["recommend_p95_ms"] = metrics.percentile(latencies, 95) * 1000
+    results["over_budget"] = int(results["recommend_p95_ms"] > RECOMMEND_BUDGET_MS)
+    recommender.close()
+    db.close()
+    return results
+
+def bench_query_plans(ops: int = 5000) -> dict:
+    """Check with EXPLAIN QUERY PLAN that every QUERY_PLAN_CHECKS query searches an index on an ops-anime database.
+
+    Each query reports 1 when its plan searches an index and 0 when it scans a table; over_budget counts the
+    scanning queries (and the run exits with status 1 when there is any).
+    """
+    db = Database(_temp_db_path())
+    db.init_db()
+    datagen.populate(db, anime=ops, users=100, watchlist_per_user=10)
+    with db.transaction() as cursor:
+        cursor.execute("ANALYZE")
+    results = {}
+    for name, (sql, params) in QUERY_PLAN_CHECKS.items():
+        with db.transaction() as cursor:
+            plan = [row[-1] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        results[f"{name}_uses_index"] = int(any(step.startswith("SEARCH") for step in plan)
+                                            and not any(step.startswith("SCAN") for step in plan))
+        if not results[f"{name}_uses_index"]:
+            console.print(f"[red]{name} does not use an index: {'; '.join(plan)}[/red]")
+    results["over_budget"] = sum(1 for value in results.values() if not value)
+    db.close()
+    return results
+
+SCENARIOS = {
+    "db-pool": bench_db_pool,
+    "db-batch": bench_db_batch,
+    "query-plans": bench_query_plans,
+    "ingest": bench_ingest,
+    "api-fetch": bench_api_fetch,
+    "api-cache": bench_api_cache,
+    "notify": bench_notify,
+    "search": bench_search,
+    "refresh": bench_refresh,
+    "replay": bench_replay,
+    "season-sync": bench_season_sync,
+    "sweep": bench_sweep,
+    "daemon": bench_daemon,
+    "fanout": bench_fanout,
+    "watchlist": bench_watchlist,
+    "watching-stats": bench_watching_stats,
+    "recommend": bench_recommend,
+    "shards": bench_shards,
+    "catalog-cache": bench_catalog_cache,
+    "raw-store": bench_raw_store,
+    "startup": bench_startup,
+    "metrics": bench_metrics,
+}
+
+# ----------------------------------------------------------------------
+# If file ran directly, run the selected benchmark
+# ----------------------------------------------------------------------
+
+def _run_metadata() -> dict:
+    """Describe the code and machine a run was made on, stored next to its results."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(CLI_PATH),
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "commit": commit, "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version, "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "stub_latency": STUB_LATENCY, "stub_throttle_rate": STUB_THROTTLE_RATE}
+
+def _latest_records(path: str) -> dict:
+    """Return {scenario: last record} from a JSON-lines results file."""
+    latest = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                latest[record["scenario"]] = record
+    return latest
+
+@click.command()
+@click.option('--scenario', '-s', 'scenarios', type=click.Choice(sorted(SCENARIOS)), multiple=True,
+              help='Benchmark scenario to run (repeatable; default: db-pool)')
+@click.option('--ops', type=int, default=None, help="Number of operations per measurement (default: the scenario's own)")
+@click.option('--stub-latency', type=float, default=STUB_LATENCY, show_default=True, help='Seconds the stub Jikan waits per request')
+@click.option('--stub-throttle-rate', type=float, default=STUB_THROTTLE_RATE, show_default=True,
+              help='Share of stub Jikan requests answered with 429')
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help='Append one JSON record per scenario to this file')
+@click.option('--compare', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Show the change against the latest record of each scenario in this JSON-lines file')
+@click.option('--json', 'as_json', is_flag=True, help='Print the JSON records instead of tables')
+def main(scenarios, ops, stub_latency, stub_throttle_rate, output, compare, as_json):
+    """Run benchmark scenarios and print their results."""
+    global STUB_LATENCY, STUB_THROTTLE_RATE
+    STUB_LATENCY, STUB_THROTTLE_RATE = stub_latency, stub_throttle_rate
+    baseline = _latest_records(compare) if compare else {}
+    over_budget = []
+    for scenario in scenarios or ("db-pool",):
+        # Keep stdout machine-readable in --json mode: scenario chatter goes to stderr
+        with contextlib.redirect_stdout(sys.stderr) if as_json else contextlib.nullcontext():
+            results = SCENARIOS[scenario](ops) if ops is not None else SCENARIOS[scenario]()
+        record = {"scenario": scenario, "ops": ops, **_run_metadata(), "results": results}
+        if results.get("over_budget"):
+            over_budget.append(scenario)
+        if output:
+            with open(output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+        if as_json:
+            click.echo(json.dumps(record))
+            continue
+        previous = baseline.get(scenario, {}).get("results", {})
+        table = Table(title=f"Benchmark: {scenario}")
+        table.add_column("Metric")
+        table.add_column("Value", justify="right")
+        if previous:
+            table.add_column(f"Baseline ({baseline[scenario]['commit'] or baseline[scenario]['timestamp']})", justify="right")
+            table.add_column("Change", justify="right")
+        for key, value in results.items():
+            row = [key, f"{value:,.1f}"]
+            if previous:
+                before = previous.get(key)
+                row.append("" if before is None else f"{before:,.1f}")
+                row.append(f"{(value - before) / before:+.1%}" if before else "")
+            table.add_row(*row)
+        console.print(table)
+    if over_budget:
+        # A failing status lets CI and pre-commit hooks catch the regression, not only the printed table
+        click.echo(f"Over budget: {', '.join(over_budget)}", err=True)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
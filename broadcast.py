@@ -0,0 +1,157 @@
+# ======================================================================
+# File: broadcast.py
+# Description: This file contains helpers to parse Jikan broadcast strings
+# (e.g. "Saturdays at 23:00 (JST)") and compute episode air times.
+# ======================================================================
+
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+WEEK = timedelta(days=7)
+
+# Weekday names as used by Jikan ("Mondays", "Tuesdays", ...), singular form
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+# UTC offsets (in minutes) of the timezones Jikan uses in broadcast strings
+TIMEZONE_OFFSETS = {
+    "JST": 9 * 60,
+    "KST": 9 * 60,
+    "CST": 8 * 60,
+    "UTC": 0,
+    "GMT": 0,
+    "Asia/Tokyo": 9 * 60,
+}
+
+# Format used for release_date values: UTC, lexically sortable, same as SQLite's CURRENT_TIMESTAMP
+RELEASE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+BROADCAST_PATTERN = re.compile(r"^\s*([A-Za-z]+?)s?\s+at\s+(\d{1,2}):(\d{2})\s*\(([^)]+)\)", re.IGNORECASE)
+
+# A parsed weekly broadcast slot; utc_offset is in minutes
+Broadcast = namedtuple("Broadcast", ["weekday", "hour", "minute", "timezone", "utc_offset"])
+
+# ----------------------------------------------------------------------
+# Parsing
+# ----------------------------------------------------------------------
+
+def parse_broadcast(text: str):
+    """Parse a broadcast string like "Saturdays at 23:00 (JST)". Returns a Broadcast or None if it is unusable."""
+    if not text:
+        return None
+    match = BROADCAST_PATTERN.match(text)
+    if not match:
+        return None
+    day, hour, minute, zone = match.groups()
+    day = day.lower()
+    if day not in WEEKDAYS or zone not in TIMEZONE_OFFSETS:
+        return None
+    hour, minute = int(hour), int(minute)
+    if hour > 23 or minute > 59:
+        return None
+    return Broadcast(WEEKDAYS.index(day), hour, minute, zone, TIMEZONE_OFFSETS[zone])
+
+def parse_aired(text: str):
+    """Parse a Jikan aired date ("2024-04-06T00:00:00+00:00"). Returns a date or None."""
+    if not text:
+        return None
+    try:
+        return datetime.fromisoformat(text).date()
+    except ValueError:
+        return None
+
+def format_release_date(moment: datetime) -> str:
+    """Format an aware datetime as a UTC release_date string."""
+    return moment.astimezone(timezone.utc).strftime(RELEASE_DATE_FORMAT)
+
+def parse_release_date(text: str) -> datetime:
+    """Parse a release_date string back into an aware UTC datetime."""
+    return datetime.strptime(text, RELEASE_DATE_FORMAT).replace(tzinfo=timezone.utc)
+
+# ----------------------------------------------------------------------
+# Air Time Computation
+# ----------------------------------------------------------------------
+
+def first_air_time(broadcast: Broadcast, aired_from) -> datetime:
+    """Return the first broadcast slot on or after the premiere date, as an aware UTC datetime.
+
+    Jikan premiere dates are calendar dates in the broadcast's local time, so the
+    slot is placed on that local date (moved forward to the broadcast weekday).
+    """
+    local_tz = timezone(timedelta(minutes=broadcast.utc_offset))
+    days_ahead = (broadcast.weekday - aired_from.weekday()) % 7
+    local_day = aired_from + timedelta(days=days_ahead)
+    local = datetime(local_day.year, local_day.month, local_day.day, broadcast.hour, broadcast.minute, tzinfo=local_tz)
+    return local.astimezone(timezone.utc)
+
+def episode_air_time(broadcast: Broadcast, aired_from, number: int) -> datetime:
+    """Return the air time of episode `number`, assuming weekly episodes from the premiere slot."""
+    return first_air_time(broadcast, aired_from) + (number - 1) * WEEK
+
+def next_episode(broadcast: Broadcast, aired_from, episodes, after: datetime):
+    """Return (episode_number, air_time) of the first episode airing strictly after `after`.
+
+    Episodes are assumed to air weekly from the premiere slot. Returns None
+    once the known episode count has been exhausted.
+    """
+    first = first_air_time(broadcast, aired_from)
+    if after < first:
+        number = 1
+    else:
+        number = (after - first) // WEEK + 2
+    if episodes and number > episodes:
+        return None
+    return number, first + (number - 1) * WEEK
+
+# ----------------------------------------------------------------------
+# Structured Broadcast Columns
+# ----------------------------------------------------------------------
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+
+# Columns of the anime table derived from the broadcast string at ingest
+BROADCAST_COLUMNS = ("broadcast_day", "broadcast_time", "broadcast_timezone", "broadcast_utc_offset", "broadcast_utc_minute")
+
+def utc_minute_of_week(broadcast: Broadcast) -> int:
+    """Return the broadcast slot as minutes since Monday 00:00 UTC (0 to MINUTES_PER_WEEK - 1)."""
+    local = broadcast.weekday * 1440 + broadcast.hour * 60 + broadcast.minute
+    return (local - broadcast.utc_offset) % MINUTES_PER_WEEK
+
+def minute_of_week(moment: datetime) -> int:
+    """Return an aware datetime as minutes since Monday 00:00 UTC."""
+    moment = moment.astimezone(timezone.utc)
+    return moment.weekday() * 1440 + moment.hour * 60 + moment.minute
+
+def broadcast_columns(text: str) -> tuple:
+    """Parse a broadcast string into values for BROADCAST_COLUMNS (all None if it cannot be parsed)."""
+    broadcast = parse_broadcast(text)
+    if broadcast is None:
+        return (None,) * len(BROADCAST_COLUMNS)
+    return (broadcast.weekday, f"{broadcast.hour:02d}:{broadcast.minute:02d}", broadcast.timezone,
+            broadcast.utc_offset, utc_minute_of_week(broadcast))
+
+def broadcast_from_columns(day, time_text, zone, utc_offset):
+    """Rebuild a Broadcast from stored columns. Returns None if the anime has no parsed slot."""
+    if day is None or not time_text or utc_offset is None:
+        return None
+    hour, minute = map(int, time_text.split(":"))
+    return Broadcast(day, hour, minute, zone, utc_offset)
+
+def next_air_times(slots, now: datetime, count: int = 1) -> dict:
+    """Compute the next `count` weekly air times for many shows in one pass.
+
+    slots is an iterable of (key, broadcast_utc_minute) pairs; returns
+    key -> list of aware UTC datetimes. The week origin is computed once and
+    every show is a single modular offset from it.
+    """
+    now = now.astimezone(timezone.utc).replace(second=0, microsecond=0)
+    now_minute = minute_of_week(now)
+    offsets = [timedelta(weeks=week) for week in range(count)]
+    result = {}
+    for key, slot in slots:
+        if slot is None:
+            continue
+        # Strictly after now: a slot equal to the current minute is a week away
+        first = now + timedelta(minutes=(slot - now_minute - 1) % MINUTES_PER_WEEK + 1)
+        result[key] = [first + offset for offset in offsets]
+    return result
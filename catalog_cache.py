@@ -0,0 +1,396 @@
+# ======================================================================
+# File: catalog_cache.py
+# Description: This file contains the optional in-process read cache of the
+# anime catalog and of the upcoming (unannounced) releases.
+#
+# How the cache works:
+#
+# - The catalog is loaded once into a column-oriented snapshot: one typed
+#   array per numeric column and one list per text column, in id order.
+#   Broadcast and status strings are shared between rows. Lookups by id
+#   binary-search the id array; lookups by mal_id and by weekly air slot go
+#   through sorted (key, row) index arrays. A row only becomes an
+#   AnimeRecord (a __slots__ object) when a lookup returns it.
+# - Unannounced releases are kept in arrays sorted by release time; rows
+#   whose release_date cannot be read are left out and counted.
+# - The cache registers a write listener on its Database. Anime rows written
+#   through the Database methods are re-read and patched into the snapshot
+#   on the next lookup; batch inserts, large batches and release writes mark
+#   that part of the cache stale and it is reloaded instead.
+# - Commits made by other connections (another process, or another thread's
+#   connection) are noticed through PRAGMA data_version, checked at most once
+#   per CHANGE_CHECK_INTERVAL, and reload the cache.
+# ======================================================================
+
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+import click
+from rich.console import Console
+from broadcast import MINUTES_PER_WEEK, minute_of_week, parse_release_date
+from db import Database
+import metrics
+
+console = Console()
+
+# Seconds between PRAGMA data_version checks for commits made by other connections
+CHANGE_CHECK_INTERVAL = 1.0
+
+# Largest number of written anime patched into the snapshot; more pending rows reload it
+PATCH_LIMIT = 256
+
+# Status of the anime kept in the air-slot index
+AIRING_STATUS = "Currently Airing"
+
+# Stored in the integer columns for NULL, and in the status column for deleted rows
+MISSING = -1
+DELETED = -2
+
+# Anime columns held by the snapshot, in AnimeRecord order
+SNAPSHOT_COLUMNS = ("id", "mal_id", "title", "episodes", "status", "broadcast", "broadcast_utc_minute")
+
+# ----------------------------------------------------------------------
+# Snapshot
+# ----------------------------------------------------------------------
+
+class AnimeRecord:
+    """A cached anime (see SNAPSHOT_COLUMNS), built on demand from the snapshot columns."""
+    __slots__ = SNAPSHOT_COLUMNS
+
+    def __init__(self, id, mal_id, title, episodes, status, broadcast, broadcast_utc_minute):
+        self.id = id
+        self.mal_id = mal_id
+        self.title = title
+        self.episodes = episodes
+        self.status = status
+        self.broadcast = broadcast
+        self.broadcast_utc_minute = broadcast_utc_minute
+
+    def __repr__(self):
+        return f"AnimeRecord(id={self.id}, mal_id={self.mal_id}, title={self.title!r}, status={self.status!r})"
+
+def _stored(value) -> int:
+    return MISSING if value is None else value
+
+def _loaded(value):
+    return None if value == MISSING else value
+
+def _index_add(keys, rows, key, row):
+    position = bisect_right(keys, key)
+    keys.insert(position, key)
+    rows.insert(position, row)
+
+def _index_remove(keys, rows, key, row):
+    position = bisect_left(keys, key)
+    while position < len(keys) and keys[position] == key:
+        if rows[position] == row:
+            del keys[position]
+            del rows[position]
+            return
+        position += 1
+
+class CatalogSnapshot:
+    """Column arrays of the anime catalog in id order, with mal_id and air-slot indexes."""
+    def __init__(self, rows=()):
+        self.ids = array("q")
+        self.mal_ids = array("q")
+        self.episodes = array("i")
+        self.statuses = array("h")     # index into status_names, MISSING or DELETED
+        self.slots = array("h")        # broadcast_utc_minute
+        self.titles = []
+        self.broadcasts = []
+        self.status_names = []
+        self._status_codes = {}
+        self._shared = {}              # one string object per distinct broadcast
+        for row in rows:
+            self._append(row)
+        live = [row for row in range(len(self.ids)) if self.statuses[row] != DELETED]
+        by_mal_id = sorted(live, key=self.mal_ids.__getitem__)
+        self.mal_keys = array("q", (self.mal_ids[row] for row in by_mal_id))
+        self.mal_rows = array("i", by_mal_id)
+        by_slot = sorted((row for row in live if self._airs(row)), key=self.slots.__getitem__)
+        self.slot_keys = array("h", (self.slots[row] for row in by_slot))
+        self.slot_rows = array("i", by_slot)
+
+    def __len__(self):
+        return len(self.mal_keys)
+
+    def _status_code(self, status) -> int:
+        if status is None:
+            return MISSING
+        code = self._status_codes.get(status)
+        if code is None:
+            code = self._status_codes[status] = len(self.status_names)
+            self.status_names.append(status)
+        return code
+
+    def _append(self, values):
+        self.ids.append(values[0])
+        self.mal_ids.append(values[1])
+        self.titles.append(values[2])
+        self.episodes.append(_stored(values[3]))
+        self.statuses.append(self._status_code(values[4]))
+        self.broadcasts.append(self._shared.setdefault(values[5], values[5]))
+        self.slots.append(_stored(values[6]))
+
+    def _set(self, row, values):
+        self.mal_ids[row] = values[1]
+        self.titles[row] = values[2]
+        self.episodes[row] = _stored(values[3])
+        self.statuses[row] = self._status_code(values[4])
+        self.broadcasts[row] = self._shared.setdefault(values[5], values[5])
+        self.slots[row] = _stored(values[6])
+
+    def _airs(self, row) -> bool:
+        code = self.statuses[row]
+        return code >= 0 and self.status_names[code] == AIRING_STATUS and self.slots[row] != MISSING
+
+    def _index(self, row):
+        _index_add(self.mal_keys, self.mal_rows, self.mal_ids[row], row)
+        if self._airs(row):
+            _index_add(self.slot_keys, self.slot_rows, self.slots[row], row)
+
+    def _unindex(self, row):
+        _index_remove(self.mal_keys, self.mal_rows, self.mal_ids[row], row)
+        if self._airs(row):
+            _index_remove(self.slot_keys, self.slot_rows, self.slots[row], row)
+
+    def _position(self, anime_id):
+        """Row of anime_id in the columns (deleted rows included), or None."""
+        position = bisect_left(self.ids, anime_id)
+        if position < len(self.ids) and self.ids[position] == anime_id:
+            return position
+        return None
+
+    def row_of(self, anime_id):
+        row = self._position(anime_id)
+        return None if row is None or self.statuses[row] == DELETED else row
+
+    def row_of_mal_id(self, mal_id):
+        position = bisect_left(self.mal_keys, mal_id)
+        if position < len(self.mal_keys) and self.mal_keys[position] == mal_id:
+            return self.mal_rows[position]
+        return None
+
+    def rows_in_slots(self, first: int, last: int):
+        """Rows of the airing anime whose broadcast_utc_minute is between first and last, in slot order."""
+        return self.slot_rows[bisect_left(self.slot_keys, first):bisect_right(self.slot_keys, last)]
+
+    def record(self, row) -> AnimeRecord:
+        code = self.statuses[row]
+        return AnimeRecord(self.ids[row], self.mal_ids[row], self.titles[row], _loaded(self.episodes[row]),
+                           self.status_names[code] if code >= 0 else None, self.broadcasts[row], _loaded(self.slots[row]))
+
+    def put(self, values) -> bool:
+        """Insert or replace one row given in SNAPSHOT_COLUMNS order. Returns False if it cannot be
+        patched in (an id below the highest cached one that is not cached yet)."""
+        row = self._position(values[0])
+        if row is None:
+            if self.ids and values[0] < self.ids[-1]:
+                return False
+            row = len(self.ids)
+            self._append(values)
+        else:
+            if self.statuses[row] != DELETED:
+                self._unindex(row)
+            self._set(row, values)
+        self._index(row)
+        return True
+
+    def delete(self, anime_id):
+        row = self.row_of(anime_id)
+        if row is not None:
+            self._unindex(row)
+            self.statuses[row] = DELETED
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by the snapshot: arrays, lists and the strings they reference."""
+        arrays = (self.ids, self.mal_ids, self.episodes, self.statuses, self.slots,
+                  self.mal_keys, self.mal_rows, self.slot_keys, self.slot_rows)
+        total = sum(sys.getsizeof(column) for column in arrays)
+        total += sys.getsizeof(self.titles) + sys.getsizeof(self.broadcasts)
+        total += sum(sys.getsizeof(title) for title in self.titles if title is not None)
+        total += sum(sys.getsizeof(text) for text in self.status_names + list(self._shared) if text is not None)
+        return total
+
+# ----------------------------------------------------------------------
+# Cache
+# ----------------------------------------------------------------------
+
+class CatalogCache:
+    """Read cache of the anime catalog and upcoming releases, kept in step with a Database's writes."""
+    def __init__(self, db: Database = None, clock=time.monotonic):
+        self.db = db or Database()
+        self.clock = clock
+        self._lock = threading.RLock()
+        self._anime = None        # CatalogSnapshot, None until loaded or when stale
+        self._releases = None     # (release times, anime ids, episodes) arrays, None until loaded or when stale
+        self._pending = set()     # anime ids written since the last lookup
+        self._versions = {}       # connection -> PRAGMA data_version when last checked
+        self._checked_at = None
+        self.loads = 0
+        self.patched = 0
+        self.db.add_write_listener(self._on_write)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop following the Database's writes."""
+        self.db.remove_write_listener(self._on_write)
+
+    def invalidate(self):
+        """Drop everything; the next lookup reloads from the database."""
+        with self._lock:
+            self._anime = None
+            self._releases = None
+            self._pending.clear()
+
+    def _on_write(self, table, ids):
+        with self._lock:
+            if table == "releases":
+                self._releases = None
+            elif table == "anime" and self._anime is not None:
+                if ids is None or len(self._pending) + len(ids) > PATCH_LIMIT:
+                    self._anime = None
+                    self._pending.clear()
+                else:
+                    self._pending.update(ids)
+
+    def _check_other_writers(self):
+        now = self.clock()
+        if self._checked_at is not None and now - self._checked_at < CHANGE_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        conn = self.db._connect()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if self._versions.get(conn, version) != version:
+            self.invalidate()
+        self._versions[conn] = version
+
+    def _load_anime(self) -> CatalogSnapshot:
+        with self.db.transaction() as cursor:
+            cursor.execute(f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM anime ORDER BY id")
+            snapshot = CatalogSnapshot(cursor)
+        self.loads += 1
+        return snapshot
+
+    def _patch(self, snapshot: CatalogSnapshot) -> CatalogSnapshot:
+        ids = list(self._pending)
+        self._pending.clear()
+        with self.db.transaction() as cursor:
+            cursor.execute(f"SELECT {', '.join(SNAPSHOT_COLUMNS)} FROM anime WHERE id IN ({','.join('?' * len(ids))})", ids)
+            rows = cursor.fetchall()
+        for row in rows:
+            if not snapshot.put(row):
+                return self._load_anime()
+        for anime_id in set(ids).difference(row[0] for row in rows):
+            snapshot.delete(anime_id)
+        self.patched += len(ids)
+        return snapshot
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Return the current anime snapshot, loading or patching it first if needed."""
+        self._check_other_writers()
+        snapshot = self._anime
+        if snapshot is not None and not self._pending:
+            return snapshot
+        with self._lock:
+            if self._anime is None:
+                self._pending.clear()
+                self._anime = self._load_anime()
+            elif self._pending:
+                self._anime = self._patch(self._anime)
+            return self._anime
+
+    def _release_arrays(self):
+        self._check_other_writers()
+        releases = self._releases
+        if releases is not None:
+            return releases
+        with self._lock:
+            if self._releases is None:
+                times, anime_ids, episodes = array("d"), array("q"), array("i")
+                with self.db.transaction() as cursor:
+                    cursor.execute("SELECT anime_id, episode_number, release_date FROM releases "
+                                   "WHERE announced_on IS NULL ORDER BY release_date, anime_id")
+                    for anime_id, episode, release_date in cursor:
+                        try:
+                            air_time = parse_release_date(release_date)
+                        except (TypeError, ValueError):
+                            metrics.increment("catalog_cache.unreadable_dates")
+                            continue
+                        times.append(air_time.timestamp())
+                        anime_ids.append(anime_id)
+                        episodes.append(episode)
+                self._releases = (times, anime_ids, episodes)
+            return self._releases
+
+    # -----------------------
+    # Lookups
+    # -----------------------
+    def get_anime(self, anime_id):
+        """Return the AnimeRecord with this id, or None."""
+        snapshot = self.snapshot()
+        row = snapshot.row_of(anime_id)
+        return None if row is None else snapshot.record(row)
+
+    def get_anime_by_mal_id(self, mal_id):
+        """Return the AnimeRecord with this MAL id, or None."""
+        snapshot = self.snapshot()
+        row = snapshot.row_of_mal_id(mal_id)
+        return None if row is None else snapshot.record(row)
+
+    def get_anime_airing_within(self, start: datetime, hours: float = 24) -> list:
+        """Same result as Database.get_anime_airing_within: (id, title, broadcast_utc_minute) of airing anime
+        whose weekly slot falls in the next `hours` after the aware datetime `start`."""
+        snapshot = self.snapshot()
+        first = minute_of_week(start)
+        last = first + int(hours * 60)
+        if hours * 60 >= MINUTES_PER_WEEK:
+            ranges = ((0, MINUTES_PER_WEEK - 1),)
+        elif last < MINUTES_PER_WEEK:
+            ranges = ((first, last),)
+        else:
+            ranges = ((first, MINUTES_PER_WEEK - 1), (0, last - MINUTES_PER_WEEK))
+        return [(snapshot.ids[row], snapshot.titles[row], snapshot.slots[row])
+                for low, high in ranges for row in snapshot.rows_in_slots(low, high)]
+
+    def upcoming_releases(self, after: datetime, limit: int = None) -> list:
+        """Return (anime_id, episode_number, aware UTC release datetime) of unannounced releases after the aware
+        datetime `after`, soonest first."""
+        times, anime_ids, episodes = self._release_arrays()
+        start = bisect_right(times, after.timestamp())
+        stop = len(times) if limit is None else min(len(times), start + limit)
+        return [(anime_ids[i], episodes[i], datetime.fromtimestamp(times[i], timezone.utc)) for i in range(start, stop)]
+
+    def memory_bytes(self) -> int:
+        """Approximate bytes held by the loaded parts of the cache."""
+        total = self._anime.memory_bytes() if self._anime is not None else 0
+        if self._releases is not None:
+            total += sum(sys.getsizeof(column) for column in self._releases)
+        return total
+
+# ----------------------------------------------------------------------
+# If file ran directly, load the cache and report its size
+# ----------------------------------------------------------------------
+
+@click.command()
+def main():
+    """Load the catalog cache from the database and print its size."""
+    cache = CatalogCache()
+    start = time.perf_counter()
+    snapshot = cache.snapshot()
+    elapsed = time.perf_counter() - start
+    console.print(f"[green]Cached {len(snapshot)} anime in {elapsed * 1000:.1f} ms "
+                  f"({cache.memory_bytes() / 1024:.1f} KiB).[/green]")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,90 @@
 # ======================================================================
 # File: cli.py
 # Description: This file contains the CLI for the anime watchlist.
+#
+# Start-up is kept short for scripts calling the CLI many times: only
+# modules that are cheap to import are loaded up front (requests, asyncio
+# and rich load on first use, see lazy.py), the release checker, the
+# notification backends, the importer and the daemon are imported by the
+# commands that need them, and `--batch` runs many commands read from
+# stdin in a single process.
 # ======================================================================
 
+import base64
+import json
+import os
+import shlex
+import sqlite3
+import sys
+import time
+from datetime import timedelta
 import click
-from rich.console import Console
-from rich.table import Table
-from db import Database
-from api_requests import get_full_anime_info, parse_anime_info
+from db import WATCHLIST_PAGE_SIZE, WATCHLIST_SORTS, Database
+from anime_raw import RawPayloadStore
+from api_requests import get_full_anime_info, parse_anime_info, get_cache
+from exporter import EXPORT_FORMATS, export
+from lazy import DeferredConsole
+import metrics
+from search import SEARCH_LIMIT, search
+from recommend import RECOMMEND_LIMIT, Recommender
+from refresh import AnimeRefresher, REFRESH_BATCH_SIZE
+from season_sync import SeasonSync
+from watching_stats import WEEKDAYS, StatsEngine
 
-console = Console()
+console = DeferredConsole()
 
-@click.group()
-def cli():
+# Set once the schema has been checked, so batch commands do not check it again
+_schema_checked = False
+
+# Commands that do not read the catalog database (or manage its schema themselves), so they must not create or
+# upgrade it
+SCHEMA_CHECK_EXEMPT = ("init-db", "migrate", "api-cache", "jikan-mirror", "stats")
+
+def _table(*args, **kwargs):
+    """Build a rich Table, importing rich.table on first use."""
+    from rich.table import Table
+    return Table(*args, **kwargs)
+
+@click.group(invoke_without_command=True)
+@click.option('--batch', is_flag=True, help='Run the commands read from stdin (one per line) in this process')
+@click.pass_context
+def cli(ctx, batch):
     """Anime Watchlist CLI - Track your favorite anime and get notifications for new episodes!"""
-    pass
+    global _schema_checked
+    if not _schema_checked and ctx.invoked_subcommand not in (None, *SCHEMA_CHECK_EXEMPT):
+        Database().upgrade_if_needed()
+        _schema_checked = True
+    if batch:
+        if ctx.invoked_subcommand is not None:
+            raise click.UsageError("--batch reads its commands from stdin; do not pass a command as well")
+        ctx.exit(1 if run_batch(sys.stdin) else 0)
+    elif ctx.invoked_subcommand is None:
+        click.echo(ctx.get_help())
+
+def run_batch(lines) -> int:
+    """Run every line as a CLI command line, all in this process. Returns the number of commands that failed.
+
+    Empty lines and lines starting with # are skipped. The input is read in
+    full first, so a command that would prompt for a missing option fails
+    instead of consuming the next lines.
+    """
+    commands = [(number, line.strip()) for number, line in enumerate(lines, 1)]
+    failed = 0
+    for number, line in commands:
+        if not line or line.startswith('#'):
+            continue
+        try:
+            cli.main(shlex.split(line), prog_name="cli.py", standalone_mode=False)
+        except click.ClickException as e:
+            failed += 1
+            click.echo(f"line {number}: {e.format_message()}", err=True)
+        except click.Abort:
+            failed += 1
+            click.echo(f"line {number}: aborted (batch commands cannot prompt; pass every option)", err=True)
+        except Exception as e:
+            failed += 1
+            click.echo(f"line {number}: {type(e).__name__}: {e}", err=True)
+    return failed
 
 # -------------------------
 # Interactive Mode
@@ -24,7 +94,7 @@ def interactive():
     """Start interactive mode with guided prompts."""
     while True:
         console.print("\n[bold cyan]What would you like to do?[/bold cyan]")
-        table = Table(show_header=False, box=None)
+        table = _table(show_header=False, box=None)
         table.add_row("[1] Initialize database")
         table.add_row("[2] Manage users")
         table.add_row("[3] Manage anime")
@@ -54,7 +124,7 @@ def _handle_user_menu():
     """Handle user management menu."""
     while True:
         console.print("\n[bold cyan]User Management[/bold cyan]")
-        table = Table(show_header=False, box=None)
+        table = _table(show_header=False, box=None)
         table.add_row("[1] Add new user")
         table.add_row("[2] View user")
         table.add_row("[3] Update user")
@@ -86,7 +156,7 @@ def _handle_anime_menu():
     """Handle anime management menu."""
     while True:
         console.print("\n[bold cyan]Anime Management[/bold cyan]")
-        table = Table(show_header=False, box=None)
+        table = _table(show_header=False, box=None)
         table.add_row("[1] Add anime by MAL ID")
         table.add_row("[2] View anime")
         table.add_row("[3] Update anime")
@@ -112,6 +182,7 @@ def _handle_anime_menu():
                 if click.confirm("\nAdd this anime to database?"):
                     db = Database()
                     if db.create_anime(**parsed_info):
+                        RawPayloadStore(db).store_many([anime_info])
                         console.print("[green]Anime added successfully![/green]")
                         
                         # Prompt to add to watchlist
@@ -133,11 +204,36 @@ def _handle_anime_menu():
             except Exception as e:
                 console.print(f"[red]Error fetching anime info: {str(e)}[/red]")
 
+def _print_watchlist_page(page, title):
+    """Print the entries of a WatchlistPage as a table."""
+    table = _table(title=title)
+    for column in ("ID", "Anime ID", "Title", "Status", "Watched", "Unwatched", "Next episode (UTC)"):
+        table.add_column(column, justify="right" if column in ("ID", "Anime ID", "Unwatched") else "left")
+    for entry in page.entries:
+        total = entry.episodes if entry.episodes is not None else "?"
+        table.add_row(str(entry.id), str(entry.anime_id), entry.title, entry.status or "-",
+                      f"{entry.last_watched_episode or 0}/{entry.aired if entry.aired is not None else '?'}/{total}",
+                      str(entry.unwatched), entry.next_air[:16] if entry.next_air else "-")
+    console.print(table)
+
+def _encode_after(sort: str, after) -> str:
+    """Turn the keyset position of a WatchlistPage into an opaque --after token (valid for the same sort only)."""
+    return base64.urlsafe_b64encode(json.dumps([sort, *after]).encode()).decode()
+
+def _decode_after(token: str, sort: str):
+    try:
+        token_sort, key, entry_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (ValueError, TypeError):
+        raise click.BadParameter("not a token printed below a watchlist page", param_hint="--after")
+    if token_sort != sort:
+        raise click.BadParameter(f"this token continues a --sort {token_sort} listing", param_hint="--after")
+    return key, entry_id
+
 def _handle_watchlist_menu():
     """Handle watchlist management menu."""
     while True:
         console.print("\n[bold cyan]Watchlist Management[/bold cyan]")
-        table = Table(show_header=False, box=None)
+        table = _table(show_header=False, box=None)
         table.add_row("[1] Add anime to watchlist")
         table.add_row("[2] View watchlist")
         table.add_row("[3] Update watched episodes")
@@ -159,12 +255,29 @@ def _handle_watchlist_menu():
                 console.print("[green]Added to watchlist![/green]")
             else:
                 console.print("[red]Failed to add to watchlist.[/red]")
+        elif choice == '2':
+            user_id = click.prompt("Enter user ID", type=int)
+            sort = click.prompt("Sort by", type=click.Choice(sorted(WATCHLIST_SORTS)), default="next_air")
+            db = Database()
+            after = None
+            while True:
+                page = db.get_watchlist_page(user_id, sort, after)
+                if page is False:
+                    console.print("[red]Failed to load the watchlist.[/red]")
+                    break
+                if not page.entries and after is None:
+                    console.print("[yellow]This watchlist is empty.[/yellow]")
+                    break
+                _print_watchlist_page(page, f"Watchlist of user {user_id}")
+                if page.after is None or not click.confirm("Show the next page?", default=True):
+                    break
+                after = page.after
 
 def _handle_release_menu():
     """Handle release management menu."""
     while True:
         console.print("\n[bold cyan]Release Management[/bold cyan]")
-        table = Table(show_header=False, box=None)
+        table = _table(show_header=False, box=None)
         table.add_row("[1] Add new release")
         table.add_row("[2] View release")
         table.add_row("[3] Update release")
@@ -187,6 +300,368 @@ def init_db_command():
         db = Database()
         db.init_db()
 
+@cli.command('migrate')
+def migrate_command():
+    """Upgrade the database schema to the latest version."""
+    db = Database()
+    applied = db.migrate()
+    if applied:
+        console.print(f"[green]Applied migrations: {', '.join(map(str, applied))}[/green]")
+    else:
+        console.print(f"[yellow]Schema already at version {db.schema_version()}.[/yellow]")
+
+@cli.command('api-cache')
+@click.option('--clear', is_flag=True, help='Remove every cached response and reset the counters')
+def api_cache_command(clear):
+    """Show Jikan response cache statistics."""
+    cache = get_cache()
+    if cache is None:
+        console.print("[yellow]Response cache is disabled (JIKAN_CACHE=0).[/yellow]")
+        return
+    if clear:
+        cache.clear()
+        console.print("[green]Response cache cleared.[/green]")
+        return
+    table = _table(title="Jikan response cache")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    for key, value in cache.stats(lifetime=True).items():
+        table.add_row(key, f"{value:.1%}" if key == "hit_rate" else f"{value:,}")
+    console.print(table)
+
+@cli.command('jikan-mirror')
+@click.option('--load', 'logs', multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help='Bulk-load a recorded traffic log (JIKAN_RECORD output); repeatable')
+@click.option('--mirror', 'mirror_path', default=None, help='Mirror database file (default: jikan_mirror.db)')
+@click.option('--warm-cache', is_flag=True, help='Copy every mirrored answer into the Jikan response cache')
+def jikan_mirror_command(logs, mirror_path, warm_cache):
+    """Build the offline Jikan mirror from recorded traffic and show its contents."""
+    import replay
+    from api_requests import JIKAN_BASE_URL
+    mirror = replay.MirrorStore(mirror_path or replay.MIRROR_DB_NAME)
+    for log in logs:
+        console.print(f"[green]Loaded {mirror.load_log(log):,} recorded exchanges from {log}.[/green]")
+    if warm_cache:
+        cache = get_cache()
+        if cache is None:
+            console.print("[yellow]Response cache is disabled (JIKAN_CACHE=0).[/yellow]")
+        else:
+            console.print(f"[green]Stored {replay.warm_cache(mirror, cache, JIKAN_BASE_URL):,} responses in the cache.[/green]")
+    table = _table(title=f"Jikan mirror ({mirror.db_name})")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    for key, value in mirror.stats().items():
+        table.add_row(key, f"{value:,}")
+    console.print(table)
+    mirror.close()
+
+@cli.command('raw-store')
+@click.option('--add-field', nargs=2, metavar='NAME PATH', default=None,
+              help='Index a payload field from local data, e.g. --add-field score \'$.score\'')
+@click.option('--type', 'column_type', type=click.Choice(['INTEGER', 'REAL', 'TEXT']), default=None,
+              help='Column type of the added field')
+@click.option('--drop-field', metavar='NAME', default=None, help='Remove an indexed payload field')
+def raw_store_command(add_field, column_type, drop_field):
+    """Show the raw Jikan payload store and manage its indexed fields."""
+    store = RawPayloadStore(Database())
+    try:
+        if add_field:
+            start = time.perf_counter()
+            store.add_field(*add_field, column_type=column_type or "")
+            console.print(f"[green]Field {add_field[0]} indexed in {time.perf_counter() - start:.2f}s.[/green]")
+        if drop_field:
+            store.drop_field(drop_field)
+            console.print(f"[green]Field {drop_field} removed.[/green]")
+    except (ValueError, sqlite3.Error) as e:
+        console.print(f"[red]{e}[/red]")
+    table = _table(title="Raw payload store")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    for key, value in store.stats().items():
+        table.add_row(key, f"{value:.2f}" if key == "ratio" else f"{value:,}")
+    table.add_row("fields", ", ".join(f"{name} {declared}".strip() for name, declared in store.fields().items()) or "-")
+    console.print(table)
+
+@cli.command('stats')
+@click.option('--log', 'log_path', type=click.Path(dir_okay=False), default=None,
+              help='Metrics log to read (default: ANINOTIF_METRICS_LOG)')
+@click.option('--since', type=float, default=None, help='Only include metrics written in the last HOURS')
+def stats_command(log_path, since):
+    """Show latency percentiles and error counts collected by the metrics log."""
+    log_path = log_path or metrics.LOG_PATH
+    data = {"histograms": {}, "counters": {}}
+    if log_path and os.path.exists(log_path):
+        data = metrics.read_log(log_path, since=time.time() - since * 3600 if since is not None else None)
+    # Also include what this process measured so far (earlier commands of a --batch run)
+    current = metrics.snapshot()
+    for name, histogram in current["histograms"].items():
+        data["histograms"].setdefault(name, metrics.Histogram()).merge(histogram)
+    for name, count in current["counters"].items():
+        data["counters"][name] = data["counters"].get(name, 0) + count
+    if not data["histograms"] and not data["counters"]:
+        console.print("[yellow]No metrics collected yet; set ANINOTIF_METRICS_LOG to a file to record them.[/yellow]")
+        return
+
+    table = _table(title=f"Latency ({log_path or 'this process'})")
+    table.add_column("Operation")
+    for column in ("Count", "p50 ms", "p95 ms", "p99 ms", "Max ms", "Total s"):
+        table.add_column(column, justify="right")
+    for name, histogram in sorted(data["histograms"].items()):
+        table.add_row(name, f"{histogram.count:,}", *(f"{histogram.percentile(pct) * 1000:.2f}" for pct in (50, 95, 99)),
+                      f"{histogram.max * 1000:.2f}", f"{histogram.total:.2f}")
+    console.print(table)
+    if data["counters"]:
+        table = _table(title="Counters")
+        table.add_column("Counter")
+        table.add_column("Value", justify="right")
+        for name, count in sorted(data["counters"].items()):
+            table.add_row(f"[red]{name}[/red]" if name.startswith("errors.") else name, f"{count:,}")
+        console.print(table)
+
+@cli.command('check-releases')
+@click.option('--once', is_flag=True, help='Check once and exit instead of running continuously')
+@click.option('--simulate-from', type=click.DateTime(), default=None, help='Run on a simulated clock starting at this UTC time')
+@click.option('--simulate-hours', type=float, default=168.0, show_default=True, help='Simulated hours to run for')
+@click.option('--backend', type=click.Choice(['auto', 'macos', 'linux', 'stdout', 'webhook']), default='auto', help='Notification backend')
+@click.option('--webhook-url', default=None, help='URL for the webhook backend')
+@click.option('--notify', type=click.Choice(['watchers', 'all']), default='watchers', show_default=True,
+              help='Notify each user watching the show, or announce every release once')
+@click.option('--profile', type=click.Choice(['cprofile', 'sample']), default=None,
+              help='Profile every release cycle into ANINOTIF_PROFILE_DIR (overrides ANINOTIF_PROFILE)')
+def check_releases_command(once, simulate_from, simulate_hours, backend, webhook_url, notify, profile):
+    """Detect new episode releases of every airing anime and notify about them."""
+    from notifications import Outbox, NotificationWorker, get_backend
+    if profile:
+        metrics.PROFILE_MODE = profile
+    from releases_checker import ReleaseScheduler, SimulatedClock
+    db = Database()
+    outbox = Outbox(db)
+    worker = NotificationWorker(outbox, get_backend(backend, webhook_url))
+    clock = SimulatedClock(simulate_from) if simulate_from else None
+
+    def on_release(release):
+        if notify == 'all':
+            outbox.enqueue_release(release)
+
+    def on_batch(released):
+        # Every watcher of the whole cycle's releases is queued with one INSERT ... SELECT, as in the daemon
+        if notify == 'watchers':
+            outbox.fan_out(released)
+        worker.wake()
+
+    scheduler = ReleaseScheduler(db, clock=clock, on_release=on_release, on_batch=on_batch)
+    console.print(f"[cyan]Tracking {scheduler.load()} airing anime.[/cyan]")
+    if once:
+        released = scheduler.run_once()
+        worker.drain_once()
+        console.print(f"{len(released)} new release(s); next release at {scheduler.next_release_time() or 'n/a'}; "
+                      f"{len(scheduler.airing_within(24))} show(s) air in the next 24h")
+        return
+    worker.start()
+    try:
+        if clock is not None:
+            scheduler.run(until=clock.now() + timedelta(hours=simulate_hours))
+        else:
+            scheduler.run()
+    except KeyboardInterrupt:
+        console.print("[yellow]Release checker stopped.[/yellow]")
+    finally:
+        worker.stop()
+
+@cli.command('daemon')
+@click.option('--backend', type=click.Choice(['auto', 'macos', 'linux', 'stdout', 'webhook']), default='auto', help='Notification backend')
+@click.option('--webhook-url', default=None, help='URL for the webhook backend')
+@click.option('--no-refresh', is_flag=True, help='Do not refresh anime metadata from Jikan')
+@click.option('--pid-file', default=None, help='Lock file path (default: aninotif.pid next to the database)')
+@click.option('--notify', type=click.Choice(['watchers', 'all']), default='watchers', show_default=True,
+              help='Notify each user watching the show, or announce every release once')
+def daemon_command(backend, webhook_url, no_refresh, pid_file, notify):
+    """Run release checks, metadata refreshes and notifications in one long-running process."""
+    from daemon import Daemon, DaemonAlreadyRunning
+    from notifications import get_backend
+    daemon = Daemon(Database(), get_backend(backend, webhook_url), refresh=not no_refresh, pid_file=pid_file,
+                    fan_out=notify == 'watchers')
+    try:
+        stats = daemon.run(on_start=lambda: console.print(
+            f"[cyan]AniNotif daemon started (PID lock {daemon.pid_file}); press Ctrl+C to stop.[/cyan]"))
+    except DaemonAlreadyRunning as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    console.print(f"[yellow]Daemon stopped after {stats['uptime_sec']:.0f}s: {stats['releases']} release(s), "
+                  f"{stats['delivered']} notification(s) delivered, {stats['reloads']} reload(s), "
+                  f"first check {stats['startup_to_first_check_ms']:.1f} ms after start, "
+                  f"{stats['cpu_percent']:.2f}% CPU.[/yellow]")
+
+@cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user', 'mal_user_id', default=None, help='MAL username owning the list (required for CSV exports)')
+@click.option('--offline', is_flag=True, help='Do not query Jikan; create unknown anime from the export data only')
+@click.option('--restart', is_flag=True, help='Ignore the saved checkpoint and import from the beginning')
+def import_command(path, mal_user_id, offline, restart):
+    """Import a MAL list export (XML or CSV, optionally gzipped)."""
+    from mal_import import MalImporter
+    try:
+        report = MalImporter(Database(), offline=offline).run(path, mal_user_id=mal_user_id, restart=restart)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    except KeyboardInterrupt:
+        console.print("[yellow]Import interrupted; run the same command again to resume.[/yellow]")
+        return
+    if report.skipped:
+        console.print(f"[cyan]Resumed after {report.skipped} already imported entries.[/cyan]")
+    console.print(f"[green]Imported {report.records - report.skipped} entries in {report.elapsed:.1f}s "
+                  f"({report.rows_per_sec:,.0f} rows/s).[/green]")
+    console.print(f"Anime created: {report.anime_created} (fetched from Jikan: {report.anime_fetched}), "
+                  f"watchlist added: {report.watchlist_added}, updated: {report.watchlist_updated}, errors: {report.errors}")
+
+@cli.command('export')
+@click.argument('kind', type=click.Choice(sorted(EXPORT_FORMATS)))
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'jsonl', 'mal-xml', 'ical']), default='csv', help='Output format')
+@click.option('--user', 'mal_user_id', default=None, help='Only export this MAL user\'s data')
+@click.option('--incremental', is_flag=True, help='Only export rows changed since the previous export with the same options')
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Output file (default: stdout)')
+def export_command(kind, export_format, mal_user_id, incremental, output):
+    """Export watchlists or the release calendar."""
+    try:
+        count = export(Database(), kind, export_format, output, mal_user_id=mal_user_id, incremental=incremental)
+    except ValueError as e:
+        console.print(f"[red]{e}[/red]")
+        return
+    if output.name != '<stdout>':
+        console.print(f"[green]Exported {count} {kind} rows to {output.name}.[/green]")
+
+@cli.command('search')
+@click.argument('query', nargs=-1, required=True)
+@click.option('--limit', type=int, default=SEARCH_LIMIT, help='Maximum number of results')
+@click.option('--offline', is_flag=True, help='Only search the local catalog, never Jikan')
+def search_command(query, limit, offline):
+    """Search anime by title (local full-text index, then Jikan)."""
+    query = " ".join(query)
+    try:
+        results = search(Database(), query, limit=limit, online=not offline)
+    except Exception as e:
+        console.print(f"[red]Error searching Jikan: {str(e)}[/red]")
+        return
+    if not results:
+        console.print(f"[yellow]No anime found for \"{query}\".[/yellow]")
+        return
+    table = _table(title=f"Results for \"{query}\"")
+    for column in ("ID", "MAL ID", "Title", "Episodes", "Status"):
+        table.add_column(column)
+    for result in results:
+        table.add_row(str(result.anime_id), str(result.mal_id), result.title, str(result.episodes or "?"), result.status or "")
+    console.print(table)
+    if results[0].source == "fuzzy":
+        console.print("[cyan]No exact match; showing the closest titles.[/cyan]")
+    elif results[0].source == "jikan":
+        console.print("[cyan]Not in the local catalog; results fetched from Jikan and added to it.[/cyan]")
+
+@cli.command('refresh')
+@click.option('--limit', type=int, default=None, help='Refresh at most this many anime (default: everything due)')
+@click.option('--batch-size', type=int, default=REFRESH_BATCH_SIZE, help='Anime fetched per batch')
+def refresh_command(limit, batch_size):
+    """Refresh the metadata of anime that are due for a check."""
+    refresher = AnimeRefresher(Database())
+    due = refresher.count_due()
+    if not due:
+        console.print("[green]Every anime is up to date.[/green]")
+        return
+    console.print(f"[cyan]{due} anime due for a refresh.[/cyan]")
+    try:
+        report = refresher.refresh_due(batch_size=batch_size, max_rows=limit)
+    except KeyboardInterrupt:
+        console.print("[yellow]Refresh interrupted; completed batches were saved.[/yellow]")
+        return
+    console.print(f"[green]Checked {report.checked} anime in {report.elapsed:.1f}s ({report.requests} requests): "
+                  f"{report.changed} changed ({report.columns_written} columns written), {report.unchanged} unchanged.[/green]")
+    if report.errors:
+        console.print(f"[yellow]{report.errors} anime could not be fetched and will be retried later.[/yellow]")
+
+@cli.command('sync-season')
+@click.option('--no-schedules', is_flag=True, help='Only walk /seasons/now, not the weekly schedule listing')
+@click.option('--no-fallback', is_flag=True, help='Do not fetch titles one by one for fields the listings lack')
+def sync_season_command(no_schedules, no_fallback):
+    """Upsert every airing anime and its broadcast slot from Jikan's season listings."""
+    try:
+        report = SeasonSync(Database()).sync(schedules=not no_schedules, fallback=not no_fallback)
+    except Exception as e:
+        console.print(f"[red]Season sync failed: {str(e)}[/red]")
+        return
+    console.print(f"[green]Synced {report.listed} airing anime in {report.elapsed:.1f}s "
+                  f"({report.pages} listing pages, {report.full_fetches} full fetches): {report.inserted} added, "
+                  f"{report.updated} updated, {report.unchanged} unchanged.[/green]")
+    if report.failed:
+        console.print(f"[yellow]{report.failed} anime still lack a broadcast slot or air date; existing rows for them were left unchanged.[/yellow]")
+
+@cli.command('watchlist')
+@click.option('--user_id', type=int, prompt='Enter user ID', help='User ID')
+@click.option('--sort', type=click.Choice(sorted(WATCHLIST_SORTS)), default='next_air', show_default=True,
+              help='next_air: soonest episode first; backlog: most unwatched episodes first; title: alphabetical')
+@click.option('--limit', type=int, default=WATCHLIST_PAGE_SIZE, show_default=True, help='Entries per page')
+@click.option('--after', default=None, help='Token printed below the previous page, to show the next one')
+def watchlist_command(user_id, sort, limit, after):
+    """Show a user's watchlist with aired, unwatched and next episodes, one page at a time."""
+    page = Database().get_watchlist_page(user_id, sort, _decode_after(after, sort) if after else None, limit)
+    if page is False:
+        console.print("[red]Failed to load the watchlist.[/red]")
+        return
+    if not page.entries:
+        console.print("[yellow]No watchlist entries to show.[/yellow]")
+        return
+    _print_watchlist_page(page, f"Watchlist of user {user_id} (by {sort})")
+    if page.after is not None:
+        console.print(f"[cyan]Next page: --after {_encode_after(sort, page.after)}[/cyan]")
+
+@cli.command('watching-stats')
+@click.option('--user_id', type=int, default=None, help='Show one user instead of everyone')
+@click.option('--rebuild', is_flag=True, help='Recompute the statistics from the watchlists first')
+def watching_stats_command(user_id, rebuild):
+    """Show episodes watched, backlog, completion rate and airing days, from maintained aggregates."""
+    engine = StatsEngine(Database())
+    if rebuild:
+        report = engine.rebuild()
+        color = "yellow" if report.drifted else "green"
+        console.print(f"[{color}]Rebuilt statistics of {report.users:,} users in {report.elapsed:.2f}s; "
+                      f"{report.drifted:,} had drifted.[/{color}]")
+    summary = engine.user(user_id) if user_id is not None else engine.overall()
+    table = _table(title=f"Watching statistics of user {user_id}" if user_id is not None else "Watching statistics")
+    table.add_column("Metric")
+    table.add_column("Value", justify="right")
+    if user_id is None:
+        table.add_row("users", f"{summary.users:,}")
+    table.add_row("entries", f"{summary.entries:,}")
+    table.add_row("episodes watched", f"{summary.episodes_watched:,}")
+    table.add_row("backlog (episodes)", f"{summary.backlog:,}")
+    table.add_row("completed", f"{summary.completed:,} ({summary.completion_rate:.0%})")
+    for weekday, count in zip(WEEKDAYS, summary.airing_days):
+        table.add_row(f"airing on {weekday} (UTC)", f"{count:,}")
+    console.print(table)
+
+@cli.command('recommend')
+@click.option('--user_id', type=int, prompt='Enter user ID', help='User ID')
+@click.option('--limit', type=int, default=RECOMMEND_LIMIT, show_default=True, help='Recommendations to show')
+@click.option('--rebuild', is_flag=True, help='Rebuild the cached feature matrix from scratch first')
+def recommend_command(user_id, limit, rebuild):
+    """Recommend anime similar to a user's watchlist by genres, themes, studios and synopsis."""
+    recommender = Recommender(Database())
+    update = recommender.refresh(full=rebuild)
+    if update.changed:
+        console.print(f"[cyan]{'Built' if update.full else 'Updated'} the feature matrix: {update.changed:,} of "
+                      f"{update.rows:,} anime featurized in {update.elapsed:.2f}s.[/cyan]")
+    results = recommender.recommend(user_id, limit)
+    recommender.close()
+    if not results:
+        console.print("[yellow]No recommendations: the watchlist is empty or shares no feature with the catalog.[/yellow]")
+        return
+    table = _table(title=f"Recommendations for user {user_id}")
+    for column in ("ID", "MAL ID", "Title", "Score", "Because of"):
+        table.add_column(column)
+    for result in results:
+        table.add_row(str(result.anime_id), str(result.mal_id), result.title or "", f"{result.score:.2f}",
+                      ", ".join(reason.split(":", 1)[1] for reason in result.reasons))
+    console.print(table)
+
 @cli.command('add-anime')
 @click.option('--mal_id', type=int, prompt='Enter MAL ID', help='MAL ID for the anime')
 def add_anime_command(mal_id):
@@ -203,6 +678,7 @@ def add_anime_command(mal_id):
         if click.confirm("\nAdd this anime to database?"):
             db = Database()
             if db.create_anime(**parsed_info):
+                RawPayloadStore(db).store_many([anime_info])
                 console.print("[green]Anime added successfully![/green]")
                 
                 # Prompt to add to watchlist
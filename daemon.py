@@ -0,0 +1,252 @@
+# ======================================================================
+# File: daemon.py
+# Description: This file contains the long-running daemon that checks for
+# releases, refreshes anime metadata and sends notifications.
+#
+# How the daemon works:
+#
+# - A single asyncio event loop hosts four tasks: the release scheduler,
+#   the metadata refresher (Jikan fetcher), the notification sender and a
+#   change watcher. Database work stays on the loop's thread; only network
+#   and backend calls run in worker threads.
+# - The scheduler sleeps until the next episode airs. Released episodes are
+#   queued in the outbox and the sender is woken immediately.
+# - The watcher polls PRAGMA data_version, which changes only when another
+#   connection (e.g. a CLI command) commits. The schedule is then reloaded
+#   and the outbox drained, without restarting the daemon.
+# - A lock file (holding the PID) prevents two daemons from running against
+#   the same database. SIGINT/SIGTERM stop the tasks, deliver what is still
+#   queued and release the lock.
+# ======================================================================
+
+import asyncio
+import os
+import signal
+import time
+from db import Database
+from notifications import NotificationWorker, Outbox, default_backend
+from refresh import AnimeRefresher, REFRESH_BATCH_SIZE
+from releases_checker import RELOAD_INTERVAL, ReleaseScheduler
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to an exclusive create of the lock file
+    fcntl = None
+
+# Lock file created next to the database
+PID_FILE_NAME = "aninotif.pid"
+
+# Seconds between PRAGMA data_version checks
+DATA_VERSION_POLL = 1.0
+
+# Seconds between metadata refresh runs
+REFRESH_POLL = 15 * 60
+
+# Seconds between outbox checks when nothing woke the sender
+NOTIFY_POLL = 60.0
+
+class DaemonAlreadyRunning(RuntimeError):
+    """Raised when the lock file is held by another daemon."""
+
+# ----------------------------------------------------------------------
+# PID Lock
+# ----------------------------------------------------------------------
+
+class PidLock:
+    """Exclusive lock file holding the PID of the running daemon."""
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+
+    def acquire(self):
+        if fcntl is not None:
+            while True:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    os.close(fd)
+                    raise DaemonAlreadyRunning(f"Another daemon is running (PID {self.read_pid()}, lock {self.path})")
+                # A stopping daemon unlinks the file before unlocking it: a lock won on an unlinked file is void
+                try:
+                    if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                        break
+                except FileNotFoundError:
+                    pass
+                os.close(fd)
+        else:
+            try:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o644)
+            except FileExistsError:
+                raise DaemonAlreadyRunning(f"Another daemon is running (PID {self.read_pid()}, lock {self.path})")
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        os.fsync(fd)
+        self._fd = fd
+        return self
+
+    def read_pid(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    def release(self):
+        if self._fd is None:
+            return
+        # Unlink while still holding the lock, so no other daemon can lock this file and then lose its pid file
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+# ----------------------------------------------------------------------
+# Daemon
+# ----------------------------------------------------------------------
+
+def _ignore_release(release):
+    """on_release handler for fan-out mode: releases are queued in batches by the scheduler loop."""
+
+class Daemon:
+    """Release checker, metadata refresher and notification sender sharing one event loop."""
+    def __init__(self, db: Database = None, backend=None, refresh: bool = True, pid_file: str = None, fan_out: bool = True):
+        self.db = db or Database()
+        self.outbox = Outbox(self.db)
+        self.worker = NotificationWorker(self.outbox, backend or default_backend())
+        # With fan_out, released batches are queued per watcher after each check instead of once per release
+        self.fan_out = fan_out
+        self.scheduler = ReleaseScheduler(self.db, on_release=_ignore_release if fan_out else self.outbox.enqueue_release)
+        self.refresher = AnimeRefresher(self.db) if refresh else None
+        self.pid_file = pid_file or os.path.join(os.path.dirname(os.path.abspath(self.db.db_name)), PID_FILE_NAME)
+        self.releases = 0
+        self.reloads = 0
+        self.refreshed = 0
+        self.startup_to_first_check = None   # seconds from run() to the first completed release check
+        self._started = None
+        self._cpu_started = None
+        self._stop = None
+        self._reload = None
+        self._notify = None
+        self._refresh = None
+
+    def stop(self):
+        """Ask the running loop to shut down (safe to call from a signal handler)."""
+        if self._stop is not None:
+            for event in (self._stop, self._reload, self._notify, self._refresh):
+                event.set()
+
+    async def _wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """Sleep up to timeout seconds or until event is set. Returns True if the event woke us (and clears it)."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        event.clear()
+        return True
+
+    async def _scheduler_loop(self):
+        self.scheduler.load()
+        while not self._stop.is_set():
+            released = self.scheduler.run_once()
+            if self.startup_to_first_check is None:
+                self.startup_to_first_check = time.perf_counter() - self._started
+            if released:
+                self.releases += len(released)
+                if self.fan_out:
+                    self.outbox.fan_out(released)
+                self._notify.set()
+            wake_at = self.scheduler.next_release_time()
+            sleep_for = RELOAD_INTERVAL if wake_at is None else (wake_at - self.scheduler.clock.now()).total_seconds()
+            if await self._wait(self._reload, min(max(sleep_for, 0.0), RELOAD_INTERVAL)) and not self._stop.is_set():
+                self.reloads += 1
+                self.scheduler.load()
+
+    async def _refresh_loop(self):
+        while not self._stop.is_set():
+            report = await self.refresher.refresh_once_async(REFRESH_BATCH_SIZE)
+            self.refreshed += report.checked
+            if report.changed:
+                self._reload.set()
+            # Keep going while full batches are due, otherwise wait for the next refresh round
+            if report.checked + report.errors < REFRESH_BATCH_SIZE:
+                await self._wait(self._refresh, REFRESH_POLL)
+
+    async def _notify_loop(self):
+        while not self._stop.is_set():
+            await self.worker.drain_async()
+            await self._wait(self._notify, NOTIFY_POLL)
+
+    async def _watch_loop(self):
+        conn = self.db._connect()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        while not self._stop.is_set():
+            await asyncio.sleep(DATA_VERSION_POLL)
+            current = conn.execute("PRAGMA data_version").fetchone()[0]
+            if current != version:
+                version = current
+                self._reload.set()
+                self._notify.set()
+
+    async def run_async(self):
+        """Run every task until stop() is called or a task fails."""
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        self._stop, self._reload, self._notify, self._refresh = (asyncio.Event() for _ in range(4))
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass  # not supported on this platform/thread; KeyboardInterrupt still stops the loop
+        loops = [self._scheduler_loop(), self._notify_loop(), self._watch_loop()]
+        if self.refresher is not None:
+            loops.append(self._refresh_loop())
+        tasks = [asyncio.create_task(coroutine) for coroutine in loops]
+        stopper = asyncio.create_task(self._stop.wait())
+        try:
+            done, _ = await asyncio.wait(tasks + [stopper], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks + [stopper]:
+                task.cancel()
+            await asyncio.gather(*tasks, stopper, return_exceptions=True)
+        # Deliver what the last check queued before exiting
+        await self.worker.drain_async()
+        for task in done:
+            if task is not stopper and task.exception() is not None:
+                raise task.exception()
+
+    def run(self, on_start=None):
+        """Acquire the PID lock and run the event loop until interrupted. on_start() is called once the lock is held."""
+        with PidLock(self.pid_file):
+            if on_start is not None:
+                on_start()
+            try:
+                asyncio.run(self.run_async())
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.db.close()
+        return self.stats()
+
+    def stats(self) -> dict:
+        """Return uptime, startup latency, CPU usage and activity counters."""
+        uptime = time.perf_counter() - self._started if self._started else 0.0
+        cpu = time.process_time() - self._cpu_started if self._cpu_started is not None else 0.0
+        return {
+            "uptime_sec": uptime,
+            "startup_to_first_check_ms": (self.startup_to_first_check or 0.0) * 1000,
+            "cpu_percent": 100.0 * cpu / uptime if uptime else 0.0,
+            "releases": self.releases,
+            "reloads": self.reloads,
+            "refreshed": self.refreshed,
+            "delivered": self.worker.delivered,
+        }
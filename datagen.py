@@ -0,0 +1,179 @@
+# ======================================================================
+# File: datagen.py
+# Description: This file contains the synthetic data generator used by the
+# benchmarks: reproducible databases of users, anime, watchlists and
+# releases shaped like real AniNotif data.
+#
+# How the generator works:
+#
+# - Every value comes from a random.Random(seed), so the same arguments
+#   always produce the same database and benchmark runs stay comparable.
+# - Anime get multi-word titles, alternate titles, a status mix (mostly
+#   finished, AIRING_SHARE airing, some not yet aired) and broadcast strings
+#   spread over every weekday, several timezones and late-night JST slots,
+#   plus the irregular strings Jikan returns ("Unknown", "Not scheduled
+#   once per week", None) that the release checker has to skip.
+# - Airing anime premiered up to 20 weeks before `now`; their past episodes
+#   are written to the releases table as already announced.
+# - Watchlists follow a popularity skew: a few shows are watched by many
+#   users, most by a handful, like real lists.
+#
+# Rows are written with the Database batch methods. Run directly to build a
+# database file:
+#   python datagen.py --output bench.db --anime 5000 --users 1000
+# ======================================================================
+
+import os
+import random
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+import click
+from broadcast import format_release_date, episode_air_time, parse_aired, parse_broadcast
+from db import Database
+
+# Share of generated anime that are currently airing
+AIRING_SHARE = 0.2
+
+# Share of generated anime that have not aired yet
+UPCOMING_SHARE = 0.05
+
+# Share of airing anime whose broadcast string cannot be scheduled
+IRREGULAR_SHARE = 0.05
+
+# Reference "now" of generated data: premieres, releases and announcements are placed relative to it
+REFERENCE_TIME = datetime(2026, 1, 5, 12, tzinfo=timezone.utc)
+
+# Broadcast strings Jikan returns for shows without a weekly slot
+IRREGULAR_BROADCASTS = ("Unknown", "Not scheduled once per week", "Sundays at Unknown", None)
+
+# Broadcast timezones and their weights (Jikan lists almost everything in JST)
+BROADCAST_TIMEZONES = (("JST", 90), ("KST", 4), ("CST", 3), ("UTC", 3))
+
+WEEKDAYS = ("Mondays", "Tuesdays", "Wednesdays", "Thursdays", "Fridays", "Saturdays", "Sundays")
+
+# Words generated titles are built from
+TITLE_WORDS = (
+    "attack", "titan", "sword", "art", "online", "demon", "slayer", "hunter", "steel", "alchemist", "spirit",
+    "cowboy", "bebop", "ghost", "shell", "neon", "genesis", "academia", "hero", "mobile", "suit", "code",
+    "geass", "death", "note", "tokyo", "ghoul", "jujutsu", "kaisen", "chainsaw", "man", "spy", "family",
+    "frieren", "beyond", "journey", "magical", "girl", "dragon", "maid", "kingdom", "vinland", "saga",
+    "violet", "garden", "clannad", "after", "story", "your", "lie", "april", "silent", "voice", "weathering",
+    "with", "you", "princess", "mononoke", "howl", "moving", "castle", "summer", "wars", "paprika", "perfect",
+    "blue", "lock", "haikyuu", "kuroko", "basketball", "slam", "dunk", "yuri", "ice", "banana", "fish",
+)
+
+# Row counts written by populate()
+GeneratedData = namedtuple("GeneratedData", ["users", "anime", "airing", "watchlist", "releases"])
+
+# ----------------------------------------------------------------------
+# Row Generators
+# ----------------------------------------------------------------------
+
+def broadcast_string(rng: random.Random) -> str:
+    """A weekly slot like "Saturdays at 23:30 (JST)", biased towards evening and late-night hours."""
+    zone = rng.choices([zone for zone, _ in BROADCAST_TIMEZONES], [weight for _, weight in BROADCAST_TIMEZONES])[0]
+    hour = rng.choice((rng.randrange(0, 24), rng.randrange(17, 24), rng.randrange(0, 3)))
+    return f"{rng.choice(WEEKDAYS)} at {hour:02d}:{rng.choice((0, 0, 15, 30, 30, 45)):02d} ({zone})"
+
+def anime_rows(count: int, seed: int = 0, now: datetime = REFERENCE_TIME, first_mal_id: int = 1):
+    """Yield `count` anime as tuples in ANIME_COLUMNS order, with mal_ids from first_mal_id."""
+    rng = random.Random(seed)
+    for mal_id in range(first_mal_id, first_mal_id + count):
+        words = rng.sample(TITLE_WORDS, rng.randint(2, 4))
+        title = " ".join(words).title()
+        alt_titles = "\n".join((f"{title}: Season {rng.randint(2, 4)}", " ".join(reversed(words)).upper()))
+        roll = rng.random()
+        if roll < AIRING_SHARE:
+            status = "Currently Airing"
+            aired_from = now - timedelta(days=rng.randrange(0, 140))
+            aired_to, episodes = None, rng.choice((None, 12, 13, 24, 25))
+            broadcast = rng.choice(IRREGULAR_BROADCASTS) if rng.random() < IRREGULAR_SHARE else broadcast_string(rng)
+        elif roll < AIRING_SHARE + UPCOMING_SHARE:
+            status = "Not yet aired"
+            aired_from = now + timedelta(days=rng.randrange(7, 180))
+            aired_to, episodes, broadcast = None, None, rng.choice((broadcast_string(rng), "Unknown", None))
+        else:
+            status = "Finished Airing"
+            episodes = rng.choice((1, 12, 12, 13, 24, 25, 26, 50))
+            aired_from = now - timedelta(days=rng.randrange(200, 9000))
+            aired_to = aired_from + timedelta(weeks=episodes)
+            broadcast = broadcast_string(rng) if rng.random() < 0.7 else None
+        yield (mal_id, title, f"Synthetic synopsis of {title.lower()}, a story about {' and '.join(words)}.", episodes, status,
+               aired_from.strftime("%Y-%m-%dT00:00:00+00:00"), aired_to.strftime("%Y-%m-%dT00:00:00+00:00") if aired_to else None,
+               broadcast, alt_titles)
+
+def past_releases(anime, now: datetime = REFERENCE_TIME):
+    """Yield (anime_id, episode_number, release_date, broadcast) for the episodes of airing anime that aired before now.
+
+    anime holds (anime_id, episodes, aired_from, broadcast) tuples.
+    """
+    for anime_id, episodes, aired_from, broadcast in anime:
+        slot, premiere = parse_broadcast(broadcast), parse_aired(aired_from)
+        if slot is None or premiere is None:
+            continue
+        number = 1
+        while episodes is None or number <= episodes:
+            air_time = episode_air_time(slot, premiere, number)
+            if air_time > now:
+                break
+            yield anime_id, number, format_release_date(air_time), broadcast
+            number += 1
+
+def watchlist_rows(users: int, anime_ids, per_user: int, seed: int = 0):
+    """Yield (user_id, anime_id, last_watched_episode) with per_user distinct shows for user ids 1..users.
+
+    Shows are picked with a Zipf-like skew over a random popularity ranking, so a few shows get most watchers.
+    """
+    rng = random.Random(seed)
+    anime_ids = list(anime_ids)
+    rng.shuffle(anime_ids)   # popularity rank, unrelated to id order or status
+    per_user = min(per_user, len(anime_ids))
+    weights = [1 / rank for rank in range(1, len(anime_ids) + 1)]
+    for user_id in range(1, users + 1):
+        picked = set()
+        while len(picked) < per_user:
+            picked.update(rng.choices(anime_ids, weights, k=per_user - len(picked)))
+        for anime_id in sorted(picked):
+            yield user_id, anime_id, rng.randrange(0, 13)
+
+# ----------------------------------------------------------------------
+# Database Population
+# ----------------------------------------------------------------------
+
+def populate(db: Database, anime: int = 5000, users: int = 1000, watchlist_per_user: int = 10, seed: int = 0,
+             now: datetime = REFERENCE_TIME) -> GeneratedData:
+    """Fill an initialised database with generated users, anime, watchlists and announced past releases."""
+    created = db.create_anime_many(anime_rows(anime, seed, now))
+    with db.transaction() as cursor:
+        cursor.executemany("INSERT INTO users (mal_user_id) VALUES (?)", ((f"bench_user_{i}",) for i in range(1, users + 1)))
+        anime_ids = [row[0] for row in cursor.execute("SELECT id FROM anime ORDER BY id")]
+        airing = cursor.execute("SELECT id, episodes, aired_from, broadcast FROM anime WHERE status = 'Currently Airing'").fetchall()
+    releases = list(past_releases(airing, now))
+    db.add_releases_many(releases)
+    db.mark_releases_announced(((anime_id, episode) for anime_id, episode, _, _ in releases), format_release_date(now))
+    watchlist = db.add_to_watchlist_many(watchlist_rows(users, anime_ids, watchlist_per_user, seed))
+    return GeneratedData(users=users, anime=created.inserted, airing=len(airing), watchlist=watchlist.inserted,
+                         releases=len(releases))
+
+# ----------------------------------------------------------------------
+# If file ran directly, build a database file
+# ----------------------------------------------------------------------
+
+@click.command()
+@click.option('--output', type=click.Path(dir_okay=False), required=True, help='Database file to create (must not exist)')
+@click.option('--anime', type=int, default=5000, show_default=True, help='Anime to generate')
+@click.option('--users', type=int, default=1000, show_default=True, help='Users to generate')
+@click.option('--watchlist-per-user', type=int, default=10, show_default=True, help='Watchlist entries per user')
+@click.option('--seed', type=int, default=0, show_default=True, help='Random seed')
+def main(output, anime, users, watchlist_per_user, seed):
+    """Generate a synthetic AniNotif database."""
+    if os.path.exists(output):
+        raise click.UsageError(f"{output} already exists")
+    db = Database(output)
+    db.init_db()
+    click.echo(populate(db, anime, users, watchlist_per_user, seed))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
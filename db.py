@@ -7,14 +7,483 @@
 
 import sqlite3
 import os
+import threading
+import zlib
+from collections import namedtuple
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from itertools import islice
 import click
-from rich.console import Console
+from broadcast import BROADCAST_COLUMNS, MINUTES_PER_WEEK, broadcast_columns, format_release_date, minute_of_week
+from lazy import DeferredConsole
+import metrics
 
 # Database file name
 DB_NAME = "anime_watchlist.db"
 
+# Pragmas applied once to every pooled connection
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",     # readers no longer block the writer
+    "PRAGMA synchronous = NORMAL",   # safe with WAL, avoids an fsync per commit
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",    # ~16 MB page cache
+    "PRAGMA busy_timeout = 5000",    # wait up to 5s for a competing writer
+)
+
+# Rows sent to executemany per savepoint by the batch operations
+BATCH_CHUNK_SIZE = 500
+
+# Column order used when batch methods receive dicts instead of tuples
+ANIME_COLUMNS = ("mal_id", "title", "synopsis", "episodes", "status", "aired_from", "aired_to", "broadcast", "alt_titles")
+WATCHLIST_COLUMNS = ("user_id", "anime_id", "last_watched_episode")
+RELEASE_COLUMNS = ("anime_id", "episode_number", "release_date", "broadcast")
+
+# SQL expression of the current UTC time with milliseconds, as stored in updated_on columns
+NOW_TIMESTAMP = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Entries per page of Database.get_watchlist_page
+WATCHLIST_PAGE_SIZE = 25
+
+# Sort orders of watchlist pages: the SQL key pages are ordered by, ascending, ties broken by watchlist id
+WATCHLIST_SORTS = {
+    "next_air": "COALESCE(next_air, '9999-12-31 23:59:59')",   # shows without a known next episode come last
+    "backlog": "-unwatched",                                     # most unwatched episodes first
+    "title": "lower(title)",
+}
+
+# A watchlist entry joined with its anime; aired is the latest episode out, next_air a release_date string or None
+WatchlistEntry = namedtuple("WatchlistEntry", ["id", "anime_id", "mal_id", "title", "status", "episodes", "aired",
+                                               "last_watched_episode", "unwatched", "next_air"])
+
+# One page of a watchlist; pass `after` to get_watchlist_page for the next page (None on the last page)
+WatchlistPage = namedtuple("WatchlistPage", ["entries", "after"])
+
+# Name of the SQL function decoding anime_raw payloads, registered on every pooled connection
+RAW_PAYLOAD_FUNCTION = "zjson"
+
+# Aggregates kept per user (user_stats) and for everyone (global_stats) by the watching-stats triggers;
+# day_0..day_6 count entries of shows airing on each UTC weekday, Monday first
+WATCHING_STATS_COLUMNS = ("entries", "episodes_watched", "backlog", "completed", *(f"day_{day}" for day in range(7)))
+
+# Outcome of a batch insert: number of rows written and (index, row, error) for every rejected row
+BatchResult = namedtuple("BatchResult", ["inserted", "conflicts"])
+
+# ----------------------------------------------------------------------
+# Schema Migrations
+#
+# Ordered (version, description, steps) entries applied by Database.migrate().
+# A step is either an SQL statement or a callable taking the cursor. Never
+# edit an applied migration: append a new version instead.
+# ----------------------------------------------------------------------
+
+def _backfill_broadcast_columns(cursor):
+    """Parse the broadcast string of every existing anime into the structured broadcast columns."""
+    rows = cursor.execute("SELECT id, broadcast FROM anime").fetchall()
+    assignments = ", ".join(f"{column} = ?" for column in BROADCAST_COLUMNS)
+    cursor.executemany(f"UPDATE anime SET {assignments} WHERE id = ?",
+                       (broadcast_columns(broadcast) + (anime_id,) for anime_id, broadcast in rows))
+
+def _zjson(blob):
+    """SQL zjson(payload): the JSON text of a zlib-compressed anime_raw payload, for SQLite's JSON functions."""
+    return None if blob is None else zlib.decompress(blob).decode()
+
+def stats_anime_values(anime):
+    """SQL expressions of the (aired, finished_episodes, airing_day) stats_anime columns of the anime row `anime`.
+
+    aired is the latest announced episode (or the episode count of finished shows), airing_day the UTC weekday
+    of the broadcast slot of airing shows.
+    """
+    return (f"MAX(COALESCE((SELECT MAX(r.episode_number) FROM releases r WHERE r.anime_id = {anime}.id "
+            f"AND r.announced_on IS NOT NULL), 0), CASE WHEN {anime}.status = 'Finished Airing' "
+            f"THEN COALESCE({anime}.episodes, 0) ELSE 0 END)",
+            f"CASE WHEN {anime}.status = 'Finished Airing' THEN {anime}.episodes END",
+            f"CASE WHEN {anime}.status = 'Currently Airing' THEN {anime}.broadcast_utc_minute / 1440 END")
+
+def stats_contribution(entry, anime):
+    """{column: SQL expression} of what the watchlist row `entry` adds to each WATCHING_STATS_COLUMNS aggregate,
+    `anime` being its stats_anime row (all NULL when the anime is unknown)."""
+    watched = f"COALESCE({entry}.last_watched_episode, 0)"
+    return {
+        "entries": "1",
+        "episodes_watched": watched,
+        "backlog": f"MAX(COALESCE({anime}.aired, 0) - {watched}, 0)",
+        "completed": f"({anime}.finished_episodes IS NOT NULL AND {watched} >= {anime}.finished_episodes)",
+        **{f"day_{day}": f"({anime}.airing_day IS {day})" for day in range(7)},
+    }
+
+def _stats_add_entry(entry, sign):
+    """Trigger statement adding (sign "+") or removing (sign "-") the watchlist row `entry` from its user's stats."""
+    contribution = stats_contribution(entry, "s")
+    return f'''
+    INSERT INTO user_stats (user_id, {", ".join(WATCHING_STATS_COLUMNS)})
+    SELECT {entry}.user_id, {", ".join(f"{sign}({contribution[column]})" for column in WATCHING_STATS_COLUMNS)}
+    FROM (SELECT 1) LEFT JOIN stats_anime s ON s.anime_id = {entry}.anime_id
+    WHERE {entry}.user_id IS NOT NULL
+    ON CONFLICT(user_id) DO UPDATE SET {", ".join(f"{column} = {column} + excluded.{column}" for column in WATCHING_STATS_COLUMNS)};
+    '''
+
+def _stats_refresh_anime(anime_id):
+    """Trigger statement recomputing the stats_anime row of anime_id (all NULL once the anime is gone)."""
+    return f'''
+    UPDATE stats_anime SET (aired, finished_episodes, airing_day) = (
+        SELECT {", ".join(stats_anime_values("a"))} FROM anime a WHERE a.id = {anime_id})
+    WHERE anime_id = {anime_id};
+    '''
+
+def _watching_stats_triggers():
+    """Triggers keeping stats_anime, user_stats and global_stats in step with anime, releases and watchlist writes."""
+    # Only these aggregates depend on the anime; entries and episodes_watched do not move when it changes
+    anime_columns = [column for column in WATCHING_STATS_COLUMNS if column not in ("entries", "episodes_watched")]
+    new, old = stats_contribution("w", "NEW"), stats_contribution("w", "OLD")
+    progress_columns = ("episodes_watched", "backlog", "completed")
+    progress_new, progress_old = stats_contribution("NEW", "s"), stats_contribution("OLD", "s")
+    global_delta = ", ".join(f"{column} = {column} + NEW.{column}" for column in WATCHING_STATS_COLUMNS)
+    global_change = ", ".join(f"{column} = {column} + NEW.{column} - OLD.{column}" for column in WATCHING_STATS_COLUMNS)
+    return (
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_watchlist_stats_insert AFTER INSERT ON watchlist BEGIN
+            {_stats_add_entry("NEW", "+")}
+        END
+        ''',
+        # Progress updates, by far the most frequent, only move three sums of the same row
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_watchlist_stats_progress AFTER UPDATE OF last_watched_episode ON watchlist
+        WHEN OLD.user_id IS NEW.user_id AND OLD.anime_id IS NEW.anime_id
+            AND OLD.last_watched_episode IS NOT NEW.last_watched_episode
+        BEGIN
+            UPDATE user_stats SET {", ".join(f"{column} = user_stats.{column} + d.{column}" for column in progress_columns)}
+            FROM (SELECT {", ".join(f"{progress_new[column]} - {progress_old[column]} AS {column}" for column in progress_columns)}
+                  FROM (SELECT 1) LEFT JOIN stats_anime s ON s.anime_id = NEW.anime_id) AS d
+            WHERE user_stats.user_id = NEW.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_watchlist_stats_update AFTER UPDATE OF user_id, anime_id ON watchlist
+        WHEN OLD.user_id IS NOT NEW.user_id OR OLD.anime_id IS NOT NEW.anime_id
+        BEGIN
+            {_stats_add_entry("OLD", "-")}
+            {_stats_add_entry("NEW", "+")}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_watchlist_stats_delete AFTER DELETE ON watchlist BEGIN
+            {_stats_add_entry("OLD", "-")}
+        END
+        ''',
+        # A changed anime moves the aggregates of its watchers only: one indexed row per watcher
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_stats_anime_propagate AFTER UPDATE ON stats_anime
+        WHEN OLD.aired IS NOT NEW.aired OR OLD.finished_episodes IS NOT NEW.finished_episodes
+            OR OLD.airing_day IS NOT NEW.airing_day
+        BEGIN
+            UPDATE user_stats SET {", ".join(f"{column} = user_stats.{column} + d.{column}" for column in anime_columns)}
+            FROM (SELECT w.user_id, {", ".join(f"SUM({new[column]} - {old[column]}) AS {column}" for column in anime_columns)}
+                  FROM watchlist w WHERE w.anime_id = NEW.anime_id GROUP BY w.user_id) AS d
+            WHERE user_stats.user_id = d.user_id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_anime_stats_insert AFTER INSERT ON anime BEGIN
+            INSERT OR IGNORE INTO stats_anime (anime_id) VALUES (NEW.id);
+            {_stats_refresh_anime("NEW.id")}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_anime_stats_update AFTER UPDATE OF status, episodes, broadcast_utc_minute ON anime
+        WHEN OLD.status IS NOT NEW.status OR OLD.episodes IS NOT NEW.episodes
+            OR OLD.broadcast_utc_minute IS NOT NEW.broadcast_utc_minute
+        BEGIN
+            {_stats_refresh_anime("NEW.id")}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_anime_stats_delete AFTER DELETE ON anime BEGIN
+            {_stats_refresh_anime("OLD.id")}
+            DELETE FROM stats_anime WHERE anime_id = OLD.id;
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_releases_stats_insert AFTER INSERT ON releases
+        WHEN NEW.announced_on IS NOT NULL
+        BEGIN
+            {_stats_refresh_anime("NEW.anime_id")}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_releases_stats_update AFTER UPDATE OF anime_id, episode_number, announced_on ON releases
+        WHEN OLD.announced_on IS NOT NULL OR NEW.announced_on IS NOT NULL
+        BEGIN
+            {_stats_refresh_anime("NEW.anime_id")}
+            {_stats_refresh_anime("OLD.anime_id")}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_releases_stats_delete AFTER DELETE ON releases
+        WHEN OLD.announced_on IS NOT NULL
+        BEGIN
+            {_stats_refresh_anime("OLD.anime_id")}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_global_insert AFTER INSERT ON user_stats BEGIN
+            UPDATE global_stats SET users = users + (NEW.entries > 0), {global_delta};
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_user_stats_global_update AFTER UPDATE ON user_stats BEGIN
+            UPDATE global_stats SET users = users + (NEW.entries > 0) - (OLD.entries > 0), {global_change};
+        END
+        ''',
+    )
+
+def rebuild_watching_stats(cursor):
+    """Recompute stats_anime, user_stats and global_stats from anime, releases and watchlist, discarding any drift."""
+    contribution = stats_contribution("w", "s")
+    cursor.execute("DELETE FROM user_stats")
+    cursor.execute("DELETE FROM stats_anime")
+    cursor.execute("DELETE FROM global_stats")
+    cursor.execute("INSERT INTO global_stats (id) VALUES (1)")
+    cursor.execute(f"INSERT INTO stats_anime (anime_id, aired, finished_episodes, airing_day) "
+                   f"SELECT a.id, {', '.join(stats_anime_values('a'))} FROM anime a")
+    # The global row is summed by the user_stats insert trigger
+    cursor.execute(f'''
+    INSERT INTO user_stats (user_id, {", ".join(WATCHING_STATS_COLUMNS)})
+    SELECT w.user_id, {", ".join(f"SUM({contribution[column]})" for column in WATCHING_STATS_COLUMNS)}
+    FROM watchlist w LEFT JOIN stats_anime s ON s.anime_id = w.anime_id
+    WHERE w.user_id IS NOT NULL
+    GROUP BY w.user_id
+    ''')
+
+def _anime_change_triggers():
+    """Triggers appending to anime_changes the mal_id of every anime whose featurized content changes."""
+    triggers = []
+    for table, watched in (("anime", ("mal_id", "title", "synopsis")), ("anime_raw", ("mal_id", "payload_hash"))):
+        changed = " OR ".join(f"OLD.{column} IS NOT NEW.{column}" for column in watched)
+        triggers += [
+            f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_changes_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO anime_changes (mal_id) VALUES (NEW.mal_id);
+            END
+            ''',
+            f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_changes_update AFTER UPDATE OF {", ".join(watched)} ON {table}
+            WHEN {changed}
+            BEGIN
+                INSERT INTO anime_changes (mal_id) VALUES (NEW.mal_id);
+                INSERT INTO anime_changes (mal_id) SELECT OLD.mal_id WHERE OLD.mal_id IS NOT NEW.mal_id;
+            END
+            ''',
+            f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_changes_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO anime_changes (mal_id) VALUES (OLD.mal_id);
+            END
+            ''',
+        ]
+    return triggers
+
+MIGRATIONS = [
+    (1, "Index watchlist/releases hot paths and make releases unique per episode", (
+        "CREATE INDEX IF NOT EXISTS idx_watchlist_user_anime ON watchlist(user_id, anime_id)",
+        "CREATE INDEX IF NOT EXISTS idx_releases_date_anime ON releases(release_date, anime_id)",
+        # Keep the first copy of duplicated episodes so the unique index can be built
+        "DELETE FROM releases WHERE id NOT IN (SELECT MIN(id) FROM releases GROUP BY anime_id, episode_number)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_releases_anime_episode ON releases(anime_id, episode_number)",
+    )),
+    (2, "Track which releases the release checker has already announced", (
+        "ALTER TABLE releases ADD COLUMN announced_on TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_releases_pending ON releases(anime_id, episode_number) WHERE announced_on IS NULL",
+    )),
+    (3, "Store broadcast slots parsed into weekday, time, timezone and UTC minute of week", (
+        "ALTER TABLE anime ADD COLUMN broadcast_day INTEGER",
+        "ALTER TABLE anime ADD COLUMN broadcast_time TEXT",
+        "ALTER TABLE anime ADD COLUMN broadcast_timezone TEXT",
+        "ALTER TABLE anime ADD COLUMN broadcast_utc_offset INTEGER",
+        "ALTER TABLE anime ADD COLUMN broadcast_utc_minute INTEGER",
+        _backfill_broadcast_columns,
+        "CREATE INDEX IF NOT EXISTS idx_anime_status_slot ON anime(status, broadcast_utc_minute)",
+    )),
+    (4, "Add the persistent notification outbox", (
+        '''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE NOT NULL,
+            user_id INTEGER,
+            anime_id INTEGER,
+            anime_title TEXT,
+            episode INTEGER,
+            air_time TEXT,
+            created_at REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            delivered_at REAL,
+            last_error TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(anime_id) REFERENCES anime(id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON notification_outbox(id) WHERE status = 'pending'",
+    )),
+    (5, "Add checkpoints for resumable MAL list imports", (
+        '''
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            records_done INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            updated_on TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    )),
+    (6, "Track row modification times for incremental exports", (
+        "ALTER TABLE watchlist ADD COLUMN updated_on TEXT",
+        "ALTER TABLE releases ADD COLUMN updated_on TEXT",
+        "UPDATE watchlist SET updated_on = COALESCE(added_on, strftime('%Y-%m-%d %H:%M:%f', 'now'))",
+        "UPDATE releases SET updated_on = strftime('%Y-%m-%d %H:%M:%f', 'now')",
+        *(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_touch_{event.lower()} AFTER {event} ON {table}
+        {"WHEN NEW.updated_on IS OLD.updated_on" if event == "UPDATE" else ""}
+        BEGIN
+            UPDATE {table} SET updated_on = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+        END
+        ''' for table in ("watchlist", "releases") for event in ("INSERT", "UPDATE")),
+        "CREATE INDEX IF NOT EXISTS idx_watchlist_updated ON watchlist(updated_on)",
+        "CREATE INDEX IF NOT EXISTS idx_releases_updated ON releases(updated_on)",
+        '''
+        CREATE TABLE IF NOT EXISTS export_state (
+            name TEXT PRIMARY KEY,
+            last_exported_on TEXT NOT NULL
+        )
+        ''',
+    )),
+    (7, "Add a full-text index over anime titles, alternate titles and synopses", (
+        "ALTER TABLE anime ADD COLUMN alt_titles TEXT",
+        # External-content index: the text lives in anime only, the triggers below keep the index in sync
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS anime_fts USING fts5(
+            title, alt_titles, synopsis,
+            content='anime', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_anime_fts_insert AFTER INSERT ON anime BEGIN
+            INSERT INTO anime_fts (rowid, title, alt_titles, synopsis) VALUES (NEW.id, NEW.title, NEW.alt_titles, NEW.synopsis);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_anime_fts_delete AFTER DELETE ON anime BEGIN
+            INSERT INTO anime_fts (anime_fts, rowid, title, alt_titles, synopsis) VALUES ('delete', OLD.id, OLD.title, OLD.alt_titles, OLD.synopsis);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_anime_fts_update AFTER UPDATE OF title, alt_titles, synopsis ON anime BEGIN
+            INSERT INTO anime_fts (anime_fts, rowid, title, alt_titles, synopsis) VALUES ('delete', OLD.id, OLD.title, OLD.alt_titles, OLD.synopsis);
+            INSERT INTO anime_fts (rowid, title, alt_titles, synopsis) VALUES (NEW.id, NEW.title, NEW.alt_titles, NEW.synopsis);
+        END
+        ''',
+        "INSERT INTO anime_fts (anime_fts) VALUES ('rebuild')",
+        # Distinct indexed terms, used to correct misspelled search words
+        "CREATE VIRTUAL TABLE IF NOT EXISTS anime_fts_vocab USING fts5vocab(anime_fts, 'row')",
+    )),
+    (8, "Track anime content hashes and refresh schedule", (
+        "ALTER TABLE anime ADD COLUMN content_hash TEXT",
+        "ALTER TABLE anime ADD COLUMN last_checked_at REAL",
+        # 0 = never checked, so every existing and new anime is due for its first refresh
+        "ALTER TABLE anime ADD COLUMN next_check_at REAL NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_anime_next_check ON anime(next_check_at)",
+    )),
+    (9, "Index watchlist by anime and progress for release fan-out, stamp updated_on on insert", (
+        # Covers the fan-out join: watchers of an anime who have not seen an episode yet
+        "CREATE INDEX IF NOT EXISTS idx_watchlist_anime_progress ON watchlist(anime_id, last_watched_episode, user_id)",
+        # Inserts made by Database stamp updated_on themselves: the per-row insert trigger made bulk inserts ~4x slower
+        "DROP TRIGGER IF EXISTS trg_watchlist_touch_insert",
+        "DROP TRIGGER IF EXISTS trg_releases_touch_insert",
+    )),
+    (10, "Store the raw Jikan payload of every anime, zlib-compressed", (
+        # Keyed by mal_id so payloads can be kept before (or without) their anime row; see anime_raw.py
+        '''
+        CREATE TABLE IF NOT EXISTS anime_raw (
+            mal_id INTEGER PRIMARY KEY,
+            payload BLOB NOT NULL,
+            payload_hash TEXT NOT NULL,
+            raw_size INTEGER NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+        ''',
+    )),
+    (11, "Index releases by anime and date for the joined watchlist view", (
+        # Covers the latest aired and next upcoming episode lookups of get_watchlist_page
+        "CREATE INDEX IF NOT EXISTS idx_releases_anime_date ON releases(anime_id, release_date, episode_number)",
+    )),
+    (12, "Maintain per-user and global watching statistics with triggers", (
+        # Per-anime inputs of the aggregates, so watchlist triggers never read releases; see watching_stats.py
+        '''
+        CREATE TABLE IF NOT EXISTS stats_anime (
+            anime_id INTEGER PRIMARY KEY,
+            aired INTEGER,
+            finished_episodes INTEGER,
+            airing_day INTEGER
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            {", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in WATCHING_STATS_COLUMNS)}
+        )
+        ''',
+        f'''
+        CREATE TABLE IF NOT EXISTS global_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER NOT NULL DEFAULT 0,
+            {", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in WATCHING_STATS_COLUMNS)}
+        )
+        ''',
+        *_watching_stats_triggers(),
+        rebuild_watching_stats,
+    )),
+    (13, "Log the anime whose title, synopsis or raw payload changed, for the recommendation matrix", (
+        # Read and pruned by recommend.py, which only re-featurizes the anime logged since its last update
+        '''
+        CREATE TABLE IF NOT EXISTS anime_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            mal_id INTEGER NOT NULL
+        )
+        ''',
+        *_anime_change_triggers(),
+    )),
+    (14, "Delay the retries of failed notifications with exponential backoff", (
+        # Set by Outbox.mark_failed_attempt; pending() skips entries until then
+        "ALTER TABLE notification_outbox ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0",
+    )),
+]
+
 # Rich console for colored output
-console = Console()
+console = DeferredConsole()
+
+# ----------------------------------------------------------------------
+# Batch Helpers
+# ----------------------------------------------------------------------
+
+def _chunked(iterable, size):
+    """Yield (offset, chunk) pairs of at most size items without materialising the iterable."""
+    iterator = iter(iterable)
+    offset = 0
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield offset, chunk
+        offset += len(chunk)
+
+def _as_rows(records, columns, defaults=None):
+    """Normalise dicts or short tuples into parameter tuples ordered like columns."""
+    defaults = defaults or {}
+    for record in records:
+        if isinstance(record, dict):
+            yield tuple(record.get(column, defaults.get(column)) for column in columns)
+        else:
+            record = tuple(record)
+            missing = columns[len(record):]
+            yield record + tuple(defaults.get(column) for column in missing)
 
 # ----------------------------------------------------------------------
 # Database Operations Class (CRUD operations and initialization)
@@ -24,153 +493,339 @@ class Database:
     """Class that encapsulates CRUD operations and initialization for the database."""
     def __init__(self, db_name=DB_NAME):
         self.db_name = db_name
+        self._local = threading.local()
+        self._pool = []
+        self._pool_lock = threading.Lock()
+        self._write_listeners = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def _connect(self):
-        """Create and return a new database connection."""
-        return sqlite3.connect(self.db_name)
+        """Return this thread's pooled connection, opening and tuning it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Each thread gets its own handle; check_same_thread is disabled only so close() can run from any thread
+            conn = sqlite3.connect(self.db_name, check_same_thread=False)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            # Deterministic, so generated columns and indexes over anime_raw payloads may use it
+            conn.create_function(RAW_PAYLOAD_FUNCTION, 1, _zjson, deterministic=True)
+            self._local.conn = conn
+            self._local.depth = 0
+            with self._pool_lock:
+                self._pool.append(conn)
+        return conn
 
-    def init_db(self):
-        """Create and initialize all necessary tables in the database if they do not exist."""
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor and commit when the outermost transaction block exits.
+
+        Nested blocks (including the ones inside every CRUD method) join the
+        enclosing transaction, so wrapping a loop in ``with db.transaction():``
+        groups all of its writes into a single commit.
+        """
         conn = self._connect()
-        cursor = conn.cursor()
+        depth = self._local.depth
+        self._local.depth = depth + 1
+        try:
+            yield conn.cursor()
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+            raise
+        else:
+            if depth == 0:
+                conn.commit()
+        finally:
+            self._local.depth = depth
 
-        # Create 'users' table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            mal_user_id TEXT UNIQUE NOT NULL
-        )
-        ''')
+    def stream(self, sql, params=()):
+        """Yield the rows of a query one at a time from a dedicated cursor instead of loading them with fetchall."""
+        cursor = self._connect().cursor()
+        try:
+            yield from cursor.execute(sql, params)
+        finally:
+            cursor.close()
 
-        # Create 'anime' table with details from the Jikan API
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS anime (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            mal_id INTEGER UNIQUE NOT NULL,
-            title TEXT NOT NULL,
-            synopsis TEXT,
-            episodes INTEGER,
-            status TEXT,
-            aired_from TEXT,
-            aired_to TEXT,
-            broadcast TEXT
-        )
-        ''')
+    def close(self):
+        """Close every pooled connection opened by this instance."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, []
+        for conn in pool:
+            conn.close()
+        self._local = threading.local()
 
-        # Create 'watchlist' table to link users and anime
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS watchlist (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            anime_id INTEGER,
-            added_on TEXT DEFAULT CURRENT_TIMESTAMP,
-            last_watched_episode INTEGER DEFAULT 0,
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(anime_id) REFERENCES anime(id)
-        )
-        ''')
+    def add_write_listener(self, listener):
+        """Call listener(table, ids) after every anime or releases write made through this instance.
 
-        # Create 'releases' table to track episode release dates
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS releases (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            anime_id INTEGER,
-            episode_number INTEGER,
-            release_date TEXT,
-            broadcast TEXT,
-            FOREIGN KEY(anime_id) REFERENCES anime(id),
-            FOREIGN KEY (broadcast) REFERENCES anime(broadcast)
-        )
-        ''')
+        ids lists the rows written when the method knows them, and is None for
+        writes whose rows are not known up front (batch inserts).
+        """
+        self._write_listeners.append(listener)
+
+    def remove_write_listener(self, listener):
+        if listener in self._write_listeners:
+            self._write_listeners.remove(listener)
+
+    def notify_write(self, table, ids=None):
+        """Tell the write listeners that rows of table changed (also for callers writing with raw SQL)."""
+        for listener in self._write_listeners:
+            listener(table, ids)
+
+    def init_db(self):
+        """Create and initialize all necessary tables in the database if they do not exist."""
+        with self.transaction() as cursor:
+            # Create 'users' table
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mal_user_id TEXT UNIQUE NOT NULL
+            )
+            ''')
+
+            # Create 'anime' table with details from the Jikan API
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS anime (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                mal_id INTEGER UNIQUE NOT NULL,
+                title TEXT NOT NULL,
+                synopsis TEXT,
+                episodes INTEGER,
+                status TEXT,
+                aired_from TEXT,
+                aired_to TEXT,
+                broadcast TEXT
+            )
+            ''')
+
+            # Create 'watchlist' table to link users and anime
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS watchlist (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                anime_id INTEGER,
+                added_on TEXT DEFAULT CURRENT_TIMESTAMP,
+                last_watched_episode INTEGER DEFAULT 0,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(anime_id) REFERENCES anime(id)
+            )
+            ''')
 
-        conn.commit()
-        conn.close()
+            # Create 'releases' table to track episode release dates
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS releases (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                anime_id INTEGER,
+                episode_number INTEGER,
+                release_date TEXT,
+                broadcast TEXT,
+                FOREIGN KEY(anime_id) REFERENCES anime(id),
+                FOREIGN KEY (broadcast) REFERENCES anime(broadcast)
+            )
+            ''')
+        self.migrate()
         console.print("[green]Database initialized successfully.[/green]")
 
+    def schema_version(self):
+        """Return the highest migration version applied to the database (0 if none)."""
+        with self.transaction() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+            if cursor.fetchone() is None:
+                return 0
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            return cursor.fetchone()[0]
+
+    def upgrade_if_needed(self):
+        """Migrate an already initialized database that is behind the latest schema version. Returns the versions applied."""
+        with self.transaction() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'anime'")
+            initialized = cursor.fetchone() is not None
+        if not initialized or self.schema_version() >= MIGRATIONS[-1][0]:
+            return []
+        return self.migrate()
+
+    def migrate(self):
+        """Apply every pending migration in order, each in its own transaction. Returns the versions applied."""
+        with self.transaction() as cursor:
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_on TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+        current = self.schema_version()
+        applied = []
+        for version, description, steps in MIGRATIONS:
+            if version <= current:
+                continue
+            with self.transaction() as cursor:
+                # DDL does not open a transaction by itself, so without BEGIN a failing step would leave the
+                # earlier ones committed and the version unrecorded
+                if not cursor.connection.in_transaction:
+                    cursor.execute("BEGIN")
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description))
+            applied.append(version)
+        return applied
+
     # ---------------------
     # Users Table Operations
     # ---------------------
     def create_user(self, mal_user_id):
         """Create a new user with the given mal_user_id. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO users (mal_user_id) VALUES (?)", (mal_user_id,))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("INSERT INTO users (mal_user_id) VALUES (?)", (mal_user_id,))
             return True
         except Exception as e:
+            metrics.record_error("db.create_user", e)
             return False
 
     def get_user(self, user_id):
         """Retrieve a user by id. Returns the user record or False if there is an error."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-            result = cursor.fetchone()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+                result = cursor.fetchone()
             return result
         except Exception as e:
+            metrics.record_error("db.get_user", e)
+            return False
+
+    def get_or_create_user(self, mal_user_id):
+        """Return the id of the user with mal_user_id, creating the user if needed. Returns False if there is an error."""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("SELECT id FROM users WHERE mal_user_id = ?", (mal_user_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute("INSERT INTO users (mal_user_id) VALUES (?)", (mal_user_id,))
+                    return cursor.lastrowid
+            return row[0]
+        except Exception as e:
+            metrics.record_error("db.get_or_create_user", e)
             return False
 
     def update_user(self, user_id, new_mal_user_id):
         """Update a user's mal_user_id. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET mal_user_id = ? WHERE id = ?", (new_mal_user_id, user_id))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("UPDATE users SET mal_user_id = ? WHERE id = ?", (new_mal_user_id, user_id))
             return True
         except Exception as e:
+            metrics.record_error("db.update_user", e)
             return False
 
     def delete_user(self, user_id):
         """Delete a user by id. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
             return True
         except Exception as e:
+            metrics.record_error("db.delete_user", e)
             return False
 
     # ---------------------
     # Anime Table Operations
     # ---------------------
-    def create_anime(self, mal_id, title, synopsis, episodes, status, aired_from, aired_to, broadcast):
+    def create_anime(self, mal_id, title, synopsis, episodes, status, aired_from, aired_to, broadcast, alt_titles=None):
         """Create a new anime entry. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO anime (mal_id, title, synopsis, episodes, status, aired_from, aired_to, broadcast) VALUES (?,?,?,?,?,?,?,?)", 
-                           (mal_id, title, synopsis, episodes, status, aired_from, aired_to, broadcast))
-            conn.commit()
-            conn.close()
+            columns = ANIME_COLUMNS + BROADCAST_COLUMNS
+            with self.transaction() as cursor:
+                cursor.execute(f"INSERT INTO anime ({', '.join(columns)}) VALUES ({','.join('?' * len(columns))})",
+                               (mal_id, title, synopsis, episodes, status, aired_from, aired_to, broadcast, alt_titles) + broadcast_columns(broadcast))
+            self.notify_write("anime", [cursor.lastrowid])
             return True
         except Exception as e:
+            metrics.record_error("db.create_anime", e)
             return False
 
     def get_anime(self, anime_id):
         """Retrieve an anime record by id. Returns the record or False if there is an error."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM anime WHERE id = ?", (anime_id,))
-            result = cursor.fetchone()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("SELECT * FROM anime WHERE id = ?", (anime_id,))
+                result = cursor.fetchone()
             return result
         except Exception as e:
+            metrics.record_error("db.get_anime", e)
+            return False
+
+    def get_anime_ids_by_mal_ids(self, mal_ids):
+        """Map MAL ids to local anime ids for the ones already in the catalog. Returns a dict or False if there is an error."""
+        try:
+            results = {}
+            with self.transaction() as cursor:
+                for _, chunk in _chunked(mal_ids, BATCH_CHUNK_SIZE):
+                    cursor.execute(f"SELECT mal_id, id FROM anime WHERE mal_id IN ({','.join('?' * len(chunk))})", chunk)
+                    results.update(cursor.fetchall())
+            return results
+        except Exception as e:
+            metrics.record_error("db.get_anime_ids_by_mal_ids", e)
             return False
 
-    def update_anime(self, anime_id, **kwargs): # TO REDO
-        """Update an anime record using keyword arguments for fields to update. Returns True if successful."""
+    def get_airing_anime(self):
+        """Retrieve (id, title, episodes, aired_from, broadcast, broadcast_day, broadcast_time, broadcast_timezone,
+        broadcast_utc_offset) for every currently airing anime. Returns a list or False if there is an error."""
         try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                SELECT id, title, episodes, aired_from, broadcast,
+                       broadcast_day, broadcast_time, broadcast_timezone, broadcast_utc_offset
+                FROM anime WHERE status = 'Currently Airing'
+                ''')
+                results = cursor.fetchall()
+            return results
+        except Exception as e:
+            metrics.record_error("db.get_airing_anime", e)
+            return False
+
+    def get_anime_airing_within(self, start, hours=24):
+        """Retrieve (id, title, broadcast_utc_minute) of airing anime whose weekly slot falls in the next `hours` after
+        the aware datetime `start`, using the (status, broadcast_utc_minute) index. Returns a list or False if there is an error."""
+        try:
+            first = minute_of_week(start)
+            last = first + int(hours * 60)
+            sql = "SELECT id, title, broadcast_utc_minute FROM anime WHERE status = 'Currently Airing' AND broadcast_utc_minute BETWEEN ? AND ?"
+            with self.transaction() as cursor:
+                if hours * 60 >= MINUTES_PER_WEEK:
+                    cursor.execute(sql, (0, MINUTES_PER_WEEK - 1))
+                elif last < MINUTES_PER_WEEK:
+                    cursor.execute(sql, (first, last))
+                else:
+                    # The window wraps past Sunday midnight UTC: query both ends of the week
+                    cursor.execute(f"{sql} UNION ALL {sql}", (first, MINUTES_PER_WEEK - 1, 0, last - MINUTES_PER_WEEK))
+                results = cursor.fetchall()
+            return results
+        except Exception as e:
+            metrics.record_error("db.get_anime_airing_within", e)
+            return False
+
+    def update_anime(self, anime_id, **kwargs):
+        """Update an anime record using keyword arguments for fields to update. Returns True if successful.
+
+        Only ANIME_COLUMNS can be set; the broadcast slot columns follow the broadcast string and the
+        content hash is cleared so the next metadata refresh compares every column again.
+        """
+        try:
+            if not kwargs or not set(kwargs) <= set(ANIME_COLUMNS):
+                return False
             columns = []
             values = []
+            if "broadcast" in kwargs:
+                kwargs.update(zip(BROADCAST_COLUMNS, broadcast_columns(kwargs["broadcast"])))
+            kwargs["content_hash"] = None
             for key, value in kwargs.items():
                 columns.append(f"{key} = ?")
                 values.append(value)
@@ -178,25 +833,23 @@ class Database:
                 return False
             values.append(anime_id)
             sql = f"UPDATE anime SET {', '.join(columns)} WHERE id = ?"
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute(sql, tuple(values))
+            self.notify_write("anime", [anime_id])
             return True
         except Exception as e:
+            metrics.record_error("db.update_anime", e)
             return False
 
     def delete_anime(self, anime_id):
         """Delete an anime record by id. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM anime WHERE id = ?", (anime_id,))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("DELETE FROM anime WHERE id = ?", (anime_id,))
+            self.notify_write("anime", [anime_id])
             return True
         except Exception as e:
+            metrics.record_error("db.delete_anime", e)
             return False
 
     # --------------------------
@@ -205,50 +858,111 @@ class Database:
     def add_to_watchlist(self, user_id, anime_id, last_watched_episode=0):
         """Add an anime to a user's watchlist. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO watchlist (user_id, anime_id, last_watched_episode) VALUES (?,?,?)", 
-                           (user_id, anime_id, last_watched_episode))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute(f"INSERT INTO watchlist (user_id, anime_id, last_watched_episode, updated_on) VALUES (?,?,?,{NOW_TIMESTAMP})", 
+                               (user_id, anime_id, last_watched_episode))
             return True
         except Exception as e:
+            metrics.record_error("db.add_to_watchlist", e)
             return False
 
     def get_watchlist(self, user_id):
         """Retrieve all watchlist entries for a given user. Returns a list of records or False if there is an error."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM watchlist WHERE user_id = ?", (user_id,))
-            results = cursor.fetchall()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("SELECT * FROM watchlist WHERE user_id = ?", (user_id,))
+                results = cursor.fetchall()
+            return results
+        except Exception as e:
+            metrics.record_error("db.get_watchlist", e)
+            return False
+
+    def get_watchlist_page(self, user_id, sort="next_air", after=None, limit=WATCHLIST_PAGE_SIZE, now=None):
+        """Retrieve one page of a user's watchlist as WatchlistEntry rows, joined with anime and releases in one query.
+
+        Pages are keyset-paginated: `after` is the value returned with the previous page. Returns a WatchlistPage,
+        or False if there is an error.
+        """
+        try:
+            key = WATCHLIST_SORTS[sort]
+            now = now or datetime.now(timezone.utc)
+            # One row past the page tells whether there is a next page
+            params = {"user_id": user_id, "now": format_release_date(now),
+                      "minute": format_release_date(now.replace(second=0, microsecond=0)),
+                      "minute_of_week": minute_of_week(now), "week": MINUTES_PER_WEEK, "limit": limit + 1}
+            keyset = ""
+            if after is not None:
+                keyset = "WHERE (sort_key, id) > (:after_key, :after_id)"
+                params["after_key"], params["after_id"] = after
+            with self.transaction() as cursor:
+                # aired: latest episode out (or the episode count of finished shows without releases);
+                # next_air: next recorded release, else the next weekly slot of airing shows with episodes left
+                cursor.execute(f'''
+                WITH entries AS (
+                    SELECT w.id, w.anime_id, a.mal_id, a.title, a.status, a.episodes, w.last_watched_episode,
+                        COALESCE((SELECT r.episode_number FROM releases r WHERE r.anime_id = w.anime_id AND r.release_date <= :now
+                                  ORDER BY r.release_date DESC LIMIT 1),
+                                 CASE WHEN a.status = 'Finished Airing' THEN a.episodes END) AS aired,
+                        (SELECT MIN(r.release_date) FROM releases r WHERE r.anime_id = w.anime_id AND r.release_date > :now)
+                            AS next_release,
+                        a.broadcast_utc_minute
+                    FROM watchlist w
+                    JOIN anime a ON a.id = w.anime_id
+                    WHERE w.user_id = :user_id
+                ), keyed AS (
+                    SELECT *, MAX(COALESCE(aired, 0) - COALESCE(last_watched_episode, 0), 0) AS unwatched,
+                        COALESCE(next_release,
+                                 CASE WHEN status = 'Currently Airing' AND broadcast_utc_minute IS NOT NULL
+                                           AND (episodes IS NULL OR COALESCE(aired, 0) < episodes)
+                                      THEN datetime(:minute, '+' || ((broadcast_utc_minute - :minute_of_week + :week) % :week)
+                                                    || ' minutes') END) AS next_air
+                    FROM entries
+                ), sorted AS (
+                    SELECT *, {key} AS sort_key FROM keyed
+                )
+                SELECT {", ".join(WatchlistEntry._fields)}, sort_key FROM sorted {keyset}
+                ORDER BY sort_key, id
+                LIMIT :limit
+                ''', params)
+                rows = cursor.fetchall()
+            entries = [WatchlistEntry(*row[:-1]) for row in rows[:limit]]
+            return WatchlistPage(entries, (rows[limit - 1][-1], rows[limit - 1][0]) if len(rows) > limit else None)
+        except Exception as e:
+            metrics.record_error("db.get_watchlist_page", e)
+            return False
+
+    def get_watchlist_ids(self, user_id, anime_ids):
+        """Map anime ids already on a user's watchlist to their watchlist entry ids. Returns a dict or False if there is an error."""
+        try:
+            results = {}
+            with self.transaction() as cursor:
+                for _, chunk in _chunked(anime_ids, BATCH_CHUNK_SIZE):
+                    cursor.execute(f"SELECT anime_id, id FROM watchlist WHERE user_id = ? AND anime_id IN ({','.join('?' * len(chunk))})",
+                                   (user_id, *chunk))
+                    results.update(cursor.fetchall())
             return results
         except Exception as e:
+            metrics.record_error("db.get_watchlist_ids", e)
             return False
 
     def update_watchlist(self, watchlist_id, last_watched_episode):
         """Update a watchlist entry's last watched episode. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("UPDATE watchlist SET last_watched_episode = ? WHERE id = ?", (last_watched_episode, watchlist_id))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("UPDATE watchlist SET last_watched_episode = ? WHERE id = ?", (last_watched_episode, watchlist_id))
             return True
         except Exception as e:
+            metrics.record_error("db.update_watchlist", e)
             return False
 
     def delete_from_watchlist(self, watchlist_id):
         """Delete a watchlist entry by id. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM watchlist WHERE id = ?", (watchlist_id,))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("DELETE FROM watchlist WHERE id = ?", (watchlist_id,))
             return True
         except Exception as e:
+            metrics.record_error("db.delete_from_watchlist", e)
             return False
 
     # -------------------------
@@ -257,26 +971,24 @@ class Database:
     def add_release(self, anime_id, episode_number, release_date, broadcast):
         """Add a new release entry for an anime. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("INSERT INTO releases (anime_id, episode_number, release_date, broadcast) VALUES (?,?,?,?)", 
-                           (anime_id, episode_number, release_date, broadcast))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute(f"INSERT INTO releases (anime_id, episode_number, release_date, broadcast, updated_on) VALUES (?,?,?,?,{NOW_TIMESTAMP})", 
+                               (anime_id, episode_number, release_date, broadcast))
+            self.notify_write("releases", [cursor.lastrowid])
             return True
         except Exception as e:
+            metrics.record_error("db.add_release", e)
             return False
 
     def get_release(self, release_id):
         """Retrieve a release record by id. Returns the record or False if there is an error."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM releases WHERE id = ?", (release_id,))
-            result = cursor.fetchone()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("SELECT * FROM releases WHERE id = ?", (release_id,))
+                result = cursor.fetchone()
             return result
         except Exception as e:
+            metrics.record_error("db.get_release", e)
             return False
 
     def update_release(self, release_id, **kwargs):
@@ -291,27 +1003,248 @@ class Database:
                 return False
             values.append(release_id)
             sql = f"UPDATE releases SET {', '.join(columns)} WHERE id = ?"
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute(sql, tuple(values))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute(sql, tuple(values))
+            self.notify_write("releases", [release_id])
             return True
         except Exception as e:
+            metrics.record_error("db.update_release", e)
             return False
 
     def delete_release(self, release_id):
         """Delete a release record by id. Returns True if successful."""
         try:
-            conn = self._connect()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM releases WHERE id = ?", (release_id,))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute("DELETE FROM releases WHERE id = ?", (release_id,))
+            self.notify_write("releases", [release_id])
+            return True
+        except Exception as e:
+            metrics.record_error("db.delete_release", e)
+            return False
+
+    def get_pending_releases(self):
+        """Retrieve (anime_id, episode_number, release_date) of the earliest unannounced release of each anime. Returns a list or False if there is an error."""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('''
+                SELECT anime_id, MIN(episode_number), release_date FROM releases
+                WHERE announced_on IS NULL GROUP BY anime_id
+                ''')
+                results = cursor.fetchall()
+            return results
+        except Exception as e:
+            metrics.record_error("db.get_pending_releases", e)
+            return False
+
+    def get_last_announced_episodes(self):
+        """Retrieve a dict of anime_id -> highest announced episode number. Returns False if there is an error."""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute("SELECT anime_id, MAX(episode_number) FROM releases WHERE announced_on IS NOT NULL GROUP BY anime_id")
+                results = dict(cursor.fetchall())
+            return results
+        except Exception as e:
+            metrics.record_error("db.get_last_announced_episodes", e)
+            return False
+
+    def mark_releases_announced(self, releases, announced_on):
+        """Mark (anime_id, episode_number) pairs as announced at the given timestamp. Returns True if successful."""
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany("UPDATE releases SET announced_on = ? WHERE anime_id = ? AND episode_number = ?",
+                                   ((announced_on, anime_id, episode) for anime_id, episode in releases))
+            self.notify_write("releases")
+            return True
+        except Exception as e:
+            metrics.record_error("db.mark_releases_announced", e)
+            return False
+
+    def delete_pending_releases(self, releases):
+        """Delete the unannounced releases of (anime_id, episode_number) pairs. Returns True if successful."""
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany("DELETE FROM releases WHERE anime_id = ? AND episode_number = ? AND announced_on IS NULL",
+                                   list(releases))
+            self.notify_write("releases")
             return True
         except Exception as e:
+            metrics.record_error("db.delete_pending_releases", e)
+            return False
+
+    # -----------------
+    # Batch Operations
+    # -----------------
+    def _insert_many(self, sql, rows):
+        """Stream rows through executemany in one transaction, isolating rows that violate constraints.
+
+        Each chunk runs inside a savepoint; if it hits an IntegrityError only that
+        chunk is rolled back and replayed row by row so the offending rows can be
+        reported while the rest of the batch is kept.
+        """
+        inserted = 0
+        conflicts = []
+        with self.transaction() as cursor:
+            if not cursor.connection.in_transaction:
+                cursor.execute("BEGIN")
+            for offset, chunk in _chunked(rows, BATCH_CHUNK_SIZE):
+                cursor.execute("SAVEPOINT batch_chunk")
+                try:
+                    cursor.executemany(sql, chunk)
+                    inserted += len(chunk)
+                except sqlite3.IntegrityError:
+                    cursor.execute("ROLLBACK TO batch_chunk")
+                    for index, row in enumerate(chunk, start=offset):
+                        try:
+                            cursor.execute(sql, row)
+                            inserted += 1
+                        except sqlite3.IntegrityError as e:
+                            conflicts.append((index, row, str(e)))
+                cursor.execute("RELEASE batch_chunk")
+        return BatchResult(inserted, conflicts)
+
+    def _update_many(self, table, ids, kwargs):
+        """Apply the same column updates to every row whose id is in ids. Returns the number of rows changed."""
+        if not kwargs:
+            return False
+        assignments = ", ".join(f"{key} = ?" for key in kwargs)
+        values = tuple(kwargs.values())
+        changed = 0
+        with self.transaction() as cursor:
+            for _, chunk in _chunked(ids, BATCH_CHUNK_SIZE):
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"UPDATE {table} SET {assignments} WHERE id IN ({placeholders})", values + tuple(chunk))
+                changed += cursor.rowcount
+        return changed
+
+    def _delete_many(self, table, ids):
+        """Delete every row whose id is in ids. Returns the number of rows deleted."""
+        deleted = 0
+        with self.transaction() as cursor:
+            for _, chunk in _chunked(ids, BATCH_CHUNK_SIZE):
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", tuple(chunk))
+                deleted += cursor.rowcount
+        return deleted
+
+    def create_anime_many(self, anime_rows):
+        """Insert many anime (dicts like parse_anime_info output, or tuples in ANIME_COLUMNS order).
+
+        Returns a BatchResult; rows rejected for e.g. a duplicate mal_id are listed in conflicts.
+        Returns False if the batch could not be written at all.
+        """
+        try:
+            columns = ANIME_COLUMNS + BROADCAST_COLUMNS
+            sql = f"INSERT INTO anime ({', '.join(columns)}) VALUES ({','.join('?' * len(columns))})"
+            broadcast_index = ANIME_COLUMNS.index("broadcast")
+            rows = (row + broadcast_columns(row[broadcast_index]) for row in _as_rows(anime_rows, ANIME_COLUMNS))
+            result = self._insert_many(sql, rows)
+            if result.inserted:
+                self.notify_write("anime")
+            return result
+        except Exception as e:
+            metrics.record_error("db.create_anime_many", e)
+            return False
+
+    def add_to_watchlist_many(self, entries):
+        """Insert many watchlist entries given as (user_id, anime_id[, last_watched_episode]) tuples or dicts. Returns a BatchResult or False."""
+        try:
+            sql = f"INSERT INTO watchlist (user_id, anime_id, last_watched_episode, updated_on) VALUES (?,?,?,{NOW_TIMESTAMP})"
+            return self._insert_many(sql, _as_rows(entries, WATCHLIST_COLUMNS, {"last_watched_episode": 0}))
+        except Exception as e:
+            metrics.record_error("db.add_to_watchlist_many", e)
+            return False
+
+    def add_releases_many(self, releases):
+        """Insert many releases given as (anime_id, episode_number, release_date, broadcast) tuples or dicts. Returns a BatchResult or False."""
+        try:
+            sql = f"INSERT INTO releases (anime_id, episode_number, release_date, broadcast, updated_on) VALUES (?,?,?,?,{NOW_TIMESTAMP})"
+            result = self._insert_many(sql, _as_rows(releases, RELEASE_COLUMNS))
+            if result.inserted:
+                self.notify_write("releases")
+            return result
+        except Exception as e:
+            metrics.record_error("db.add_releases_many", e)
+            return False
+
+    def update_anime_many(self, anime_ids, **kwargs):
+        """Set the given fields (ANIME_COLUMNS only) on every anime in anime_ids. Returns the number of rows changed or False."""
+        try:
+            if not kwargs or not set(kwargs) <= set(ANIME_COLUMNS):
+                return False
+            anime_ids = list(anime_ids)
+            kwargs["content_hash"] = None
+            if "broadcast" in kwargs:
+                kwargs.update(zip(BROADCAST_COLUMNS, broadcast_columns(kwargs["broadcast"])))
+            changed = self._update_many("anime", anime_ids, kwargs)
+            self.notify_write("anime", anime_ids)
+            return changed
+        except Exception as e:
+            metrics.record_error("db.update_anime_many", e)
+            return False
+
+    def update_watchlist_many(self, updates):
+        """Update last watched episodes from (watchlist_id, last_watched_episode) pairs. Returns the number of rows changed or False."""
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany("UPDATE watchlist SET last_watched_episode = ? WHERE id = ?",
+                                   ((episode, watchlist_id) for watchlist_id, episode in updates))
+                return cursor.rowcount
+        except Exception as e:
+            metrics.record_error("db.update_watchlist_many", e)
+            return False
+
+    def update_releases_many(self, release_ids, **kwargs):
+        """Set the given fields on every release in release_ids. Returns the number of rows changed or False."""
+        try:
+            release_ids = list(release_ids)
+            changed = self._update_many("releases", release_ids, kwargs)
+            self.notify_write("releases", release_ids)
+            return changed
+        except Exception as e:
+            metrics.record_error("db.update_releases_many", e)
+            return False
+
+    def delete_users_many(self, user_ids):
+        """Delete every user in user_ids. Returns the number of rows deleted or False."""
+        try:
+            return self._delete_many("users", user_ids)
+        except Exception as e:
+            metrics.record_error("db.delete_users_many", e)
+            return False
+
+    def delete_anime_many(self, anime_ids):
+        """Delete every anime in anime_ids. Returns the number of rows deleted or False."""
+        try:
+            anime_ids = list(anime_ids)
+            deleted = self._delete_many("anime", anime_ids)
+            self.notify_write("anime", anime_ids)
+            return deleted
+        except Exception as e:
+            metrics.record_error("db.delete_anime_many", e)
+            return False
+
+    def delete_from_watchlist_many(self, watchlist_ids):
+        """Delete every watchlist entry in watchlist_ids. Returns the number of rows deleted or False."""
+        try:
+            return self._delete_many("watchlist", watchlist_ids)
+        except Exception as e:
+            metrics.record_error("db.delete_from_watchlist_many", e)
+            return False
+
+    def delete_releases_many(self, release_ids):
+        """Delete every release in release_ids. Returns the number of rows deleted or False."""
+        try:
+            release_ids = list(release_ids)
+            deleted = self._delete_many("releases", release_ids)
+            self.notify_write("releases", release_ids)
+            return deleted
+        except Exception as e:
+            metrics.record_error("db.delete_releases_many", e)
             return False
 
+# Time every public operation into db.<method> histograms (connection and listener plumbing excluded)
+metrics.instrument(Database, "db", exclude=("transaction", "stream", "close", "add_write_listener",
+                                            "remove_write_listener", "notify_write"))
 
 # ----------------------------------------------------------------------
 # If file ran directly, initialize the database                        
@@ -0,0 +1,221 @@
+# ======================================================================
+# File: exporter.py
+# Description: This file contains streaming exporters for watchlists and
+# the release calendar (CSV, JSON Lines, MAL-compatible XML, iCalendar).
+#
+# Rows are read by iterating the SQLite cursor and written one at a time,
+# so memory stays flat whatever the table size. In incremental mode only
+# rows changed since the previous export with the same settings are written.
+# ======================================================================
+
+import csv
+import json
+from datetime import datetime, timezone
+from html import escape
+from db import Database
+import metrics
+
+# Columns of the exported watchlist rows
+WATCHLIST_FIELDS = ("user", "mal_id", "title", "episodes", "status", "last_watched_episode", "added_on", "updated_on")
+
+# Columns of the exported release rows
+RELEASE_FIELDS = ("mal_id", "title", "episode_number", "release_date", "broadcast", "updated_on")
+
+# Formats available for each kind of export
+EXPORT_FORMATS = {
+    "watchlist": ("csv", "jsonl", "mal-xml"),
+    "releases": ("csv", "jsonl", "ical"),
+}
+
+# Length of an episode event in calendar exports
+EPISODE_DURATION = "PT30M"
+
+# ----------------------------------------------------------------------
+# Queries
+# ----------------------------------------------------------------------
+
+def _where(filters) -> tuple:
+    """Build a WHERE clause from the (condition, value) pairs whose value is given, so each filter can use its index."""
+    filters = [(condition, value) for condition, value in filters if value is not None]
+    if not filters:
+        return "", ()
+    return "WHERE " + " AND ".join(condition for condition, _ in filters), tuple(value for _, value in filters)
+
+def iter_watchlist(db: Database, mal_user_id: str = None, since: str = None):
+    """Stream watchlist rows (see WATCHLIST_FIELDS) joined with their user and anime, in watchlist index order."""
+    where, params = _where((("u.mal_user_id = ?", mal_user_id), ("w.updated_on >= ?", since)))
+    sql = f'''
+    SELECT u.mal_user_id, a.mal_id, a.title, a.episodes, a.status, w.last_watched_episode, w.added_on, w.updated_on
+    FROM watchlist w
+    JOIN users u ON u.id = w.user_id
+    JOIN anime a ON a.id = w.anime_id
+    {where}
+    ORDER BY w.user_id, w.anime_id, w.id
+    '''
+    return db.stream(sql, params)
+
+def iter_releases(db: Database, mal_user_id: str = None, since: str = None, upcoming_only: bool = True):
+    """Stream release rows (see RELEASE_FIELDS) by release date, limited to a user's watchlist when mal_user_id is given."""
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if upcoming_only else None
+    where, params = _where((
+        ("r.release_date >= ?", now),
+        ("r.updated_on >= ?", since),
+        ("r.anime_id IN (SELECT w.anime_id FROM watchlist w JOIN users u ON u.id = w.user_id WHERE u.mal_user_id = ?)",
+         mal_user_id),
+    ))
+    sql = f'''
+    SELECT a.mal_id, a.title, r.episode_number, r.release_date, r.broadcast, r.updated_on
+    FROM releases r
+    JOIN anime a ON a.id = r.anime_id
+    {where}
+    ORDER BY r.release_date, r.anime_id, r.id
+    '''
+    return db.stream(sql, params)
+
+# ----------------------------------------------------------------------
+# Writers
+# ----------------------------------------------------------------------
+
+def write_csv(rows, fields, out) -> int:
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+def write_jsonl(rows, fields, out) -> int:
+    count = 0
+    for row in rows:
+        out.write(json.dumps(dict(zip(fields, row)), ensure_ascii=False))
+        out.write("\n")
+        count += 1
+    return count
+
+def write_mal_xml(rows, fields, out, mal_user_id: str) -> int:
+    """Write watchlist rows in the layout of a MAL list export (importable by MAL and by mal_import)."""
+    out.write('<?xml version="1.0" encoding="UTF-8" ?>\n<myanimelist>\n')
+    out.write(f"\t<myinfo>\n\t\t<user_name>{escape(mal_user_id, quote=False)}</user_name>\n\t\t<user_export_type>1</user_export_type>\n\t</myinfo>\n")
+    count = 0
+    for _, mal_id, title, episodes, _, watched, *_ in rows:
+        status = "Completed" if episodes and (watched or 0) >= episodes else "Watching"
+        out.write(
+            "\t<anime>\n"
+            f"\t\t<series_animedb_id>{mal_id}</series_animedb_id>\n"
+            f"\t\t<series_title>{escape(title or '', quote=False)}</series_title>\n"
+            f"\t\t<series_episodes>{episodes or 0}</series_episodes>\n"
+            f"\t\t<my_watched_episodes>{watched or 0}</my_watched_episodes>\n"
+            f"\t\t<my_status>{status}</my_status>\n"
+            "\t</anime>\n"
+        )
+        count += 1
+    out.write("</myanimelist>\n")
+    return count
+
+def _ical_text(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+def _ical_line(line: str) -> str:
+    """Fold a content line at 75 octets as required by RFC 5545."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts, chunk = [], b""
+    for char in line:
+        piece = char.encode("utf-8")
+        if len(chunk) + len(piece) > (75 if not parts else 74):
+            parts.append(chunk.decode("utf-8"))
+            chunk = b""
+        chunk += piece
+    parts.append(chunk.decode("utf-8"))
+    return "\r\n ".join(parts) + "\r\n"
+
+def _ical_start(release_date) -> str:
+    """DTSTART value of a release_date ("YYYY-MM-DD HH:MM:SS" UTC, or ISO 8601), or None if it is missing or unreadable."""
+    if not release_date:
+        return None
+    try:
+        moment = datetime.strptime(release_date, "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        try:
+            moment = datetime.fromisoformat(release_date)
+        except (TypeError, ValueError):
+            return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y%m%dT%H%M%SZ")
+
+def write_ical(rows, fields, out) -> int:
+    """Write release rows as an iCalendar feed with one event per episode.
+
+    Releases without a readable release_date cannot be placed on a calendar: they are skipped and counted in the
+    export.skipped_rows metric instead of aborting the export.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//AniNotif//Release Calendar//EN\r\nCALSCALE:GREGORIAN\r\n")
+    count = 0
+    for mal_id, title, episode, release_date, broadcast, _ in rows:
+        start = _ical_start(release_date)
+        if start is None:
+            metrics.increment("export.skipped_rows")
+            continue
+        out.write("BEGIN:VEVENT\r\n")
+        out.write(_ical_line(f"UID:release-{mal_id}-{episode}@aninotif"))
+        out.write(f"DTSTAMP:{stamp}\r\nDTSTART:{start}\r\nDURATION:{EPISODE_DURATION}\r\n")
+        out.write(_ical_line(f"SUMMARY:{_ical_text(f'{title} - Episode {episode}')}"))
+        if broadcast:
+            out.write(_ical_line(f"DESCRIPTION:{_ical_text(f'Broadcast: {broadcast}')}"))
+        out.write("END:VEVENT\r\n")
+        count += 1
+    out.write("END:VCALENDAR\r\n")
+    return count
+
+# ----------------------------------------------------------------------
+# Export Entry Point
+# ----------------------------------------------------------------------
+
+def export(db: Database, kind: str, export_format: str, out, mal_user_id: str = None, incremental: bool = False) -> int:
+    """Stream a watchlist or releases export to `out`. Returns the number of rows written.
+
+    In incremental mode the previous export with the same kind, format and
+    user is looked up in export_state and only rows updated since then are
+    written; the state is advanced once the export has completed.
+    """
+    if export_format not in EXPORT_FORMATS[kind]:
+        raise ValueError(f"{export_format} is not available for {kind} exports")
+    if export_format == "mal-xml" and not mal_user_id:
+        raise ValueError("MAL XML exports hold a single user's list; pass a MAL user name")
+
+    state_name = f"{kind}:{export_format}:{mal_user_id or '*'}"
+    since = None
+    with db.transaction() as cursor:
+        cursor.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now')")
+        started = cursor.fetchone()[0]
+        if incremental:
+            cursor.execute("SELECT last_exported_on FROM export_state WHERE name = ?", (state_name,))
+            row = cursor.fetchone()
+            since = row[0] if row else None
+
+    if kind == "watchlist":
+        rows, fields = iter_watchlist(db, mal_user_id, since), WATCHLIST_FIELDS
+    else:
+        # Incremental calendar exports also carry past episodes whose rows changed
+        rows, fields = iter_releases(db, mal_user_id, since, upcoming_only=since is None), RELEASE_FIELDS
+
+    if export_format == "csv":
+        count = write_csv(rows, fields, out)
+    elif export_format == "jsonl":
+        count = write_jsonl(rows, fields, out)
+    elif export_format == "mal-xml":
+        count = write_mal_xml(rows, fields, out, mal_user_id)
+    else:
+        count = write_ical(rows, fields, out)
+
+    if incremental:
+        with db.transaction() as cursor:
+            cursor.execute('''
+            INSERT INTO export_state (name, last_exported_on) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET last_exported_on = excluded.last_exported_on
+            ''', (state_name, started))
+    return count
@@ -0,0 +1,56 @@
+# ======================================================================
+# File: lazy.py
+# Description: This file contains the helpers that keep start-up fast by
+# loading heavy dependencies (requests, asyncio, rich) only when they are
+# first used.
+#
+# How lazy loading works:
+#
+# - lazy_import(name) returns the module object at once but only runs the
+#   module's code on its first attribute access (importlib.util.LazyLoader),
+#   so a module-level `requests = lazy_import("requests")` costs nothing to
+#   commands that never reach the network.
+# - DeferredConsole stands in for rich's Console and creates the real one
+#   the first time it is used.
+# ======================================================================
+
+import importlib.util
+import sys
+
+def lazy_import(name: str):
+    """Return the module `name`, deferring its execution until an attribute is read.
+
+    A module that is already imported is returned as is. Parent packages of a
+    dotted name are imported right away.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+class DeferredConsole:
+    """rich Console created (and rich imported) on first use; accepts the Console arguments."""
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._console = None
+
+    def __getattr__(self, name):
+        if self._console is None:
+            from rich.console import Console
+            self._console = Console(**self._kwargs)
+        return getattr(self._console, name)
+
+    # `with console:` (used by rich's Live and Progress) looks these up on the class, not through __getattr__
+    def __enter__(self):
+        return self.__getattr__("__enter__")()
+
+    def __exit__(self, *exc_info):
+        return self.__getattr__("__exit__")(*exc_info)
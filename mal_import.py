@@ -0,0 +1,243 @@
+# ======================================================================
+# File: mal_import.py
+# Description: This file contains the streaming importer for MyAnimeList
+# list exports (XML or CSV, optionally gzipped).
+#
+# How the importer works:
+#
+# - The export is parsed incrementally (iterparse / csv reader), so memory
+#   stays constant however large the file is.
+# - Entries are processed in batches: MAL ids are resolved against the local
+#   anime table first and only the misses are fetched from Jikan (or built
+#   from the export itself in offline mode).
+# - Each batch writes anime and watchlist rows and advances the checkpoint in
+#   a single transaction, so an interrupted import resumes where it stopped.
+# ======================================================================
+
+import csv
+import gzip
+import io
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from itertools import islice
+from anime_raw import RawPayloadStore
+from api_requests import fetch_anime_many, parse_anime_info
+from db import Database
+from lazy import DeferredConsole, lazy_import
+
+# Loaded on first use: offline imports never start an event loop
+asyncio = lazy_import("asyncio")
+
+console = DeferredConsole()
+
+# Entries written per transaction (and per checkpoint)
+IMPORT_BATCH_SIZE = 500
+
+# An entry of a MAL list export
+MalEntry = namedtuple("MalEntry", ["mal_id", "title", "episodes", "watched", "status"])
+
+# CSV column aliases accepted for each field (MAL-style exports and common converters)
+CSV_ALIASES = {
+    "mal_id": ("series_animedb_id", "anime_id", "mal_id", "id"),
+    "title": ("series_title", "title", "name"),
+    "episodes": ("series_episodes", "episodes", "total_episodes"),
+    "watched": ("my_watched_episodes", "watched_episodes", "last_watched_episode", "progress"),
+    "status": ("my_status", "status"),
+}
+
+# Import outcome
+ImportReport = namedtuple("ImportReport", ["records", "skipped", "anime_created", "anime_fetched", "watchlist_added",
+                                           "watchlist_updated", "errors", "elapsed", "rows_per_sec"])
+
+# ----------------------------------------------------------------------
+# Streaming Parsers
+# ----------------------------------------------------------------------
+
+def _to_int(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+def open_export(path: str):
+    """Open an export as (raw file, text stream, format), transparently un-gzipping it."""
+    raw = open(path, "rb")
+    gzipped = raw.peek(2)[:2] == b"\x1f\x8b"
+    binary = gzip.GzipFile(fileobj=raw) if gzipped else raw
+    head = binary.peek(256)[:256].decode("utf-8", "ignore").lstrip("\ufeff \t\r\n")
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    return raw, text, "xml" if head.startswith("<") else "csv"
+
+def iter_xml_entries(stream):
+    """Yield (user_name, MalEntry) from a MAL XML export, clearing parsed elements as it goes."""
+    user_name = None
+    context = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event != "end":
+            continue
+        if element.tag == "user_name":
+            user_name = (element.text or "").strip() or None
+        elif element.tag == "anime":
+            fields = {child.tag: (child.text or "").strip() for child in element}
+            mal_id = _to_int(fields.get("series_animedb_id"))
+            if mal_id is not None:
+                yield user_name, MalEntry(mal_id, fields.get("series_title") or None, _to_int(fields.get("series_episodes")),
+                                          _to_int(fields.get("my_watched_episodes")) or 0, fields.get("my_status") or None)
+            element.clear()
+            root.clear()
+
+def iter_csv_entries(stream):
+    """Yield (None, MalEntry) from a CSV export whose header uses any of CSV_ALIASES."""
+    reader = csv.reader(stream)
+    header = [column.strip().lower() for column in next(reader, [])]
+    positions = {}
+    for field, aliases in CSV_ALIASES.items():
+        positions[field] = next((header.index(alias) for alias in aliases if alias in header), None)
+    if positions["mal_id"] is None:
+        raise ValueError("CSV export has no MAL id column (expected one of: " + ", ".join(CSV_ALIASES["mal_id"]) + ")")
+
+    def field(row, name):
+        index = positions[name]
+        return row[index].strip() if index is not None and index < len(row) else None
+
+    for row in reader:
+        mal_id = _to_int(field(row, "mal_id"))
+        if mal_id is not None:
+            yield None, MalEntry(mal_id, field(row, "title") or None, _to_int(field(row, "episodes")),
+                                 _to_int(field(row, "watched")) or 0, field(row, "status") or None)
+
+# ----------------------------------------------------------------------
+# Importer
+# ----------------------------------------------------------------------
+
+class MalImporter:
+    """Import a MAL export into users, anime and watchlist in checkpointed batches."""
+    def __init__(self, db: Database = None, offline: bool = False, batch_size: int = IMPORT_BATCH_SIZE):
+        self.db = db or Database()
+        self.offline = offline
+        self.batch_size = batch_size
+        self.raw = RawPayloadStore(self.db)
+
+    @staticmethod
+    def checkpoint_key(path: str) -> str:
+        """Identify an export by path and size so a different file never resumes a stale checkpoint."""
+        return f"{os.path.abspath(path)}:{os.path.getsize(path)}"
+
+    def _checkpoint(self, source: str):
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT records_done, completed FROM import_checkpoints WHERE source = ?", (source,))
+            return cursor.fetchone() or (0, 0)
+
+    def _resolve_missing(self, entries):
+        """Build anime rows for MAL ids not in the catalog, from Jikan (or the export itself). Returns (rows, fetched count)."""
+        fetched = {}
+        if not self.offline and entries:
+            report = asyncio.run(fetch_anime_many([entry.mal_id for entry in entries]))
+            fetched = report.results
+            self.raw.store_many(fetched.values())
+        rows = []
+        for entry in entries:
+            if entry.mal_id in fetched:
+                rows.append(parse_anime_info(fetched[entry.mal_id]))
+            else:
+                # Offline or not found on Jikan: keep what the export knows so the watchlist row can still be linked
+                rows.append({"mal_id": entry.mal_id, "title": entry.title or f"MAL #{entry.mal_id}", "episodes": entry.episodes})
+        return rows, len(fetched)
+
+    def _import_batch(self, source: str, user_id: int, batch, records_done: int, totals: dict):
+        """Write one batch of entries and advance the checkpoint, all in one transaction."""
+        local = self.db.get_anime_ids_by_mal_ids([entry.mal_id for _, entry in batch])
+        missing = list({entry.mal_id: entry for _, entry in batch if entry.mal_id not in local}.values())
+        rows, fetched = self._resolve_missing(missing)
+        with self.db.transaction() as cursor:
+            if rows:
+                result = self.db.create_anime_many(rows)
+                # On failure (False) the entries stay without an anime id and are counted as errors below
+                if result is not False:
+                    totals["anime_created"] += result.inserted
+                    totals["errors"] += len(result.conflicts)
+                local.update(self.db.get_anime_ids_by_mal_ids([row["mal_id"] for row in rows]))
+            totals["anime_fetched"] += fetched
+
+            progress = {}
+            owners = {}
+            for user_name, entry in batch:
+                if user_id:
+                    owner = user_id
+                elif user_name not in owners:
+                    owner = owners[user_name] = self.db.get_or_create_user(user_name)
+                else:
+                    owner = owners[user_name]
+                if entry.mal_id in local and owner:
+                    progress[(owner, local[entry.mal_id])] = entry.watched
+            for owner in {owner for owner, _ in progress}:
+                anime_ids = [anime_id for (user, anime_id) in progress if user == owner]
+                existing = self.db.get_watchlist_ids(owner, anime_ids)
+                updates = [(existing[anime_id], progress[(owner, anime_id)]) for anime_id in anime_ids if anime_id in existing]
+                inserts = [(owner, anime_id, progress[(owner, anime_id)]) for anime_id in anime_ids if anime_id not in existing]
+                if updates:
+                    if self.db.update_watchlist_many(updates) is False:
+                        totals["errors"] += len(updates)
+                    else:
+                        totals["watchlist_updated"] += len(updates)
+                if inserts:
+                    result = self.db.add_to_watchlist_many(inserts)
+                    if result is False:
+                        totals["errors"] += len(inserts)
+                    else:
+                        totals["watchlist_added"] += result.inserted
+                        totals["errors"] += len(result.conflicts)
+            totals["errors"] += sum(1 for _, entry in batch if entry.mal_id not in local)
+
+            cursor.execute('''
+            INSERT INTO import_checkpoints (source, records_done, updated_on) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(source) DO UPDATE SET records_done = excluded.records_done, completed = 0,
+                updated_on = CURRENT_TIMESTAMP
+            ''', (source, records_done))
+
+    def run(self, path: str, mal_user_id: str = None, restart: bool = False, show_progress: bool = True) -> ImportReport:
+        """Import the export at path, resuming from its checkpoint unless restart is set."""
+        from rich.progress import Progress, BarColumn, TextColumn, TimeRemainingColumn
+        source = self.checkpoint_key(path)
+        if restart:
+            with self.db.transaction() as cursor:
+                cursor.execute("DELETE FROM import_checkpoints WHERE source = ?", (source,))
+        skip, completed = self._checkpoint(source)
+        if completed:
+            skip = 0
+        user_id = self.db.get_or_create_user(mal_user_id) if mal_user_id else None
+
+        raw, stream, export_format = open_export(path)
+        entries = iter_xml_entries(stream) if export_format == "xml" else iter_csv_entries(stream)
+        if export_format == "csv" and user_id is None:
+            raise ValueError("CSV exports do not name their owner; pass a MAL user name")
+
+        totals = dict(anime_created=0, anime_fetched=0, watchlist_added=0, watchlist_updated=0, errors=0)
+        records = 0
+        start = time.perf_counter()
+        with raw, Progress(TextColumn("[cyan]Importing"), BarColumn(), TextColumn("{task.fields[rows]} rows"),
+                           TimeRemainingColumn(), console=console, disable=not show_progress) as progress:
+            task = progress.add_task("import", total=os.path.getsize(path), rows=0)
+            # Records before the checkpoint are parsed but not written again
+            for _ in islice(entries, skip):
+                pass
+            records = skip
+            while True:
+                batch = list(islice(entries, self.batch_size))
+                if not batch:
+                    break
+                if user_id is None and batch[0][0] is None:
+                    raise ValueError("The XML export has no <user_name>; pass a MAL user name")
+                records += len(batch)
+                self._import_batch(source, user_id, batch, records, totals)
+                progress.update(task, completed=raw.tell(), rows=records)
+            progress.update(task, completed=os.path.getsize(path), rows=records)
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE import_checkpoints SET completed = 1 WHERE source = ?", (source,))
+
+        elapsed = time.perf_counter() - start
+        imported = records - skip
+        return ImportReport(records, skip, elapsed=elapsed, rows_per_sec=imported / elapsed if elapsed else 0.0, **totals)
@@ -0,0 +1,302 @@
+# ======================================================================
+# File: metrics.py
+# Description: This file contains the lightweight instrumentation shared by
+# the database, Jikan and notification code: latency histograms, counters,
+# a JSON-lines event log and opt-in profiling of the release cycle.
+#
+# How metrics are collected:
+#
+# - observe(name, seconds) adds a sample to a log-bucketed histogram (within
+#   about 4.5%), so percentiles need neither stored samples nor sorting.
+#   timer()/timed() wrap a block or a function; instrument() times every
+#   public method of a class (used for Database).
+# - increment() bumps a counter; record_error() counts an exception by scope
+#   and type (errors.<scope>.<Type>) and logs it, for code that reports
+#   failures by returning False.
+# - With ANINOTIF_METRICS_LOG set to a file, events are appended to it as
+#   JSON lines and the collected histograms and counters are written there
+#   when the process exits; the `stats` command merges them into
+#   p50/p95/p99 tables.
+# - With ANINOTIF_PROFILE set to "cprofile" or "sample", profiled() blocks
+#   (the release cycle) are profiled into ANINOTIF_PROFILE_DIR: cProfile
+#   .prof files, or folded stacks from a sampling thread (flame graph input).
+# ======================================================================
+
+import atexit
+import functools
+import inspect
+import json
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# JSON-lines file receiving events and metric snapshots (unset = keep metrics in memory only)
+LOG_PATH = os.environ.get("ANINOTIF_METRICS_LOG") or None
+
+# Profiler used by profiled() blocks: "cprofile", "sample" or unset (off)
+PROFILE_MODE = os.environ.get("ANINOTIF_PROFILE") or None
+
+# Directory receiving profile files
+PROFILE_DIR = os.environ.get("ANINOTIF_PROFILE_DIR", ".")
+
+# Seconds between stack samples in "sample" mode
+SAMPLE_INTERVAL = 0.005
+
+# Histogram buckets: upper bounds growing by 2 ** (1/8) from 1 microsecond; the last bucket collects the rest
+BUCKET_BASE = 1e-6
+BUCKET_GROWTH = 2 ** 0.125
+BUCKET_COUNT = 256
+
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+
+def percentile(values, pct: float) -> float:
+    """Return the pct-th percentile (nearest rank) of values, or 0.0 if there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+# ----------------------------------------------------------------------
+# Histograms and Counters
+# ----------------------------------------------------------------------
+
+class Histogram:
+    """Latency histogram over fixed logarithmic buckets; mergeable and serialisable."""
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = {}    # bucket index -> samples
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        index = 0 if seconds <= BUCKET_BASE else min(BUCKET_COUNT - 1, math.ceil(math.log(seconds / BUCKET_BASE) / _LOG_GROWTH))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """Geometric middle of the bucket holding the pct-th percentile sample (never above the largest sample)."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(BUCKET_BASE * BUCKET_GROWTH ** (index - 0.5), self.max) if index else min(BUCKET_BASE, self.max)
+        return self.max
+
+    def merge(self, other: "Histogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def to_dict(self) -> dict:
+        return {"counts": {str(index): count for index, count in self.counts.items()}, "count": self.count,
+                "total": self.total, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        histogram = cls()
+        histogram.counts = {int(index): count for index, count in data["counts"].items()}
+        histogram.count, histogram.total, histogram.max = data["count"], data["total"], data["max"]
+        return histogram
+
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+
+def observe(name: str, seconds: float):
+    """Add a duration sample to the histogram `name`."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+def increment(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+def record_error(scope: str, error: BaseException):
+    """Count an exception as errors.<scope>.<Type> and log it."""
+    increment(f"errors.{scope}.{type(error).__name__}")
+    log_event("error", scope=scope, type=type(error).__name__, message=str(error))
+
+def snapshot(reset: bool = False) -> dict:
+    """Return {"histograms": {name: Histogram}, "counters": {name: int}}, optionally starting over."""
+    global _histograms, _counters
+    with _lock:
+        data = {"histograms": dict(_histograms), "counters": dict(_counters)}
+        if reset:
+            _histograms, _counters = {}, {}
+        return data
+
+# ----------------------------------------------------------------------
+# Timing Helpers
+# ----------------------------------------------------------------------
+
+@contextmanager
+def timer(name: str):
+    """Time the block into the histogram `name` (also when it raises)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def timed(name: str):
+    """Decorator timing every call of a function or coroutine function into the histogram `name`."""
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    observe(name, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+def instrument(cls, prefix: str, exclude=()):
+    """Time every public method defined on cls into `<prefix>.<method>` histograms."""
+    for name, member in list(vars(cls).items()):
+        if name.startswith("_") or name in exclude or not inspect.isfunction(member):
+            continue
+        setattr(cls, name, timed(f"{prefix}.{name}")(member))
+    return cls
+
+# ----------------------------------------------------------------------
+# Structured Log
+# ----------------------------------------------------------------------
+
+_log_lock = threading.Lock()
+
+def log_event(event: str, **fields):
+    """Append {"ts", "pid", "event", **fields} to the JSON-lines log (no-op unless LOG_PATH is set)."""
+    if not LOG_PATH:
+        return
+    line = json.dumps({"ts": time.time(), "pid": os.getpid(), "event": event, **fields}, ensure_ascii=False, default=str)
+    with _log_lock:
+        with open(LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def flush():
+    """Write the histograms and counters collected since the last flush to the log as a "metrics" event."""
+    if not LOG_PATH:
+        return
+    data = snapshot(reset=True)
+    if data["histograms"] or data["counters"]:
+        log_event("metrics", histograms={name: histogram.to_dict() for name, histogram in data["histograms"].items()},
+                  counters=data["counters"])
+
+atexit.register(flush)
+
+def read_log(path: str, since: float = None) -> dict:
+    """Merge the "metrics" events of a log (optionally only those written after `since`).
+
+    Returns {"histograms": {name: Histogram}, "counters": {name: int}, "errors": [recent error events]}.
+    """
+    histograms, counters, errors = {}, {}, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue   # a line cut short by a crash
+            if since is not None and event.get("ts", 0) < since:
+                continue
+            if event.get("event") == "metrics":
+                for name, data in event["histograms"].items():
+                    histograms.setdefault(name, Histogram()).merge(Histogram.from_dict(data))
+                for name, count in event["counters"].items():
+                    counters[name] = counters.get(name, 0) + count
+            elif event.get("event") == "error":
+                errors = (errors + [event])[-20:]
+    return {"histograms": histograms, "counters": counters, "errors": errors}
+
+# ----------------------------------------------------------------------
+# Profiling
+# ----------------------------------------------------------------------
+
+class StackSampler:
+    """Sample one thread's Python stack from a background thread and count folded stacks."""
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}     # "file:function;file:function" (outermost first) -> samples
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            names = []
+            while frame is not None:
+                names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if names:
+                stack = ";".join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        """Write the samples in folded-stack format ("stack count" lines, as read by flamegraph tools)."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+@contextmanager
+def profiled(name: str):
+    """Profile the block with PROFILE_MODE into PROFILE_DIR/<name>-<time>-<pid>.(prof|folded); a no-op when off."""
+    if PROFILE_MODE not in ("cprofile", "sample"):
+        yield
+        return
+    path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    if PROFILE_MODE == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path + ".prof")
+            log_event("profile", name=name, path=path + ".prof")
+    else:
+        sampler = StackSampler()
+        try:
+            with sampler:
+                yield
+        finally:
+            sampler.write(path + ".folded")
+            log_event("profile", name=name, path=path + ".folded", samples=sum(sampler.stacks.values()))
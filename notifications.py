@@ -4,6 +4,20 @@
 #
 # How the module works:
 #
+# - Releases are enqueued into a persistent outbox table (notification_outbox)
+#   with an idempotency key, so a restarted checker never notifies twice.
+# - Outbox.fan_out turns a batch of releases into one entry per watcher with a
+#   single INSERT ... SELECT joining watchlist, users and anime.
+# - A NotificationWorker drains the outbox in the background, coalescing
+#   several episodes of the same show into a single message.
+# - A failed delivery is retried later with exponential backoff
+#   (next_attempt_at), so a short backend outage does not use up the
+#   attempts of an entry.
+# - Messages are delivered through a pluggable backend: macOS notification
+#   center, Linux desktop (notify-send), stdout, or a webhook.
+#
+# The macOS backend uses mac_notifications:
+#
 # create_notification(title='Notification', subtitle=None, text=None, icon=None, sound=None, delay=timedelta(), action_button_str=None, action_callback=None, reply_button_str=None, reply_callback=None, snooze_button_str=None)
 #
 # - title: The title of the notification.
@@ -13,22 +27,366 @@
 # - sound: The sound of the notification.
 # ======================================================================
 
+import json
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from itertools import groupby
+from db import Database
+from lazy import DeferredConsole, lazy_import
+from metrics import percentile
+import metrics
+
+# Loaded on first use, so commands that only queue notifications do not pay for the event loop
+asyncio = lazy_import("asyncio")
+
+console = DeferredConsole()
+
+# Delivery attempts before an outbox entry is marked as failed
+MAX_ATTEMPTS = 8
+
+# Seconds before retrying an entry after its first failed attempt, doubled after every further failure up to
+# RETRY_MAX_DELAY (with MAX_ATTEMPTS, an entry survives an outage of about two hours)
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 3600
+
+# Outbox entries handled per worker iteration
+DRAIN_BATCH_SIZE = 200
+
+# Recipients of a batch of releases, passed as a JSON array of [anime_id, episode, air_time]:
+# every watcher of the anime whose last watched episode is before the released one
+FANOUT_QUERY = '''
+SELECT w.user_id, u.mal_user_id, r.anime_id, a.title, r.episode, r.air_time
+FROM (
+    SELECT json_extract(value, '$[0]') AS anime_id, json_extract(value, '$[1]') AS episode,
+           json_extract(value, '$[2]') AS air_time
+    FROM json_each(?)
+) r
+JOIN watchlist w ON w.anime_id = r.anime_id AND COALESCE(w.last_watched_episode, 0) < r.episode
+JOIN users u ON u.id = w.user_id
+JOIN anime a ON a.id = r.anime_id
+'''
+
+# ----------------------------------------------------------------------
+# Notification Backends
+# ----------------------------------------------------------------------
+
+class StdoutBackend:
+    """Print notifications to the console (works everywhere, used as the fallback)."""
+    name = "stdout"
+
+    def send(self, title: str, subtitle: str, message: str) -> bool:
+        console.print(f"[bold cyan]{title}[/bold cyan] - {subtitle}\n  {message}")
+        return True
+
+class MacBackend:
+    """macOS notification center through mac_notifications."""
+    name = "macos"
 
-from mac_notifications import client
+    def __init__(self):
+        from mac_notifications import client
+        self.client = client
 
+    def send(self, title: str, subtitle: str, message: str) -> bool:
+        self.client.create_notification(title=title, subtitle=subtitle, text=message)
+        return True
+
+class LinuxDesktopBackend:
+    """Linux desktop notifications through notify-send."""
+    name = "linux"
+
+    def __init__(self):
+        self.executable = shutil.which("notify-send")
+        if self.executable is None:
+            raise RuntimeError("notify-send is not installed")
+
+    def send(self, title: str, subtitle: str, message: str) -> bool:
+        result = subprocess.run([self.executable, "--app-name=AniNotif", title, f"{subtitle}\n{message}"],
+                                capture_output=True, timeout=10)
+        return result.returncode == 0
+
+class WebhookBackend:
+    """POST notifications as JSON to a webhook URL (e.g. a local bot or a stub receiver)."""
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = 10):
+        import requests
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, title: str, subtitle: str, message: str) -> bool:
+        response = self.session.post(self.url, json={"title": title, "subtitle": subtitle, "text": message}, timeout=self.timeout)
+        return response.ok
 
-def release_notification(anime_title: str, episode: int, time: str) -> bool: # Returns True if the notification was sent, False otherwise
+def default_backend():
+    """Pick the best backend available on this platform, falling back to stdout."""
+    candidates = [MacBackend] if sys.platform == "darwin" else [LinuxDesktopBackend]
+    for backend in candidates:
+        try:
+            return backend()
+        except Exception:
+            continue
+    return StdoutBackend()
+
+def get_backend(name: str, webhook_url: str = None):
+    """Instantiate a backend by name ("auto", "macos", "linux", "stdout" or "webhook")."""
+    if name == "auto":
+        return default_backend()
+    if name == "webhook":
+        if not webhook_url:
+            raise ValueError("The webhook backend needs a webhook URL")
+        return WebhookBackend(webhook_url)
+    return {"macos": MacBackend, "linux": LinuxDesktopBackend, "stdout": StdoutBackend}[name]()
+
+def format_release_message(anime_title: str, episodes, time: str):
+    """Build (title, subtitle, message) for one or more episodes of the same show."""
+    episodes = sorted(episodes)
+    if len(episodes) == 1:
+        label = f"Episode {episodes[0]}"
+        message = f"New {anime_title} episode, EP - {episodes[0]} available at {time}"
+    else:
+        label = f"Episodes {episodes[0]}-{episodes[-1]}" if episodes[-1] - episodes[0] == len(episodes) - 1 \
+            else "Episodes " + ", ".join(map(str, episodes))
+        message = f"{len(episodes)} new {anime_title} episodes available, latest at {time}"
+    return f"{anime_title} - {label}", f"Releases at {time}", message
+
+def format_air_time(air_time) -> str:
+    """Format a release air time (aware datetime) as shown in notifications."""
+    return air_time.strftime("%Y-%m-%d %H:%M UTC")
+
+def release_notification(anime_title: str, episode: int, time: str, backend=None) -> bool: # Returns True if the notification was sent, False otherwise
     """Send a notification to the user."""
-    title = f"{anime_title} - Episode {episode}"
-    subtitle = f"Releases at {time}"
-    message = f"New {anime_title} episode, EP - {episode} available at {time}"
+    title, subtitle, message = format_release_message(anime_title, [episode], time)
     try:
-        client.create_notification(title=title, subtitle=subtitle, text=message)
-        return True
+        return (backend or default_backend()).send(title, subtitle, message)
     except Exception as e:
+        metrics.record_error("notify.send", e)
         print(f"Error sending notification: {e}")
         return False
 
+# ----------------------------------------------------------------------
+# Persistent Outbox
+# ----------------------------------------------------------------------
+
+class Outbox:
+    """Persistent queue of notifications stored in the notification_outbox table."""
+    def __init__(self, db: Database = None):
+        self.db = db or Database()
+
+    @staticmethod
+    def release_key(anime_id: int, episode: int, user_id: int = None) -> str:
+        """Idempotency key of a release notification (per user when user_id is given)."""
+        key = f"release:{anime_id}:{episode}"
+        return key if user_id is None else f"{key}:user:{user_id}"
+
+    def enqueue(self, anime_id: int, anime_title: str, episode: int, air_time: str, user_id: int = None) -> bool:
+        """Queue a release notification. Returns False if the same notification was already queued."""
+        return self.enqueue_many([(anime_id, anime_title, episode, air_time, user_id)]) == 1
+
+    def enqueue_many(self, notifications) -> int:
+        """Queue (anime_id, anime_title, episode, air_time, user_id) tuples, skipping known keys. Returns the number queued."""
+        now = time.time()
+        rows = [(self.release_key(anime_id, episode, user_id), user_id, anime_id, title, episode, air_time, now)
+                for anime_id, title, episode, air_time, user_id in notifications]
+        with self.db.transaction() as cursor:
+            before = cursor.connection.total_changes
+            cursor.executemany('''
+            INSERT OR IGNORE INTO notification_outbox
+                (idempotency_key, user_id, anime_id, anime_title, episode, air_time, created_at)
+            VALUES (?,?,?,?,?,?,?)
+            ''', rows)
+            return cursor.connection.total_changes - before
+
+    def enqueue_release(self, release):
+        """on_release callback for releases_checker: queue a Release for delivery."""
+        self.enqueue(release.anime_id, release.title, release.episode, format_air_time(release.air_time))
+
+    @staticmethod
+    def _release_batch(releases) -> str:
+        return json.dumps([[release.anime_id, release.episode, format_air_time(release.air_time)] for release in releases])
+
+    def recipients(self, releases) -> list:
+        """Return (user_id, mal_user_id, anime_id, anime_title, episode, air_time) for everyone to notify about releases."""
+        with self.db.transaction() as cursor:
+            cursor.execute(FANOUT_QUERY, (self._release_batch(releases),))
+            return cursor.fetchall()
+
+    def fan_out(self, releases) -> int:
+        """Queue one notification per watcher of each Release with a single INSERT ... SELECT. Returns the number queued.
+
+        Watchers who already watched the episode are skipped; re-running a batch queues nothing new.
+        """
+        releases = list(releases)
+        if not releases:
+            return 0
+        with self.db.transaction() as cursor:
+            before = cursor.connection.total_changes
+            cursor.execute(f'''
+            INSERT OR IGNORE INTO notification_outbox
+                (idempotency_key, user_id, anime_id, anime_title, episode, air_time, created_at)
+            SELECT 'release:' || anime_id || ':' || episode || ':user:' || user_id, user_id, anime_id, title, episode, air_time, ?
+            FROM ({FANOUT_QUERY})
+            ''', (time.time(), self._release_batch(releases)))
+            return cursor.connection.total_changes - before
+
+    def pending(self, limit: int = DRAIN_BATCH_SIZE, after_id: int = 0, now: float = None):
+        """Return up to `limit` pending entries due for an attempt, with ids above after_id, as
+        (id, user_id, anime_id, anime_title, episode, air_time, created_at, attempts)."""
+        with self.db.transaction() as cursor:
+            cursor.execute('''
+            SELECT id, user_id, anime_id, anime_title, episode, air_time, created_at, attempts
+            FROM notification_outbox WHERE status = 'pending' AND id > ? AND next_attempt_at <= ? ORDER BY id LIMIT ?
+            ''', (after_id, time.time() if now is None else now, limit))
+            return cursor.fetchall()
+
+    def mark_sent(self, ids, delivered_at: float):
+        with self.db.transaction() as cursor:
+            cursor.executemany("UPDATE notification_outbox SET status = 'sent', delivered_at = ?, attempts = attempts + 1 WHERE id = ?",
+                               ((delivered_at, outbox_id) for outbox_id in ids))
+
+    def mark_failed_attempt(self, ids, error: str):
+        """Record a failed delivery and schedule the next attempt; entries out of attempts are marked failed for good."""
+        now = time.time()
+        with self.db.transaction() as cursor:
+            cursor.executemany('''
+            UPDATE notification_outbox
+            SET attempts = attempts + 1, last_error = ?,
+                status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END,
+                next_attempt_at = ? + MIN(?, ? * (1 << MIN(attempts, 30)))
+            WHERE id = ?
+            ''', ((error, MAX_ATTEMPTS, now, RETRY_MAX_DELAY, RETRY_BASE_DELAY, outbox_id) for outbox_id in ids))
+
+    def counts(self) -> dict:
+        """Return the number of outbox entries by status."""
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT status, COUNT(*) FROM notification_outbox GROUP BY status")
+            return dict(cursor.fetchall())
+
+# ----------------------------------------------------------------------
+# Background Worker
+# ----------------------------------------------------------------------
+
+class NotificationWorker:
+    """Drain the outbox through a backend, in the calling thread (drain_once) or a background thread (start/stop)."""
+    def __init__(self, outbox: Outbox = None, backend=None, poll_interval: float = 1.0):
+        self.outbox = outbox or Outbox()
+        self.backend = backend or default_backend()
+        self.poll_interval = poll_interval
+        self.delivered = 0       # outbox entries delivered
+        self.messages = 0        # messages sent after coalescing
+        self.failures = 0
+        self.latencies = []      # seconds between enqueue and delivery
+        self.busy_time = 0.0     # seconds spent delivering
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def _groups(batch):
+        """Split pending rows into one group per (user, show), episodes in order."""
+        batch.sort(key=lambda row: (row[1] is not None, row[1] or 0, row[2], row[4]))
+        return [list(group) for _, group in groupby(batch, key=lambda row: (row[1], row[2]))]
+
+    def _send(self, group):
+        """Send the coalesced message of a group through the backend. Returns (ok, error)."""
+        title, subtitle, message = format_release_message(group[0][3], [row[4] for row in group], group[-1][5])
+        try:
+            with metrics.timer("notify.send"):
+                ok = self.backend.send(title, subtitle, message)
+        except Exception as e:
+            metrics.record_error("notify.send", e)
+            return False, str(e)
+        if not ok:
+            metrics.increment("notify.backend_failures")
+        return ok, "backend reported failure"
+
+    def _record(self, group, ok: bool, error: str) -> int:
+        """Mark a group sent or failed in the outbox. Returns the number of entries delivered."""
+        ids = [row[0] for row in group]
+        if not ok:
+            self.outbox.mark_failed_attempt(ids, error)
+            self.failures += 1
+            return 0
+        now = time.time()
+        self.outbox.mark_sent(ids, now)
+        self.latencies.extend(now - row[6] for row in group)
+        self.delivered += len(group)
+        self.messages += 1
+        return len(group)
+
+    def drain_once(self) -> int:
+        """Deliver every pending entry, one message per (user, show). Returns the number of entries delivered."""
+        delivered, last_id = 0, 0
+        while True:
+            # Rows are fetched past the last id of the previous batch, so a failed row is tried once per pass
+            batch = self.outbox.pending(after_id=last_id)
+            if not batch:
+                return delivered
+            last_id = batch[-1][0]
+            start = time.perf_counter()
+            for group in self._groups(batch):
+                delivered += self._record(group, *self._send(group))
+            self.busy_time += time.perf_counter() - start
+            if len(batch) < DRAIN_BATCH_SIZE:
+                return delivered
+
+    async def drain_async(self) -> int:
+        """drain_once for an event loop: backend calls run in a worker thread, outbox updates stay on the loop's thread."""
+        delivered, last_id = 0, 0
+        while True:
+            batch = self.outbox.pending(after_id=last_id)
+            if not batch:
+                return delivered
+            last_id = batch[-1][0]
+            start = time.perf_counter()
+            for group in self._groups(batch):
+                delivered += self._record(group, *await asyncio.to_thread(self._send, group))
+            self.busy_time += time.perf_counter() - start
+            if len(batch) < DRAIN_BATCH_SIZE:
+                return delivered
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.drain_once()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        """Start draining in a daemon thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="notification-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Ask the background thread to drain now instead of waiting for the next poll."""
+        self._wake.set()
+
+    def stop(self, drain: bool = True):
+        """Stop the background thread, optionally delivering what is still pending first."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if drain:
+            self.drain_once()
+
+    def metrics(self) -> dict:
+        """Return delivery counts, latency percentiles and throughput."""
+        return {
+            "delivered": self.delivered,
+            "messages": self.messages,
+            "failures": self.failures,
+            "latency_p50_ms": percentile(self.latencies, 50) * 1000,
+            "latency_p95_ms": percentile(self.latencies, 95) * 1000,
+            "latency_p99_ms": percentile(self.latencies, 99) * 1000,
+            "throughput_per_sec": self.delivered / self.busy_time if self.busy_time else 0.0,
+        }
+
 
 if __name__ == '__main__':
     release_notification(anime_title="Test", episode=1, time="10:00")
@@ -0,0 +1,481 @@
+# ======================================================================
+# File: recommend.py
+# Description: This file contains the content-based recommendations of
+# the `recommend` command: anime of the local catalog ranked by their
+# similarity to the shows on a user's watchlist.
+#
+# How recommendations are computed:
+#
+# - Every anime becomes a sparse feature vector: its genres, themes,
+#   demographics and studios (read from the raw payloads in anime_raw) and
+#   its most frequent title and synopsis terms, weighted by TF-IDF and
+#   normalised to unit length.
+# - The vectors form a sparse matrix stored twice, by anime (CSR) and by
+#   feature (CSC), in flat typed arrays. A user's profile is the sum of the
+#   rows of their watchlist, trimmed to its strongest features; the scores
+#   of the whole catalog are then one sparse matrix-vector product over
+#   the CSC postings of those features, so only anime sharing a feature
+#   with the profile are visited.
+# - The matrix is cached next to the database (<db name>.features) and
+#   memory-mapped, so a command starts scoring without parsing it. Triggers
+#   (migration 13 in db.py) log the mal_id of every anime whose title,
+#   synopsis or raw payload changes in anime_changes; before scoring, only
+#   those rows are re-featurized and spliced into the cached arrays, the
+#   untouched runs being copied as raw bytes.
+# - Spliced rows use the current document frequencies while older rows
+#   keep theirs, so once REBUILD_SHARE of the rows were spliced (or the log
+#   has a gap, e.g. after another cache file consumed it) the matrix is
+#   rebuilt from scratch.
+#
+# NumPy/SciPy are not dependencies of the project: the arrays are the
+# standard library's array and mmap, and the products plain loops over
+# memoryviews.
+# ======================================================================
+
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import time
+from array import array
+from collections import Counter, namedtuple
+from operator import itemgetter
+from anime_raw import RawAnime
+from db import BATCH_CHUNK_SIZE, Database
+
+# Suffix of the matrix cache file, written next to the database file
+MATRIX_SUFFIX = ".features"
+
+# Cache file header: magic, rows, features, stored values, last anime_changes seq applied, rows spliced since the
+# last full build, bytes of the JSON vocabulary
+MATRIX_MAGIC = b"ANIFEAT1"
+MATRIX_HEADER = struct.Struct("=8s6q")
+
+# Raw payload lists turned into features, and the kind of feature they give
+RAW_FEATURES = (("genres", "genre"), ("explicit_genres", "genre"), ("themes", "theme"),
+                ("demographics", "demographic"), ("studios", "studio"))
+
+# Weight of each kind of feature on top of its TF-IDF weight
+KIND_WEIGHTS = {"genre": 2.0, "theme": 2.0, "demographic": 1.0, "studio": 1.5, "term": 1.0}
+
+# Title and synopsis terms kept per anime (the most frequent ones)
+MAX_TERMS_PER_ANIME = 64
+
+# Words of at least three letters; digits and punctuation never make a term
+TERM_PATTERN = re.compile(r"[^\W\d_]{3,}")
+
+# Frequent English words that say nothing about a show
+STOP_WORDS = frozenset("""
+about after again against all also and any are around because been before being between both but can could did
+does during each even ever every for from further had has have her here hers him his how into its just last made
+make many more most much must never new not now off once one only other our out over own same she should since
+some still such than that the their them then there these they this those through too two under until upon very
+was way were what when where which while who whom why will with within without would year years you your
+""".split())
+
+# Strongest profile features the catalog is scored against
+PROFILE_FEATURES = 64
+
+# Share of rows spliced since the last full build above which the matrix is rebuilt from scratch
+REBUILD_SHARE = 0.2
+
+# Recommendations returned by default
+RECOMMEND_LIMIT = 10
+
+# Shared features listed as the reasons of a recommendation
+REASON_COUNT = 3
+
+# A recommended anime; reasons are the names of its features that weigh most in the score
+Recommendation = namedtuple("Recommendation", ["anime_id", "mal_id", "title", "score", "reasons"])
+
+# Outcome of Recommender.refresh(): rows of the matrix, rows re-featurized, whether it was a full build
+MatrixUpdate = namedtuple("MatrixUpdate", ["rows", "changed", "full", "elapsed"])
+
+def anime_features(title: str, synopsis: str, raw: RawAnime = None) -> dict:
+    """{feature name: term frequency} of one anime; genres, themes, demographics and studios count once."""
+    features = {}
+    if raw is not None:
+        for key, kind in RAW_FEATURES:
+            for item in raw.get(key) or ():
+                if isinstance(item, dict) and item.get("name"):
+                    features[f"{kind}:{item['name']}"] = 1
+    # The title is counted twice: its words describe the show better than most synopsis words
+    words = TERM_PATTERN.findall(f"{title or ''} {title or ''} {synopsis or ''}".lower())
+    terms = Counter(word for word in words if word not in STOP_WORDS)
+    features.update((f"term:{word}", count) for word, count in terms.most_common(MAX_TERMS_PER_ANIME))
+    return features
+
+def feature_weight(name: str, frequency: int, documents: int, rows: int) -> float:
+    """TF-IDF weight of a feature occurring `frequency` times in an anime and in `documents` of `rows` anime."""
+    return KIND_WEIGHTS[name.split(":", 1)[0]] * (1 + math.log(frequency)) * (math.log((1 + rows) / (1 + documents)) + 1)
+
+# ----------------------------------------------------------------------
+# Matrix File
+# ----------------------------------------------------------------------
+
+def _sections(rows: int, features: int, values: int) -> tuple:
+    """(name, typecode, length) of the arrays of a matrix file, in file order."""
+    return (("anime_ids", "q", rows), ("mal_ids", "q", rows), ("row_ptr", "q", rows + 1), ("col_idx", "i", values),
+            ("row_val", "f", values), ("col_ptr", "q", features + 1), ("row_idx", "i", values), ("col_val", "f", values),
+            ("df", "i", features))
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+def write_matrix(path: str, arrays: dict, vocabulary: list, seq: int, spliced: int):
+    """Write a matrix file atomically (readers mapping the previous file keep their copy)."""
+    vocab = json.dumps(vocabulary, ensure_ascii=False).encode()
+    rows, features, values = len(arrays["anime_ids"]), len(vocabulary), len(arrays["col_idx"])
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(MATRIX_HEADER.pack(MATRIX_MAGIC, rows, features, values, seq, spliced, len(vocab)))
+        for name, _, _ in _sections(rows, features, values):
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(arrays[name])
+        f.write(vocab)
+    os.replace(temp, path)
+
+class FeatureMatrix:
+    """A memory-mapped matrix file; its arrays are typed memoryviews over the mapping."""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        try:
+            magic, self.rows, self.features, self.values, self.seq, self.spliced, vocab_size = \
+                MATRIX_HEADER.unpack_from(self._map)
+            if magic != MATRIX_MAGIC:
+                raise ValueError(f"not a feature matrix: {path}")
+            offset = MATRIX_HEADER.size
+            for name, typecode, length in _sections(self.rows, self.features, self.values):
+                offset = _align(offset)
+                size = length * array(typecode).itemsize
+                view = memoryview(self._map)[offset:offset + size]
+                self._views.append(view)
+                setattr(self, name, view.cast(typecode))
+                self._views.append(getattr(self, name))
+                offset += size
+            if offset + vocab_size != len(self._map):
+                raise ValueError(f"truncated feature matrix: {path}")
+            self._vocab_offset = offset
+        except (ValueError, struct.error):
+            self.close()
+            raise
+        self._vocabulary = None
+        self._positions = None
+
+    @property
+    def vocabulary(self) -> list:
+        """Feature names by column, parsed on first use."""
+        if self._vocabulary is None:
+            self._vocabulary = json.loads(self._map[self._vocab_offset:])
+        return self._vocabulary
+
+    @property
+    def positions(self) -> dict:
+        """{anime_id: row} of the live rows (deleted anime leave an empty row with anime_id 0)."""
+        if self._positions is None:
+            self._positions = {anime_id: row for row, anime_id in enumerate(self.anime_ids) if anime_id}
+        return self._positions
+
+    def row(self, position: int) -> tuple:
+        """(column indices, values) of a row."""
+        start, end = self.row_ptr[position], self.row_ptr[position + 1]
+        return self.col_idx[start:end], self.row_val[start:end]
+
+    def close(self):
+        # Views must be released before the mapping can be closed
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._map.close()
+
+def load_matrix(path: str):
+    """Open a matrix file, or return None when it is missing or unreadable."""
+    try:
+        return FeatureMatrix(path)
+    except (OSError, ValueError):
+        return None
+
+# ----------------------------------------------------------------------
+# Recommender
+# ----------------------------------------------------------------------
+
+class Recommender:
+    """Keep the feature matrix of a Database's catalog up to date and rank anime for its users."""
+    def __init__(self, db: Database = None, path: str = None):
+        self.db = db or Database()
+        self.path = path or os.path.splitext(self.db.db_name)[0] + MATRIX_SUFFIX
+        self.matrix = None
+
+    def _featurize(self, mal_ids=None):
+        """Yield (anime_id, mal_id, features) for every anime of the catalog, or for those of mal_ids."""
+        sql = ("SELECT a.id, a.mal_id, a.title, a.synopsis, r.payload FROM anime a "
+               "LEFT JOIN anime_raw r ON r.mal_id = a.mal_id")
+        if mal_ids is None:
+            chunks = [(f"{sql} ORDER BY a.id", ())]
+        else:
+            mal_ids = sorted(mal_ids)
+            chunks = [(f"{sql} WHERE a.mal_id IN ({','.join('?' * len(chunk))}) ORDER BY a.id", chunk)
+                      for chunk in (mal_ids[start:start + BATCH_CHUNK_SIZE]
+                                    for start in range(0, len(mal_ids), BATCH_CHUNK_SIZE))]
+        for query, params in chunks:
+            for anime_id, mal_id, title, synopsis, payload in self.db.stream(query, params):
+                raw = RawAnime(mal_id, payload) if payload is not None else None
+                yield anime_id, mal_id, anime_features(title, synopsis, raw)
+
+    @staticmethod
+    def _latest_seq(cursor) -> int:
+        row = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'anime_changes'").fetchone()
+        return row[0] if row else 0
+
+    def _pending_changes(self, since: int):
+        """Return (mal_ids changed after seq `since`, latest seq), or (None, latest seq) when the log has a gap."""
+        with self.db.transaction() as cursor:
+            latest = self._latest_seq(cursor)
+            rows = cursor.execute("SELECT seq, mal_id FROM anime_changes WHERE seq > ?", (since,)).fetchall()
+        if since > latest or len(rows) != latest - since:
+            return None, latest
+        return {mal_id for _, mal_id in rows}, latest
+
+    def _prune(self, seq: int):
+        with self.db.transaction() as cursor:
+            cursor.execute("DELETE FROM anime_changes WHERE seq <= ?", (seq,))
+
+    def build(self) -> MatrixUpdate:
+        """Featurize the whole catalog and write a new matrix file."""
+        start = time.perf_counter()
+        with self.db.transaction() as cursor:
+            seq = self._latest_seq(cursor)
+        anime_ids, mal_ids, rows = array("q"), array("q"), []
+        vocabulary, columns, df = [], {}, array("i")
+        for anime_id, mal_id, features in self._featurize():
+            anime_ids.append(anime_id)
+            mal_ids.append(mal_id)
+            row = []
+            for name, frequency in features.items():
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = len(vocabulary)
+                    vocabulary.append(name)
+                    df.append(0)
+                df[column] += 1
+                row.append((column, frequency))
+            rows.append(row)
+        row_ptr, col_idx, row_val = array("q", [0]), array("i"), array("f")
+        for row in rows:
+            self._append_row(row, vocabulary, df, len(rows), col_idx, row_val)
+            row_ptr.append(len(col_idx))
+        arrays = {"anime_ids": anime_ids, "mal_ids": mal_ids, "row_ptr": row_ptr, "col_idx": col_idx,
+                  "row_val": row_val, "df": df, **self._transpose(row_ptr, col_idx, row_val, len(vocabulary))}
+        self._replace(arrays, vocabulary, seq, 0)
+        return MatrixUpdate(rows=len(rows), changed=len(rows), full=True, elapsed=time.perf_counter() - start)
+
+    @staticmethod
+    def _append_row(row, vocabulary, df, rows, col_idx, row_val):
+        """Append the unit-length TF-IDF values of a row of (column, frequency) pairs, in column order."""
+        weights = sorted((column, feature_weight(vocabulary[column], frequency, df[column], rows)) for column, frequency in row)
+        norm = math.sqrt(sum(weight * weight for _, weight in weights)) or 1.0
+        col_idx.extend(column for column, _ in weights)
+        row_val.extend(weight / norm for _, weight in weights)
+
+    @staticmethod
+    def _transpose(row_ptr, col_idx, row_val, features) -> dict:
+        """CSC arrays (col_ptr, row_idx, col_val) of a CSR matrix, rows ascending within each column."""
+        counts = array("q", bytes(8 * (features + 1)))
+        for column in col_idx:
+            counts[column + 1] += 1
+        for column in range(features):
+            counts[column + 1] += counts[column]
+        col_ptr = array("q", counts)
+        row_idx, col_val = array("i", bytes(4 * len(col_idx))), array("f", bytes(4 * len(col_idx)))
+        for row in range(len(row_ptr) - 1):
+            for index in range(row_ptr[row], row_ptr[row + 1]):
+                column = col_idx[index]
+                slot = counts[column]
+                row_idx[slot], col_val[slot] = row, row_val[index]
+                counts[column] = slot + 1
+        return {"col_ptr": col_ptr, "row_idx": row_idx, "col_val": col_val}
+
+    def _splice(self, matrix: FeatureMatrix, changed: set, seq: int) -> MatrixUpdate:
+        """Re-featurize the anime of `changed` (mal_ids) and splice their rows into a copy of the matrix arrays."""
+        start = time.perf_counter()
+        vocabulary, df = list(matrix.vocabulary), array("i", matrix.df)
+        columns = {name: column for column, name in enumerate(vocabulary)}
+        by_mal_id = {mal_id: row for row, mal_id in enumerate(matrix.mal_ids) if matrix.anime_ids[row]}
+        # Take the old rows out of the document frequencies; their positions are reused (or emptied)
+        replaced = {}
+        for mal_id in changed:
+            if (row := by_mal_id.get(mal_id)) is not None:
+                replaced[row] = None
+                for column in matrix.row(row)[0]:
+                    df[column] -= 1
+        fresh, touched = [], set()
+        for anime_id, mal_id, features in self._featurize(changed):
+            row = []
+            for name, frequency in features.items():
+                column = columns.get(name)
+                if column is None:
+                    column = columns[name] = len(vocabulary)
+                    vocabulary.append(name)
+                    df.append(0)
+                df[column] += 1
+                row.append((column, frequency))
+            fresh.append((by_mal_id.get(mal_id), anime_id, mal_id, row))
+        anime_ids, mal_ids = array("q", matrix.anime_ids), array("q", matrix.mal_ids)
+        for position in replaced:
+            anime_ids[position] = 0
+        live = sum(1 for anime_id in anime_ids if anime_id) + len(fresh)
+        new_rows = {}   # position -> (col_idx, row_val)
+        for position, anime_id, mal_id, row in fresh:
+            if position is None:
+                position = len(anime_ids)
+                anime_ids.append(anime_id)
+                mal_ids.append(mal_id)
+            else:
+                anime_ids[position] = anime_id
+            values = (array("i"), array("f"))
+            self._append_row(row, vocabulary, df, live, *values)
+            new_rows[position] = values
+            touched.update(values[0])
+        for position in replaced:
+            new_rows.setdefault(position, (array("i"), array("f")))
+            touched.update(matrix.row(position)[0])
+        # CSR: copy the runs of untouched rows as raw bytes, write the new rows in between
+        row_ptr, col_idx, row_val = array("q", [0]), array("i"), array("f")
+        copied = 0
+        for position in range(len(anime_ids)):
+            if position in new_rows:
+                if copied < position:
+                    begin, end = matrix.row_ptr[copied], matrix.row_ptr[position]
+                    col_idx.frombytes(matrix.col_idx[begin:end].cast("B"))
+                    row_val.frombytes(matrix.row_val[begin:end].cast("B"))
+                    shift = len(col_idx) - end
+                    row_ptr.extend(matrix.row_ptr[row + 1] + shift for row in range(copied, position))
+                col_idx.extend(new_rows[position][0])
+                row_val.extend(new_rows[position][1])
+                row_ptr.append(len(col_idx))
+                copied = position + 1
+        if copied < matrix.rows:
+            begin = matrix.row_ptr[copied]
+            col_idx.frombytes(matrix.col_idx[begin:].cast("B"))
+            row_val.frombytes(matrix.row_val[begin:].cast("B"))
+            shift = len(col_idx) - matrix.values
+            row_ptr.extend(matrix.row_ptr[row + 1] + shift for row in range(copied, matrix.rows))
+        # CSC: copy the runs of untouched columns, rebuild the postings of touched ones. New columns only come from
+        # new rows, so every column past the old ones is touched and each gap between touched columns is a run of
+        # old columns.
+        postings = {column: [] for column in touched}
+        for position, (indices, values) in new_rows.items():
+            for column, value in zip(indices, values):
+                postings[column].append((position, value))
+        col_ptr, row_idx, col_val = array("q", [0]), array("i"), array("f")
+
+        def copy_columns(first, end):
+            begin, stop = matrix.col_ptr[first], matrix.col_ptr[end]
+            row_idx.frombytes(matrix.row_idx[begin:stop].cast("B"))
+            col_val.frombytes(matrix.col_val[begin:stop].cast("B"))
+            shift = len(row_idx) - stop
+            col_ptr.extend(matrix.col_ptr[index + 1] + shift for index in range(first, end))
+
+        copied = 0
+        for column in sorted(touched):
+            if copied < column:
+                copy_columns(copied, column)
+            entries = postings[column]
+            if column < matrix.features:
+                begin, stop = matrix.col_ptr[column], matrix.col_ptr[column + 1]
+                entries += [(row, value) for row, value in zip(matrix.row_idx[begin:stop], matrix.col_val[begin:stop])
+                            if row not in new_rows]
+            entries.sort(key=itemgetter(0))
+            row_idx.extend(row for row, _ in entries)
+            col_val.extend(value for _, value in entries)
+            col_ptr.append(len(row_idx))
+            copied = column + 1
+        if copied < matrix.features:
+            copy_columns(copied, matrix.features)
+        arrays = {"anime_ids": anime_ids, "mal_ids": mal_ids, "row_ptr": row_ptr, "col_idx": col_idx,
+                  "row_val": row_val, "col_ptr": col_ptr, "row_idx": row_idx, "col_val": col_val, "df": df}
+        spliced = matrix.spliced + len(new_rows)
+        self._replace(arrays, vocabulary, seq, spliced)
+        return MatrixUpdate(rows=len(anime_ids), changed=len(new_rows), full=False, elapsed=time.perf_counter() - start)
+
+    def _replace(self, arrays: dict, vocabulary: list, seq: int, spliced: int):
+        if self.matrix is not None:
+            self.matrix.close()
+            self.matrix = None
+        write_matrix(self.path, arrays, vocabulary, seq, spliced)
+        self._prune(seq)
+        self.matrix = load_matrix(self.path)
+
+    def refresh(self, full: bool = False) -> MatrixUpdate:
+        """Bring the matrix file up to date: splice the rows of changed anime, or rebuild it when needed."""
+        start = time.perf_counter()
+        if self.matrix is None and not full:
+            self.matrix = load_matrix(self.path)
+        if full or self.matrix is None:
+            return self.build()
+        changed, seq = self._pending_changes(self.matrix.seq)
+        if changed is None or self.matrix.spliced + len(changed) > REBUILD_SHARE * max(self.matrix.rows, 1):
+            return self.build()
+        if not changed:
+            return MatrixUpdate(rows=self.matrix.rows, changed=0, full=False, elapsed=time.perf_counter() - start)
+        return self._splice(self.matrix, changed, seq)
+
+    def recommend(self, user_id: int, limit: int = RECOMMEND_LIMIT) -> list:
+        """Rank the anime missing from user_id's watchlist by cosine similarity to it. Returns Recommendation rows."""
+        self.refresh()
+        matrix = self.matrix
+        with self.db.transaction() as cursor:
+            watched = {anime_id for anime_id, in cursor.execute("SELECT anime_id FROM watchlist WHERE user_id = ?",
+                                                                 (user_id,))}
+        positions = matrix.positions
+        profile = Counter()
+        for anime_id in watched:
+            if (position := positions.get(anime_id)) is not None:
+                indices, values = matrix.row(position)
+                for column, value in zip(indices, values):
+                    profile[column] += value
+        profile = dict(profile.most_common(PROFILE_FEATURES))
+        norm = math.sqrt(sum(weight * weight for weight in profile.values()))
+        if not norm:
+            return []
+        # Sparse matrix-vector product over the postings of the profile's features only; deleted anime have no
+        # postings, so their score stays 0 like the watched ones'
+        scores = [0.0] * matrix.rows
+        col_ptr, row_idx, col_val = matrix.col_ptr, matrix.row_idx, matrix.col_val
+        for column, weight in profile.items():
+            begin, end = col_ptr[column], col_ptr[column + 1]
+            for row, value in zip(row_idx[begin:end], col_val[begin:end]):
+                scores[row] += weight * value
+        for anime_id in watched:
+            if anime_id in positions:
+                scores[positions[anime_id]] = 0.0
+        best = [(scores[row], row) for row in heapq.nlargest(limit, range(matrix.rows), key=scores.__getitem__)
+                if scores[row] > 0]
+        if not best:
+            return []
+        ids = [matrix.anime_ids[row] for _, row in best]
+        with self.db.transaction() as cursor:
+            titles = dict(cursor.execute(f"SELECT id, title FROM anime WHERE id IN ({','.join('?' * len(ids))})", ids))
+        results = []
+        for score, row in best:
+            indices, values = matrix.row(row)
+            shared = heapq.nlargest(REASON_COUNT, ((profile[column] * value, column) for column, value in zip(indices, values)
+                                                    if column in profile))
+            results.append(Recommendation(anime_id=matrix.anime_ids[row], mal_id=matrix.mal_ids[row],
+                                          title=titles.get(matrix.anime_ids[row]), score=score / norm,
+                                          reasons=[matrix.vocabulary[column] for _, column in shared]))
+        return results
+
+    def close(self):
+        if self.matrix is not None:
+            self.matrix.close()
+            self.matrix = None
+
+
+if __name__ == "__main__":
+    print(json.dumps(Recommender().refresh()._asdict(), indent=2))
@@ -0,0 +1,168 @@
+# ======================================================================
+# File: refresh.py
+# Description: This file contains the incremental refresh of anime metadata
+# (episode counts, status, air dates, broadcast slot...) from Jikan.
+#
+# How a refresh works:
+#
+# - Every anime has a next_check_at time. Only rows that are due are read,
+#   through the idx_anime_next_check index, oldest first and airing shows
+#   first among rows that were never checked.
+# - Due rows are fetched with fetch_anime_many (rate limited, through the
+#   response cache) and the parsed payload is hashed. A hash equal to the
+#   stored content_hash means nothing changed and only the check times move.
+# - Otherwise the payload is diffed against the stored row and only the
+#   changed columns are written, in batches grouped by changed column set.
+# - The next check is scheduled from the anime status (the same intervals as
+#   the response cache TTLs) with some jitter, so steady-state cost follows the
+#   number of due and changed rows, not the catalog size.
+# - Every fetched payload is also kept whole in anime_raw (see anime_raw.py).
+# ======================================================================
+
+import hashlib
+import json
+import random
+import time
+from collections import namedtuple
+from anime_raw import RawPayloadStore
+from api_cache import DEFAULT_TTL, STATUS_TTLS
+from api_requests import fetch_anime_many, parse_anime_info
+from broadcast import BROADCAST_COLUMNS, broadcast_columns
+from db import ANIME_COLUMNS, Database
+from lazy import lazy_import
+
+asyncio = lazy_import("asyncio")
+
+# Anime refreshed per run by default
+REFRESH_BATCH_SIZE = 100
+
+# Seconds before an anime whose fetch failed is tried again
+ERROR_RETRY_DELAY = 3600
+
+# Fraction of the refresh interval added at random, so rows checked together do not all fall due together
+REFRESH_JITTER = 0.1
+
+# Outcome of a refresh run; columns_written counts individual column values updated
+RefreshReport = namedtuple("RefreshReport", ["checked", "changed", "unchanged", "errors", "columns_written",
+                                             "requests", "elapsed"])
+
+# ----------------------------------------------------------------------
+# Change Detection
+# ----------------------------------------------------------------------
+
+def content_hash(parsed: dict) -> str:
+    """Hash the ANIME_COLUMNS values of a parsed anime (parse_anime_info output)."""
+    values = [parsed.get(column) for column in ANIME_COLUMNS]
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode()).hexdigest()
+
+def changed_columns(stored: dict, parsed: dict) -> dict:
+    """Return {column: new value} for the ANIME_COLUMNS whose parsed value differs from the stored one."""
+    return {column: parsed.get(column) for column in ANIME_COLUMNS if parsed.get(column) != stored[column]}
+
+def refresh_interval(status: str) -> float:
+    """Seconds until an anime with this status should be checked again."""
+    return STATUS_TTLS.get(status, DEFAULT_TTL)
+
+# ----------------------------------------------------------------------
+# Refresher
+# ----------------------------------------------------------------------
+
+class AnimeRefresher:
+    """Refresh the anime rows that are due, writing only what changed."""
+    def __init__(self, db: Database = None, clock=time.time, concurrency: int = 3, rate_limiter=None, seed: int = None):
+        self.db = db or Database()
+        self.clock = clock
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self._rng = random.Random(seed)
+        self.raw = RawPayloadStore(self.db, clock)
+
+    def due(self, limit: int = REFRESH_BATCH_SIZE, now: float = None) -> list:
+        """Return up to `limit` due anime as dicts of id, content_hash and ANIME_COLUMNS."""
+        now = self.clock() if now is None else now
+        with self.db.transaction() as cursor:
+            cursor.execute(f'''
+            SELECT id, content_hash, {", ".join(ANIME_COLUMNS)} FROM anime
+            WHERE next_check_at <= ?
+            ORDER BY next_check_at, status = 'Currently Airing' DESC
+            LIMIT ?
+            ''', (now, limit))
+            names = [description[0] for description in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def count_due(self, now: float = None) -> int:
+        now = self.clock() if now is None else now
+        with self.db.transaction() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM anime WHERE next_check_at <= ?", (now,))
+            return cursor.fetchone()[0]
+
+    def _next_check(self, now: float, status: str) -> float:
+        return now + refresh_interval(status) * (1 + self._rng.random() * REFRESH_JITTER)
+
+    def refresh_once(self, limit: int = REFRESH_BATCH_SIZE) -> RefreshReport:
+        """Fetch and apply one batch of due anime. Returns a RefreshReport."""
+        return asyncio.run(self.refresh_once_async(limit))
+
+    async def refresh_once_async(self, limit: int = REFRESH_BATCH_SIZE) -> RefreshReport:
+        """refresh_once for an already running event loop."""
+        start = time.perf_counter()
+        rows = self.due(limit)
+        if not rows:
+            return RefreshReport(0, 0, 0, 0, 0, 0, 0.0)
+        fetch = await fetch_anime_many([row["mal_id"] for row in rows], concurrency=self.concurrency,
+                                       rate_limiter=self.rate_limiter)
+        now = self.clock()
+
+        touched = []   # (last_checked_at, next_check_at, id) of unchanged rows
+        retries = []   # (next_check_at, id) of rows that could not be fetched
+        updates = {}   # changed column names -> [(values..., content_hash, last_checked_at, next_check_at, id)]
+        columns_written = 0
+        for row in rows:
+            data = fetch.results.get(row["mal_id"])
+            try:
+                parsed = parse_anime_info(data) if data is not None else None
+            except (KeyError, TypeError):
+                parsed = None
+            if parsed is None:
+                retries.append((now + ERROR_RETRY_DELAY, row["id"]))
+                continue
+            digest = content_hash(parsed)
+            next_check = self._next_check(now, parsed["status"])
+            if digest == row["content_hash"]:
+                touched.append((now, next_check, row["id"]))
+                continue
+            # Also reached when only the hash is missing (first refresh): then no column but content_hash is written
+            changes = changed_columns(row, parsed)
+            if "broadcast" in changes:
+                changes.update(zip(BROADCAST_COLUMNS, broadcast_columns(changes["broadcast"])))
+            columns_written += len(changes)
+            updates.setdefault(tuple(changes), []).append((*changes.values(), digest, now, next_check, row["id"]))
+
+        with self.db.transaction() as cursor:
+            # Raw payloads are kept even when the parsed columns did not change (new fields are only in the payload)
+            self.raw.store_many(fetch.results.values())
+            cursor.executemany("UPDATE anime SET last_checked_at = ?, next_check_at = ? WHERE id = ?", touched)
+            cursor.executemany("UPDATE anime SET next_check_at = ? WHERE id = ?", retries)
+            for columns, values in updates.items():
+                assignments = "".join(f"{column} = ?, " for column in columns)
+                cursor.executemany(f"UPDATE anime SET {assignments}content_hash = ?, last_checked_at = ?, next_check_at = ? WHERE id = ?",
+                                   values)
+        if updates:
+            # Check times alone are not cached anywhere; only rows with written columns are reported
+            self.db.notify_write("anime", [values[-1] for rows in updates.values() for values in rows])
+
+        changed = sum(len(values) for columns, values in updates.items() if columns)
+        return RefreshReport(checked=len(rows) - len(retries), changed=changed, unchanged=len(rows) - len(retries) - changed,
+                             errors=len(retries), columns_written=columns_written, requests=fetch.requests,
+                             elapsed=time.perf_counter() - start)
+
+    def refresh_due(self, batch_size: int = REFRESH_BATCH_SIZE, max_rows: int = None) -> RefreshReport:
+        """Refresh batches until nothing is due (or max_rows have been handled). Returns the combined RefreshReport."""
+        totals = [0] * len(RefreshReport._fields)
+        while max_rows is None or totals[0] + totals[3] < max_rows:
+            limit = batch_size if max_rows is None else min(batch_size, max_rows - totals[0] - totals[3])
+            report = self.refresh_once(limit)
+            if not report.checked and not report.errors:
+                break
+            totals = [total + value for total, value in zip(totals, report)]
+        return RefreshReport(*totals)
@@ -0,0 +1,220 @@
+# ======================================================================
+# File: releases_checker.py
+# Description: This file contains the release-detection engine. It computes
+# the next air time of every currently airing anime from its broadcast slot,
+# records upcoming episodes in the releases table and sleeps until the
+# earliest one is out, using a heap instead of polling every show.
+#
+# How the engine works:
+#
+# - load() reads every "Currently Airing" anime, takes its earliest unannounced
+#   release (or computes its next episode) and pushes (air_time, anime_id, episode)
+#   onto a min-heap. New upcoming episodes are written to the releases table;
+#   a recorded release whose date cannot be read is replaced by the computed one.
+# - run_once() pops every entry whose air time has passed, reports it through
+#   on_release (the whole cycle at once through on_batch), marks it announced
+#   and pushes that show's following episode.
+# - airing_within() answers "what airs in the next N hours" from the
+#   precomputed broadcast_utc_minute column with one indexed query.
+# - run() repeats run_once() and sleeps until the top of the heap is due,
+#   reloading the catalog periodically to pick up newly added shows.
+#
+# Every run_once() is timed as release.cycle and, with ANINOTIF_PROFILE set,
+# profiled (see metrics.py).
+#
+# A SimulatedClock can replace the system clock to test schedules deterministically.
+# ======================================================================
+
+import heapq
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from broadcast import (broadcast_from_columns, episode_air_time, parse_aired, next_air_times, next_episode,
+                       format_release_date, parse_release_date)
+from db import Database
+from lazy import DeferredConsole
+import metrics
+
+console = DeferredConsole()
+
+# How often the catalog is re-read to pick up added/finished shows, in seconds
+RELOAD_INTERVAL = 6 * 3600
+
+# A detected episode release
+Release = namedtuple("Release", ["anime_id", "title", "episode", "air_time", "broadcast"])
+
+# ----------------------------------------------------------------------
+# Clocks
+# ----------------------------------------------------------------------
+
+class SystemClock:
+    """Wall clock returning aware UTC datetimes."""
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def sleep(self, seconds: float):
+        time.sleep(max(0.0, seconds))
+
+class SimulatedClock:
+    """Deterministic clock: sleeping simply advances the current time."""
+    def __init__(self, start: datetime):
+        self.current = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+
+    def now(self) -> datetime:
+        return self.current
+
+    def sleep(self, seconds: float):
+        self.current += timedelta(seconds=max(0.0, seconds))
+
+# ----------------------------------------------------------------------
+# Release Scheduler
+# ----------------------------------------------------------------------
+
+class ReleaseScheduler:
+    """Heap-based scheduler of upcoming episode releases for every airing anime."""
+    def __init__(self, db: Database = None, clock=None, on_release=None, on_batch=None):
+        self.db = db or Database()
+        self.clock = clock or SystemClock()
+        self.on_release = on_release or _print_release
+        self.on_batch = on_batch    # called once per cycle with the list of releases, e.g. Outbox.fan_out
+        self._heap = []
+        self._shows = {}  # anime_id -> (title, episodes, premiere date, Broadcast, broadcast string)
+        self._loaded_at = None
+
+    def load(self):
+        """(Re)build the heap from the catalog and record every show's upcoming episode. Returns the number of shows scheduled."""
+        now = self.clock.now()
+        self._heap = []
+        self._shows = {}
+        pending = {anime_id: (episode, release_date) for anime_id, episode, release_date in self.db.get_pending_releases() or []}
+        announced = self.db.get_last_announced_episodes() or {}
+        fresh = []
+        unreadable = []
+        for anime_id, title, episodes, aired_from, broadcast_text, *slot_columns in self.db.get_airing_anime() or []:
+            slot, premiere = broadcast_from_columns(*slot_columns), parse_aired(aired_from)
+            if slot is None or premiere is None:
+                continue
+            self._shows[anime_id] = (title, episodes, premiere, slot, broadcast_text)
+            resume_at = _recorded_air_time(anime_id, *pending[anime_id]) if anime_id in pending else None
+            if resume_at is not None:
+                # Resume from the episode a previous run recorded but never announced
+                self._heap.append((resume_at, anime_id, pending[anime_id][0]))
+            else:
+                if anime_id in pending:
+                    # The recorded row is replaced by the episode computed below, so it is only reported once
+                    unreadable.append((anime_id, pending[anime_id][0]))
+                # Never go back to an episode a previous run already announced
+                after = now
+                if anime_id in announced:
+                    after = max(now, episode_air_time(slot, premiere, announced[anime_id]))
+                self._schedule(anime_id, after)
+                if self._heap and self._heap[-1][1] == anime_id:
+                    fresh.append(self._heap[-1])
+        heapq.heapify(self._heap)
+        if unreadable:
+            self.db.delete_pending_releases(unreadable)
+        self._record_upcoming(fresh)
+        self._loaded_at = now
+        return len(self._heap)
+
+    def _schedule(self, anime_id, after: datetime):
+        """Append the first episode of anime_id airing after `after` to the heap (unordered)."""
+        title, episodes, premiere, slot, _ = self._shows[anime_id]
+        upcoming = next_episode(slot, premiere, episodes, after)
+        if upcoming is not None:
+            episode, air_time = upcoming
+            self._heap.append((air_time, anime_id, episode))
+
+    def _record_upcoming(self, entries):
+        """Write heap entries into the releases table; already known episodes are left untouched."""
+        if entries:
+            self.db.add_releases_many(
+                (anime_id, episode, format_release_date(air_time), self._shows[anime_id][4])
+                for air_time, anime_id, episode in entries
+            )
+
+    def airing_within(self, hours: float = 24) -> list:
+        """Return (air_time, anime_id, title) of the airing shows whose weekly slot comes up in the next `hours`,
+        soonest first, with one indexed query on broadcast_utc_minute and one next_air_times pass (no load needed)."""
+        now = self.clock.now()
+        rows = self.db.get_anime_airing_within(now, hours) or []
+        titles = {anime_id: title for anime_id, title, _ in rows}
+        end = now + timedelta(hours=hours)
+        upcoming = next_air_times(((anime_id, slot) for anime_id, _, slot in rows), now)
+        return sorted((times[0], anime_id, titles[anime_id]) for anime_id, times in upcoming.items() if times[0] <= end)
+
+    def next_release_time(self):
+        """Return the air time at the top of the heap, or None if nothing is scheduled."""
+        return self._heap[0][0] if self._heap else None
+
+    @metrics.timed("release.cycle")
+    @metrics.profiled("release-cycle")
+    def run_once(self):
+        """Report every release that is now out and schedule the following episodes. Returns the released list."""
+        now = self.clock.now()
+        if self._loaded_at is None or (now - self._loaded_at).total_seconds() >= RELOAD_INTERVAL:
+            self.load()
+        released = []
+        scheduled = []
+        while self._heap and self._heap[0][0] <= now:
+            air_time, anime_id, episode = heapq.heappop(self._heap)
+            title, _, _, _, broadcast_text = self._shows[anime_id]
+            released.append(Release(anime_id, title, episode, air_time, broadcast_text))
+            size = len(self._heap)
+            self._schedule(anime_id, air_time)
+            if len(self._heap) > size:
+                entry = self._heap.pop()
+                heapq.heappush(self._heap, entry)
+                scheduled.append(entry)
+        self._record_upcoming(scheduled)
+        for release in released:
+            self.on_release(release)
+        if released and self.on_batch is not None:
+            self.on_batch(released)
+        if released:
+            self.db.mark_releases_announced(((r.anime_id, r.episode) for r in released), format_release_date(now))
+        return released
+
+    def run(self, until: datetime = None, max_sleep: float = RELOAD_INTERVAL):
+        """Loop forever (or until the clock passes `until`), sleeping until the earliest upcoming release."""
+        self.load()
+        while until is None or self.clock.now() < until:
+            self.run_once()
+            wake_at = self.next_release_time()
+            sleep_for = max_sleep if wake_at is None else (wake_at - self.clock.now()).total_seconds()
+            if until is not None:
+                sleep_for = min(sleep_for, (until - self.clock.now()).total_seconds())
+            self.clock.sleep(min(max(sleep_for, 0.0), max_sleep))
+
+def _recorded_air_time(anime_id, episode, release_date):
+    """Air time of a recorded release, or None (logged) when its release_date is missing or not in the stored format."""
+    try:
+        return parse_release_date(release_date)
+    except (TypeError, ValueError):
+        metrics.increment("release.unreadable_dates")
+        console.print(f"[yellow]Ignoring episode {episode} of anime {anime_id}: unreadable release date {release_date!r}[/yellow]")
+        return None
+
+def _print_release(release: Release):
+    """Default release handler: print the release to the console."""
+    console.print(f"[green]{release.title}[/green] episode {release.episode} is out ({format_release_date(release.air_time)} UTC)")
+
+# ----------------------------------------------------------------------
+# Entry Points
+# ----------------------------------------------------------------------
+
+def run_once(db: Database = None, clock=None, on_release=None):
+    """Load the schedule, report releases that are out now and return (released, next release time)."""
+    scheduler = ReleaseScheduler(db, clock, on_release)
+    scheduler.load()
+    released = scheduler.run_once()
+    return released, scheduler.next_release_time()
+
+def run(db: Database = None, clock=None, on_release=None, until: datetime = None):
+    """Run the release-detection loop until interrupted (or until `until` on a simulated clock)."""
+    ReleaseScheduler(db, clock, on_release).run(until=until)
+
+
+if __name__ == '__main__':
+    released, upcoming = run_once()
+    console.print(f"{len(released)} release(s) out; next release at {upcoming}")
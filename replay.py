@@ -0,0 +1,291 @@
+# ======================================================================
+# File: replay.py
+# Description: This file contains the record/replay layer of the Jikan
+# client: every request/response can be appended to a compressed JSON-lines
+# log, and the whole API can later be served from that log, or from a
+# mirror table bulk-loaded from it, without touching the network.
+#
+# How record/replay works:
+#
+# - api_requests mounts a transport adapter on the shared HTTP session for
+#   JIKAN_BASE_URL, so every call (single fetches, concurrent batches,
+#   search) goes through it without changes to the callers.
+# - JIKAN_RECORD=traffic.jsonl.gz: RecordingAdapter sends requests as usual
+#   and appends one JSON line per exchange (method, path, status, the
+#   headers the client reads, JSON body) to a gzip stream.
+# - JIKAN_REPLAY=traffic.jsonl.gz (or a mirror .db file): ReplayAdapter
+#   answers from the recording instantly, honours If-None-Match with 304,
+#   and answers requests that were never recorded with a Jikan-style 404.
+#   The client's rate limiter is switched off, since nothing reaches Jikan.
+# - Requests are keyed by method and path with sorted query parameters,
+#   relative to the base URL, so a log recorded against api.jikan.moe
+#   replays under any JIKAN_BASE_URL. When a request was recorded several
+#   times, the latest 200/404 answer wins over throttled or failed ones.
+# - The `jikan-mirror` command bulk-loads logs into the mirror table (one
+#   zlib-compressed row per request) and can copy it into the response
+#   cache to warm a new deployment without a single Jikan call.
+# ======================================================================
+
+import atexit
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from http import HTTPStatus
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+import metrics
+
+# Mirror database file name
+MIRROR_DB_NAME = "jikan_mirror.db"
+
+# Response headers kept in recordings (the ones the cache and the retry logic read)
+RECORDED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control", "Expires", "Retry-After")
+
+# Answers a replay prefers when a request was recorded several times (throttling and server errors are transient)
+SERVED_STATUSES = (200, 404)
+
+# Body of the answer to a request missing from the recording (same shape as Jikan's 404)
+NOT_RECORDED = {"status": 404, "type": "BadResponseException", "message": "Resource was not recorded", "error": None}
+
+def request_key(method: str, url: str, base_url: str) -> str:
+    """Return "METHOD /path?sorted=query" for url, relative to the path of base_url."""
+    parts = urlsplit(url)
+    base_path = urlsplit(base_url).path.rstrip("/")
+    path = parts.path[len(base_path):] if base_path and parts.path.startswith(base_path) else parts.path
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f"{method.upper()} {path or '/'}{'?' + query if query else ''}"
+
+def _prefer(new_status: int, old_status: int) -> bool:
+    """Whether a later recording of the same request should replace the earlier one."""
+    return new_status in SERVED_STATUSES or old_status not in SERVED_STATUSES
+
+# ----------------------------------------------------------------------
+# Traffic Log
+# ----------------------------------------------------------------------
+
+class TrafficLog:
+    """Append-only gzip JSON-lines log of Jikan exchanges."""
+    def __init__(self, path: str):
+        self.path = path
+        self.written = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, key: str, status: int, headers, body: bytes, elapsed: float):
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = body.decode("utf-8", "replace")
+        record = {"ts": time.time(), "key": key, "status": status, "elapsed_ms": round(elapsed * 1000, 3),
+                  "headers": {name: headers[name] for name in RECORDED_HEADERS if name in headers}, "body": payload}
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+        with self._lock:
+            if self._file is None:
+                # Appending starts a new gzip member; readers see one continuous stream
+                self._file = gzip.open(self.path, "ab")
+                atexit.register(self.close)
+            self._file.write(line)
+            # A sync flush keeps every complete record readable if the process dies
+            self._file.flush()
+            self.written += 1
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def read_log(path: str):
+    """Yield the records of a traffic log, stopping quietly at a truncated tail."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+        except (EOFError, zlib.error):
+            return
+
+def _body_bytes(body) -> bytes:
+    if body is None:
+        return b""
+    if isinstance(body, str):
+        return body.encode()
+    return json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode()
+
+# ----------------------------------------------------------------------
+# Replay Sources
+# ----------------------------------------------------------------------
+
+class LogStore:
+    """Recorded answers of a traffic log, held in memory: {key: (status, headers, body bytes)}."""
+    def __init__(self, path: str):
+        self.answers = {}
+        for record in read_log(path):
+            previous = self.answers.get(record["key"])
+            if previous is None or _prefer(record["status"], previous[0]):
+                self.answers[record["key"]] = (record["status"], record["headers"], _body_bytes(record["body"]))
+
+    def get(self, key: str):
+        return self.answers.get(key)
+
+    def close(self):
+        pass
+
+class MirrorStore:
+    """SQLite mirror of recorded answers, one zlib-compressed row per request, bulk-loaded from traffic logs."""
+    def __init__(self, db_name: str = MIRROR_DB_NAME):
+        self.db_name = db_name
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_name, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS mirror (
+            key TEXT PRIMARY KEY,
+            status INTEGER NOT NULL,
+            headers TEXT NOT NULL,
+            body BLOB NOT NULL,
+            raw_size INTEGER NOT NULL,
+            recorded_at REAL NOT NULL
+        )
+        ''')
+        self._conn.commit()
+
+    def load_log(self, path: str) -> int:
+        """Bulk-load a traffic log in one transaction. Returns the number of records read."""
+        served = ", ".join(map(str, SERVED_STATUSES))
+        count = 0
+
+        def rows():
+            nonlocal count
+            for record in read_log(path):
+                count += 1
+                body = _body_bytes(record["body"])
+                yield (record["key"], record["status"], json.dumps(record["headers"]), zlib.compress(body, 6), len(body),
+                       record["ts"])
+
+        with self._lock, self._conn:
+            self._conn.executemany(f'''
+            INSERT INTO mirror (key, status, headers, body, raw_size, recorded_at) VALUES (?,?,?,?,?,?)
+            ON CONFLICT(key) DO UPDATE SET status = excluded.status, headers = excluded.headers, body = excluded.body,
+                raw_size = excluded.raw_size, recorded_at = excluded.recorded_at
+            WHERE excluded.recorded_at >= mirror.recorded_at
+              AND (excluded.status IN ({served}) OR mirror.status NOT IN ({served}))
+            ''', rows())
+        return count
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT status, headers, body FROM mirror WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), zlib.decompress(row[2])
+
+    def entries(self, status: int = None):
+        """Yield (key, status, headers, body bytes) for every mirrored request (optionally one status only)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT key, status, headers, body FROM mirror" +
+                                      (" WHERE status = ?" if status is not None else "") + " ORDER BY key",
+                                      (status,) if status is not None else ()).fetchall()
+        for key, row_status, headers, body in rows:
+            yield key, row_status, json.loads(headers), zlib.decompress(body)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries, stored, raw = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0), COALESCE(SUM(raw_size), 0) FROM mirror").fetchone()
+            by_status = dict(self._conn.execute("SELECT status, COUNT(*) FROM mirror GROUP BY status"))
+        return {"entries": entries, **{f"status_{status}": count for status, count in sorted(by_status.items())},
+                "stored_bytes": stored, "raw_bytes": raw}
+
+    def close(self):
+        self._conn.close()
+
+def open_source(path: str):
+    """Open a replay source: a mirror database (.db/.sqlite) or a traffic log."""
+    if path.endswith((".db", ".sqlite")):
+        return MirrorStore(path)
+    return LogStore(path)
+
+def warm_cache(source: MirrorStore, cache, base_url: str) -> int:
+    """Store every recorded 200 GET answer in a ResponseCache under its URL. Returns the number of entries stored."""
+    stored = 0
+    for key, status, headers, body in source.entries(status=200):
+        method, path = key.split(" ", 1)
+        if method == "GET":
+            cache.store(f"{base_url.rstrip('/')}{path}", json.loads(body), headers)
+            stored += 1
+    return stored
+
+# ----------------------------------------------------------------------
+# Transport Adapters
+# ----------------------------------------------------------------------
+
+class RecordingAdapter(HTTPAdapter):
+    """HTTPAdapter appending every exchange to a TrafficLog."""
+    def __init__(self, log: TrafficLog, base_url: str, **kwargs):
+        super().__init__(**kwargs)
+        self.log = log
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        self.log.write(request_key(request.method, request.url, self.base_url), response.status_code, response.headers,
+                       response.content, time.perf_counter() - start)
+        return response
+
+class ReplayAdapter(BaseAdapter):
+    """Adapter answering from a replay source; nothing is sent over the network."""
+    def __init__(self, source, base_url: str):
+        super().__init__()
+        self.source = source
+        self.base_url = base_url
+        self.served = 0
+        self.missing = 0
+
+    def send(self, request, **kwargs):
+        answer = self.source.get(request_key(request.method, request.url, self.base_url))
+        if answer is None:
+            self.missing += 1
+            metrics.increment("jikan.replay.missing")
+            return self._response(request, 404, {"Content-Type": "application/json"}, _body_bytes(NOT_RECORDED))
+        self.served += 1
+        status, headers, body = answer
+        etag = headers.get("ETag")
+        if status == 200 and etag and request.headers.get("If-None-Match") == etag:
+            return self._response(request, 304, {"ETag": etag}, b"")
+        return self._response(request, status, headers, body)
+
+    @staticmethod
+    def _response(request, status: int, headers, body: bytes):
+        response = requests.Response()
+        response.status_code = status
+        response.reason = HTTPStatus(status).phrase
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = body
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        self.source.close()
+
+def install(session, base_url: str, record: str = None, replay: str = None):
+    """Mount the replay (or, failing that, the recording) adapter on session for URLs under base_url. Returns the adapter."""
+    if replay:
+        adapter = ReplayAdapter(open_source(replay), base_url)
+    elif record:
+        adapter = RecordingAdapter(TrafficLog(record), base_url, pool_connections=4, pool_maxsize=16)
+    else:
+        return None
+    session.mount(base_url, adapter)
+    return adapter
@@ -0,0 +1,129 @@
+# ======================================================================
+# File: search.py
+# Description: This file contains the anime title search used by the
+# `search` command.
+#
+# How a search works:
+#
+# - The query is split into words and matched against the anime_fts index
+#   (title, alternate titles, synopsis), every word as a prefix, ranked by
+#   bm25 with titles weighted above synopses.
+# - If nothing matches, misspelled words are replaced by the closest indexed
+#   term (difflib over the anime_fts_vocab terms sharing their first letter)
+#   and the search is retried.
+# - Only if the local catalog still has no match is Jikan's /anime?q= endpoint
+#   queried. Its response goes through the response cache and the results are
+#   added to the catalog, so the next search for them is answered locally.
+# ======================================================================
+
+import difflib
+import re
+from collections import namedtuple
+from urllib.parse import urlencode
+from anime_raw import RawPayloadStore
+from api_requests import get_json, parse_anime_info
+from db import Database
+
+# Default number of results returned by a search
+SEARCH_LIMIT = 10
+
+# bm25 weights of the title, alt_titles and synopsis columns
+COLUMN_WEIGHTS = (10.0, 6.0, 1.0)
+
+# Minimum difflib similarity for a misspelled word to be replaced by an indexed term
+FUZZY_CUTOFF = 0.75
+
+# Largest page size accepted by Jikan's search endpoint
+JIKAN_SEARCH_LIMIT = 25
+
+# A search hit; source is "local", "fuzzy" or "jikan"
+SearchResult = namedtuple("SearchResult", ["anime_id", "mal_id", "title", "episodes", "status", "score", "source"])
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# ----------------------------------------------------------------------
+# Local Search
+# ----------------------------------------------------------------------
+
+def query_words(query: str) -> list:
+    """Split a search query into lowercase words, the way the FTS tokenizer sees them."""
+    return [word.lower() for word in WORD_PATTERN.findall(query)]
+
+def match_expression(words) -> str:
+    """Build an FTS5 MATCH expression requiring every word as a prefix ("attack tit" finds "Attack on Titan")."""
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+def search_local(db: Database, words, limit: int = SEARCH_LIMIT, source: str = "local") -> list:
+    """Return the best ranked SearchResults for words from the full-text index."""
+    if not words:
+        return []
+    weights = ", ".join(str(weight) for weight in COLUMN_WEIGHTS)
+    with db.transaction() as cursor:
+        cursor.execute(f'''
+        SELECT a.id, a.mal_id, a.title, a.episodes, a.status, bm25(anime_fts, {weights}) AS score
+        FROM anime_fts JOIN anime a ON a.id = anime_fts.rowid
+        WHERE anime_fts MATCH ?
+        ORDER BY score
+        LIMIT ?
+        ''', (match_expression(words), limit))
+        return [SearchResult(*row, source) for row in cursor.fetchall()]
+
+def correct_words(db: Database, words) -> list:
+    """Replace every word that is not the prefix of an indexed term by its closest indexed term.
+
+    Candidates are limited to terms sharing the word's first letter and of a
+    similar length, so only a small range of the vocabulary is compared.
+    Returns None if some word has no close enough term.
+    """
+    corrected = []
+    with db.transaction() as cursor:
+        for word in words:
+            cursor.execute("SELECT 1 FROM anime_fts_vocab WHERE term >= ? AND term < ? LIMIT 1", (word, word + "\U0010ffff"))
+            if cursor.fetchone():
+                corrected.append(word)
+                continue
+            cursor.execute('''
+            SELECT term FROM anime_fts_vocab
+            WHERE term >= ? AND term < ? AND length(term) BETWEEN ? AND ?
+            ''', (word[0], word[0] + "\U0010ffff", len(word) - 2, len(word) + 2))
+            matches = difflib.get_close_matches(word, [term for term, in cursor.fetchall()], n=1, cutoff=FUZZY_CUTOFF)
+            if not matches:
+                return None
+            corrected.append(matches[0])
+    return corrected
+
+# ----------------------------------------------------------------------
+# Jikan Fallback
+# ----------------------------------------------------------------------
+
+def search_jikan(db: Database, query: str, limit: int = SEARCH_LIMIT) -> list:
+    """Search Jikan, add the results missing from the catalog and return them in Jikan's order."""
+    payload = get_json("/anime?" + urlencode({"q": query, "limit": min(limit, JIKAN_SEARCH_LIMIT)}))
+    rows = [parse_anime_info(anime) for anime in payload.get("data") or []]
+    if not rows:
+        return []
+    RawPayloadStore(db).store_many(payload["data"])
+    # Anime already in the catalog come back as mal_id conflicts and are left as they are
+    db.create_anime_many(rows)
+    local_ids = db.get_anime_ids_by_mal_ids([row["mal_id"] for row in rows]) or {}
+    return [SearchResult(local_ids.get(row["mal_id"]), row["mal_id"], row["title"], row["episodes"], row["status"], None, "jikan")
+            for row in rows]
+
+# ----------------------------------------------------------------------
+# Entry Point
+# ----------------------------------------------------------------------
+
+def search(db: Database, query: str, limit: int = SEARCH_LIMIT, online: bool = True) -> list:
+    """Search the catalog by title: prefix match, then fuzzy match, then (if online) Jikan."""
+    words = query_words(query)
+    if not words:
+        return []
+    results = search_local(db, words, limit)
+    if results:
+        return results
+    corrected = correct_words(db, words)
+    if corrected and corrected != words:
+        results = search_local(db, corrected, limit, source="fuzzy")
+        if results:
+            return results
+    return search_jikan(db, query, limit) if online else []
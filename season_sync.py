@@ -0,0 +1,175 @@
+# ======================================================================
+# File: season_sync.py
+# Description: This file contains the season-level catalog sync used by the
+# `sync-season` command: every airing title is learnt from Jikan's listing
+# endpoints, 25 per request, instead of one full fetch per show.
+#
+# How a sync works:
+#
+# - /seasons/now is walked page by page, then /schedules, which also lists
+#   older shows that are still airing. An entry seen first wins; later
+#   listings only fill fields it lacks (a season entry without a broadcast
+#   slot may have one in the schedule).
+# - Only titles still missing a field the release checker needs (broadcast
+#   slot, air date) are fetched one by one with fetch_anime_many.
+# - Entries are parsed like full fetches and upserted in batched
+#   transactions: new titles are inserted, titles whose content hash changed
+#   get every column rewritten, and unchanged ones only have their check
+#   times moved. Synced rows count as freshly checked, so the metadata
+#   refresh does not fetch them again right away. Listing entries and full
+#   fetches are also kept whole in anime_raw (see anime_raw.py).
+# ======================================================================
+
+import json
+import random
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+from anime_raw import RawPayloadStore
+from api_requests import fetch_anime_many, get_json, parse_anime_info
+from broadcast import BROADCAST_COLUMNS, broadcast_columns
+from db import ANIME_COLUMNS, BATCH_CHUNK_SIZE, Database
+from lazy import lazy_import
+from refresh import REFRESH_JITTER, content_hash, refresh_interval
+
+asyncio = lazy_import("asyncio")
+
+# Listing endpoints walked by a sync, in order
+SEASON_PATH = "/seasons/now"
+SCHEDULES_PATH = "/schedules"
+
+# Entries requested per listing page (Jikan's maximum)
+LISTING_PAGE_LIMIT = 25
+
+# Pages read per listing at most, in case pagination never ends
+MAX_PAGES = 200
+
+# Outcome of a sync; pages and full_fetches count Jikan calls (pages served by the response cache included)
+SyncReport = namedtuple("SyncReport", ["listed", "inserted", "updated", "unchanged", "full_fetches", "failed", "pages",
+                                       "elapsed"])
+
+def listing_gaps(anime: dict) -> list:
+    """Names of the fields a listing entry lacks that scheduling releases needs."""
+    gaps = []
+    if not (anime.get("broadcast") or {}).get("string"):
+        gaps.append("broadcast")
+    if not (anime.get("aired") or {}).get("from"):
+        gaps.append("aired")
+    return gaps
+
+# ----------------------------------------------------------------------
+# Season Sync
+# ----------------------------------------------------------------------
+
+class SeasonSync:
+    """Upsert the airing catalog from Jikan's paginated season and schedule listings."""
+    def __init__(self, db: Database = None, clock=time.time, concurrency: int = 3, rate_limiter=None, seed: int = None):
+        self.db = db or Database()
+        self.clock = clock
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self._rng = random.Random(seed)
+        self.raw = RawPayloadStore(self.db, clock)
+        self.pages = 0
+
+    def iter_listing(self, path: str, **params):
+        """Yield every anime entry of a paginated listing endpoint."""
+        for page in range(1, MAX_PAGES + 1):
+            payload = get_json(f"{path}?{urlencode({**params, 'page': page, 'limit': LISTING_PAGE_LIMIT})}",
+                               rate_limiter=self.rate_limiter)
+            self.pages += 1
+            yield from payload.get("data") or []
+            if not (payload.get("pagination") or {}).get("has_next_page"):
+                return
+
+    def collect(self, schedules: bool = True) -> dict:
+        """Return {mal_id: entry} from /seasons/now, completed (and extended) by /schedules."""
+        entries = {}
+        for path in (SEASON_PATH, SCHEDULES_PATH) if schedules else (SEASON_PATH,):
+            for anime in self.iter_listing(path):
+                known = entries.get(anime["mal_id"])
+                if known is None:
+                    entries[anime["mal_id"]] = anime
+                    continue
+                for field in listing_gaps(known):
+                    if field not in listing_gaps(anime):
+                        known[field] = anime[field]
+        return entries
+
+    def fill_gaps(self, entries: dict) -> tuple:
+        """Full-fetch the entries still lacking fields, in place. Returns (ids fetched, ids still incomplete)."""
+        incomplete = [mal_id for mal_id, anime in entries.items() if listing_gaps(anime)]
+        if not incomplete:
+            return [], []
+        fetch = asyncio.run(fetch_anime_many(incomplete, concurrency=self.concurrency, rate_limiter=self.rate_limiter))
+        entries.update(fetch.results)
+        return incomplete, [mal_id for mal_id in incomplete if listing_gaps(entries[mal_id])]
+
+    def upsert(self, rows, incomplete=()) -> tuple:
+        """Write parsed rows in batched transactions. Returns (inserted, updated, unchanged) counts.
+
+        Titles in `incomplete` are only inserted when new, so a partial entry never overwrites a complete row.
+        """
+        now = self.clock()
+        inserted = updated = unchanged = 0
+        changed_ids = []
+        columns = ANIME_COLUMNS + BROADCAST_COLUMNS
+        incomplete = set(incomplete)
+        for start in range(0, len(rows), BATCH_CHUNK_SIZE):
+            chunk = rows[start:start + BATCH_CHUNK_SIZE]
+            inserts, updates, touched = [], [], []
+            with self.db.transaction() as cursor:
+                cursor.execute(f"SELECT mal_id, id, content_hash FROM anime WHERE mal_id IN ({','.join('?' * len(chunk))})",
+                               [row["mal_id"] for row in chunk])
+                existing = {mal_id: (anime_id, digest) for mal_id, anime_id, digest in cursor.fetchall()}
+                for row in chunk:
+                    digest = content_hash(row)
+                    next_check = now + refresh_interval(row["status"]) * (1 + self._rng.random() * REFRESH_JITTER)
+                    values = tuple(row.get(column) for column in ANIME_COLUMNS) + broadcast_columns(row["broadcast"])
+                    anime_id, stored_digest = existing.get(row["mal_id"], (None, None))
+                    if anime_id is None:
+                        inserts.append(values + (digest, now, next_check))
+                    elif row["mal_id"] in incomplete:
+                        continue
+                    elif digest != stored_digest:
+                        updates.append(values + (digest, now, next_check, anime_id))
+                        changed_ids.append(anime_id)
+                    else:
+                        touched.append((now, next_check, anime_id))
+                cursor.executemany(f"INSERT INTO anime ({', '.join(columns)}, content_hash, last_checked_at, next_check_at) "
+                                   f"VALUES ({','.join('?' * (len(columns) + 3))})", inserts)
+                assignments = "".join(f"{column} = ?, " for column in columns)
+                cursor.executemany(f"UPDATE anime SET {assignments}content_hash = ?, last_checked_at = ?, next_check_at = ? "
+                                   "WHERE id = ?", updates)
+                cursor.executemany("UPDATE anime SET last_checked_at = ?, next_check_at = ? WHERE id = ?", touched)
+            inserted, updated, unchanged = inserted + len(inserts), updated + len(updates), unchanged + len(touched)
+        if inserted:
+            self.db.notify_write("anime")
+        elif changed_ids:
+            self.db.notify_write("anime", changed_ids)
+        return inserted, updated, unchanged
+
+    def sync(self, schedules: bool = True, fallback: bool = True) -> SyncReport:
+        """Walk the listings, fill gaps with full fetches (unless fallback is off) and upsert everything."""
+        start = time.perf_counter()
+        self.pages = 0
+        entries = self.collect(schedules)
+        if fallback:
+            fetched, incomplete = self.fill_gaps(entries)
+        else:
+            fetched, incomplete = [], [mal_id for mal_id, anime in entries.items() if listing_gaps(anime)]
+        rows = []
+        for mal_id, anime in entries.items():
+            try:
+                rows.append(parse_anime_info(anime))
+            except (KeyError, TypeError):
+                incomplete.append(mal_id)
+        inserted, updated, unchanged = self.upsert(rows, incomplete)
+        self.raw.store_many(entries.values())
+        return SyncReport(listed=len(entries), inserted=inserted, updated=updated, unchanged=unchanged,
+                          full_fetches=len(fetched), failed=len(incomplete), pages=self.pages,
+                          elapsed=time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print(json.dumps(SeasonSync().sync()._asdict(), indent=2))
@@ -0,0 +1,229 @@
+# ======================================================================
+# File: sharding.py
+# Description: This file contains a sharded storage layout for the
+# per-user tables, measured by the `shards` benchmark scenario.
+#
+# How the layout works:
+#
+# - The shared catalog (users, anime, releases) lives in one read-mostly
+#   file, catalog.db, managed by a regular Database.
+# - Per-user data (watchlist and notification outbox) is spread over several
+#   shard files, watchlist-NN.db, chosen by a stable hash of the user id, so
+#   writers of different users no longer contend for the same SQLite lock.
+# - Every shard connection ATTACHes the catalog. Unqualified table names
+#   resolve to the shard first and to the catalog next, so the existing
+#   Database and Outbox methods (including the fan-out join) run unchanged
+#   against a shard.
+# - Operations spanning users (fan-out, batch inserts) run on every shard in
+#   parallel worker threads.
+#
+# The shard count is recorded in the catalog; opening a layout with a
+# different count is refused, since users would be routed to the wrong shard.
+#
+# ShardedDatabase only covers the per-user batch operations (watchlist
+# inserts and lookups, fan-out, outboxes). The CLI, the daemon and the
+# modules they use still run on a single-file Database.
+# ======================================================================
+
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from db import WATCHLIST_COLUMNS, BatchResult, Database, _as_rows
+from notifications import Outbox
+
+# File names inside a sharded layout directory
+CATALOG_FILE = "catalog.db"
+SHARD_FILE = "watchlist-{:02d}.db"
+
+# Per-user tables created in every shard (same columns and indexes as in the single-file schema, minus
+# foreign keys, which SQLite cannot declare across attached databases)
+SHARD_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS watchlist (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        anime_id INTEGER,
+        added_on TEXT DEFAULT CURRENT_TIMESTAMP,
+        last_watched_episode INTEGER DEFAULT 0,
+        updated_on TEXT
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_watchlist_user_anime ON watchlist(user_id, anime_id)",
+    "CREATE INDEX IF NOT EXISTS idx_watchlist_anime_progress ON watchlist(anime_id, last_watched_episode, user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_watchlist_updated ON watchlist(updated_on)",
+    '''
+    CREATE TRIGGER IF NOT EXISTS trg_watchlist_touch_update AFTER UPDATE ON watchlist
+    WHEN NEW.updated_on IS OLD.updated_on
+    BEGIN
+        UPDATE watchlist SET updated_on = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = NEW.id;
+    END
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT UNIQUE NOT NULL,
+        user_id INTEGER,
+        anime_id INTEGER,
+        anime_title TEXT,
+        episode INTEGER,
+        air_time TEXT,
+        created_at REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        delivered_at REAL,
+        last_error TEXT,
+        next_attempt_at REAL NOT NULL DEFAULT 0
+    )
+    ''',
+    "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON notification_outbox(id) WHERE status = 'pending'",
+)
+
+# Columns added to the shard tables after their first release, added to older shard files by init_shard
+SHARD_ADDED_COLUMNS = (
+    ("notification_outbox", "next_attempt_at", "REAL NOT NULL DEFAULT 0"),
+)
+
+# Tables of the single-file schema that only belong in the shards (per-user data), and the watching-statistics
+# aggregates built on them, which triggers of the catalog could not maintain; init_db drops them from the catalog
+SHARD_ONLY_TABLES = ("watchlist", "notification_outbox")
+WATCHLIST_AGGREGATE_TABLES = ("user_stats", "global_stats", "stats_anime")
+
+def shard_index(user_id: int, shards: int) -> int:
+    """Stable shard number of a user (the same in every process, unlike hash())."""
+    return zlib.crc32(str(user_id).encode()) % shards
+
+# ----------------------------------------------------------------------
+# Shards
+# ----------------------------------------------------------------------
+
+class ShardDatabase(Database):
+    """A Database on one shard file, with the catalog attached to every connection as `catalog`."""
+    def __init__(self, db_name: str, catalog_path: str):
+        super().__init__(db_name)
+        self.catalog_path = catalog_path
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = super()._connect()
+            conn.execute("ATTACH DATABASE ? AS catalog", (self.catalog_path,))
+        return conn
+
+    def init_shard(self):
+        """Create the per-user tables of the shard, or add the columns an older shard file lacks."""
+        with self.transaction() as cursor:
+            for statement in SHARD_SCHEMA:
+                cursor.execute(statement)
+            for table, column, definition in SHARD_ADDED_COLUMNS:
+                if column not in {row[1] for row in cursor.execute(f"PRAGMA main.table_info({table})")}:
+                    cursor.execute(f"ALTER TABLE main.{table} ADD COLUMN {column} {definition}")
+
+class ShardedDatabase:
+    """Catalog file plus user-sharded watchlist files, exposing the per-user Database operations."""
+    def __init__(self, root: str, shards: int = 4):
+        if shards < 1:
+            raise ValueError("A sharded layout needs at least one shard")
+        self.root = root
+        self.shard_count = shards
+        os.makedirs(root, exist_ok=True)
+        catalog_path = os.path.join(root, CATALOG_FILE)
+        self.catalog = Database(catalog_path)
+        self.shards = [ShardDatabase(os.path.join(root, SHARD_FILE.format(i)), catalog_path) for i in range(shards)]
+        self._executor = ThreadPoolExecutor(max_workers=shards, thread_name_prefix="shard")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def init_db(self):
+        """Create the catalog and every shard, recording the shard count."""
+        self.catalog.init_db()
+        with self.catalog.transaction() as cursor:
+            self._drop_per_user_schema(cursor)
+            cursor.execute("CREATE TABLE IF NOT EXISTS shard_layout (shards INTEGER NOT NULL)")
+            cursor.execute("SELECT shards FROM shard_layout")
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO shard_layout (shards) VALUES (?)", (self.shard_count,))
+            elif row[0] != self.shard_count:
+                raise ValueError(f"{self.root} was created with {row[0]} shards, not {self.shard_count}")
+        for shard in self.shards:
+            shard.init_shard()
+
+    @staticmethod
+    def _drop_per_user_schema(cursor):
+        """Drop the empty per-user tables Database.init_db created in the catalog, with the triggers using them."""
+        tables = [table for table in SHARD_ONLY_TABLES + WATCHLIST_AGGREGATE_TABLES
+                  if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+                  and (table in WATCHLIST_AGGREGATE_TABLES or not cursor.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone())]
+        if not tables:
+            return
+        pattern = re.compile(rf"\b({'|'.join(tables)})\b")
+        triggers = [name for name, sql in cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+                    if pattern.search(sql)]
+        for name in triggers:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        for table in tables:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for database in [self.catalog, *self.shards]:
+            database.close()
+
+    def shard_for(self, user_id: int) -> ShardDatabase:
+        return self.shards[shard_index(user_id, self.shard_count)]
+
+    def map_shards(self, fn, items_by_shard=None) -> list:
+        """Run fn(shard) (or fn(shard, items) for the shards that have items) on worker threads, one per shard."""
+        if items_by_shard is None:
+            return list(self._executor.map(fn, self.shards))
+        futures = [self._executor.submit(fn, self.shards[index], items) for index, items in items_by_shard.items()]
+        return [future.result() for future in futures]
+
+    def _group_by_shard(self, rows, user_of=lambda row: row[0]) -> dict:
+        groups = {}
+        for row in rows:
+            groups.setdefault(shard_index(user_of(row), self.shard_count), []).append(row)
+        return groups
+
+    # -----------------------
+    # Per-user Operations
+    # -----------------------
+    def add_to_watchlist(self, user_id, anime_id, last_watched_episode=0):
+        return self.shard_for(user_id).add_to_watchlist(user_id, anime_id, last_watched_episode)
+
+    def get_watchlist(self, user_id):
+        return self.shard_for(user_id).get_watchlist(user_id)
+
+    def get_watchlist_page(self, user_id, *args, **kwargs):
+        return self.shard_for(user_id).get_watchlist_page(user_id, *args, **kwargs)
+
+    def get_watchlist_ids(self, user_id, anime_ids):
+        return self.shard_for(user_id).get_watchlist_ids(user_id, anime_ids)
+
+    def add_to_watchlist_many(self, entries):
+        """Insert (user_id, anime_id[, last_watched_episode]) tuples or dicts, every shard in parallel. Returns a
+        BatchResult (conflict indexes refer to `entries`, as with Database.add_to_watchlist_many) or False if a shard
+        failed."""
+        rows = _as_rows(entries, WATCHLIST_COLUMNS, {"last_watched_episode": 0})
+        groups = self._group_by_shard(enumerate(rows), user_of=lambda item: item[1][0])
+        results = self.map_shards(lambda shard, items: (items, shard.add_to_watchlist_many([row for _, row in items])),
+                                  groups)
+        if any(result is False for _, result in results):
+            return False
+        return BatchResult(sum(result.inserted for _, result in results),
+                           sorted(((items[index][0], row, error) for items, result in results
+                                   for index, row, error in result.conflicts), key=lambda conflict: conflict[0]))
+
+    def fan_out(self, releases) -> int:
+        """Queue per-watcher notifications for releases on every shard in parallel. Returns the number queued."""
+        releases = list(releases)
+        return sum(self.map_shards(lambda shard: Outbox(shard).fan_out(releases)))
+
+    def outboxes(self) -> list:
+        """One Outbox per shard, for notification workers."""
+        return [Outbox(shard) for shard in self.shards]
@@ -0,0 +1,322 @@
+# ======================================================================
+# File: stub_jikan.py
+# Description: This file contains a local stub of the Jikan API used to
+# exercise api_requests (rate limiting, retries, batch fetching, search,
+# season and schedule listings) without touching the real service. It also
+# accepts POST /webhook to stand in for the notification webhook backend.
+#
+# Usage:
+#   python stub_jikan.py --port 8765 --latency 0.05 --throttle-rate 0.1
+#   JIKAN_BASE_URL=http://127.0.0.1:8765/v4 python cli.py add-anime --mal_id 1
+# ======================================================================
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import click
+
+WEEKDAYS = ("Mondays", "Tuesdays", "Wednesdays", "Thursdays", "Fridays", "Saturdays", "Sundays")
+
+# (mal_id, name) pools the descriptive fields of fake payloads are drawn from
+GENRES = ((1, "Action"), (2, "Adventure"), (4, "Comedy"), (8, "Drama"), (10, "Fantasy"), (14, "Horror"), (7, "Mystery"),
+          (22, "Romance"), (24, "Sci-Fi"), (36, "Slice of Life"), (30, "Sports"), (37, "Supernatural"))
+THEMES = ((62, "Isekai"), (17, "Martial Arts"), (18, "Mecha"), (19, "Music"), (23, "School"), (38, "Military"))
+STUDIOS = ((4, "Bones"), (43, "ufotable"), (44, "Shaft"), (56, "A-1 Pictures"), (569, "MAPPA"), (858, "Wit Studio"),
+           (1835, "CloverWorks"), (2, "Kyoto Animation"))
+PRODUCERS = ((17, "Aniplex"), (53, "Dentsu"), (61, "Frontier Works"), (143, "Mainichi Broadcasting System"),
+             (159, "Kodansha"), (1143, "TOHO animation"), (104, "Lantis"), (166, "Movic"))
+
+# ----------------------------------------------------------------------
+# Synthetic Payloads
+# ----------------------------------------------------------------------
+
+def fake_anime(mal_id: int) -> dict:
+    """Build a deterministic Jikan-shaped anime payload for mal_id."""
+    rng = random.Random(mal_id)
+    airing = mal_id % 3 == 0
+    day = WEEKDAYS[mal_id % 7]
+    hour, minute = rng.randrange(0, 24), rng.choice((0, 30))
+    return {
+        "mal_id": mal_id,
+        "title": f"Stub Anime {mal_id}",
+        "titles": [
+            {"type": "Default", "title": f"Stub Anime {mal_id}"},
+            {"type": "English", "title": f"Stub Anime {mal_id}: The Series"},
+            {"type": "Japanese", "title": f"スタブアニメ {mal_id}"},
+        ],
+        "synopsis": f"Synthetic synopsis for anime {mal_id}.",
+        "episodes": None if airing else rng.choice((12, 13, 24, 25)),
+        "status": "Currently Airing" if airing else "Finished Airing",
+        "aired": {
+            "from": f"20{10 + mal_id % 15:02d}-{1 + mal_id % 12:02d}-0{1 + mal_id % 9}T00:00:00+00:00",
+            "to": None if airing else f"20{10 + mal_id % 15:02d}-12-20T00:00:00+00:00",
+        },
+        "broadcast": {
+            "day": day,
+            "time": f"{hour:02d}:{minute:02d}",
+            "timezone": "Asia/Tokyo",
+            "string": f"{day} at {hour:02d}:{minute:02d} (JST)",
+        },
+        **_fake_details(mal_id),
+    }
+
+def _fake_details(mal_id: int) -> dict:
+    """The descriptive fields of a Jikan anime payload that parse_anime_info does not keep."""
+    rng = random.Random(-mal_id)
+    url = f"https://myanimelist.net/anime/{mal_id}"
+
+    def entities(kind, pool, count):
+        return [{"mal_id": entity_id, "type": kind, "name": name, "url": f"https://myanimelist.net/anime/{kind}/{entity_id}"}
+                for entity_id, name in rng.sample(pool, count)]
+
+    images = {size: f"https://cdn.myanimelist.net/images/anime/{mal_id % 1000}/{mal_id}{suffix}"
+              for size, suffix in (("image_url", ".jpg"), ("small_image_url", "t.jpg"), ("large_image_url", "l.jpg"))}
+    return {
+        "url": url,
+        "images": {"jpg": images, "webp": {size: image.replace(".jpg", ".webp") for size, image in images.items()}},
+        "type": rng.choice(("TV", "TV", "TV", "Movie", "OVA", "ONA")),
+        "source": rng.choice(("Manga", "Light novel", "Original", "Web manga", "Visual novel")),
+        "duration": f"{rng.choice((23, 24, 24, 12))} min per ep",
+        "rating": rng.choice(("PG-13 - Teens 13 or older", "R - 17+ (violence & profanity)", "G - All Ages")),
+        "score": round(rng.uniform(5.5, 9.2), 2),
+        "scored_by": rng.randrange(1000, 2000000),
+        "rank": rng.randrange(1, 20000),
+        "popularity": rng.randrange(1, 20000),
+        "members": rng.randrange(5000, 4000000),
+        "favorites": rng.randrange(0, 200000),
+        "background": rng.choice((None, f"Stub Anime {mal_id} was adapted from a long-running serialization.")),
+        "season": rng.choice(("winter", "spring", "summer", "fall")),
+        "year": 2010 + mal_id % 15,
+        "producers": entities("producer", PRODUCERS, rng.randint(2, 4)),
+        "licensors": entities("producer", PRODUCERS[:3], rng.randint(0, 1)),
+        "studios": entities("producer", STUDIOS, 1),
+        "genres": entities("anime", GENRES, rng.randint(1, 4)),
+        "themes": entities("anime", THEMES, rng.randint(0, 2)),
+        "demographics": entities("anime", ((27, "Shounen"), (42, "Seinen"), (25, "Shoujo")), rng.randint(0, 1)),
+    }
+
+# MAL ids of the current season's titles, and of older shows still airing (listed by /schedules only)
+SEASON_FIRST_MAL_ID = 60001
+CONTINUING_FIRST_MAL_ID = 70001
+
+# Largest page size of the listing endpoints (same cap as Jikan)
+LISTING_PAGE_LIMIT = 25
+
+def fake_airing_anime(mal_id: int) -> dict:
+    """fake_anime for a title airing now (season or continuing show)."""
+    anime = fake_anime(mal_id)
+    anime["status"] = "Currently Airing"
+    anime["episodes"] = None if mal_id >= CONTINUING_FIRST_MAL_ID else random.Random(mal_id).choice((None, 12, 13, 24))
+    anime["aired"]["to"] = None
+    return anime
+
+def listing_entry(mal_id: int) -> dict:
+    """An anime as listed by /seasons and /schedules: every 10th season title has no broadcast slot yet."""
+    anime = fake_airing_anime(mal_id)
+    if mal_id < CONTINUING_FIRST_MAL_ID and mal_id % 10 == 0:
+        anime["broadcast"] = {"day": None, "time": None, "timezone": None, "string": None}
+    return anime
+
+def paginate(items: list, page: int, limit: int) -> dict:
+    """Jikan-shaped {"data", "pagination"} body for one page of items."""
+    limit = max(1, min(limit, LISTING_PAGE_LIMIT))
+    last_page = max(1, -(-len(items) // limit))
+    chunk = items[(page - 1) * limit: page * limit]
+    return {
+        "data": chunk,
+        "pagination": {"last_visible_page": last_page, "has_next_page": page < last_page, "current_page": page,
+                       "items": {"count": len(chunk), "total": len(items), "per_page": limit}},
+    }
+
+# ----------------------------------------------------------------------
+# Stub Server
+# ----------------------------------------------------------------------
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """Request handler serving the subset of Jikan endpoints used by the app."""
+    routes = [
+        (re.compile(r"^/v4/anime/(\d+)(?:/full)?$"), "anime"),
+        (re.compile(r"^/v4/anime$"), "anime_search"),
+        (re.compile(r"^/v4/seasons/now$"), "season_now"),
+        (re.compile(r"^/v4/schedules$"), "schedules"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers=None):
+        body = json.dumps(payload).encode()
+        if status == 200:
+            # Answer conditional requests like Jikan does, via a content-derived ETag
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            headers = dict(headers or {}, ETag=etag)
+            if self.headers.get("If-None-Match") == etag:
+                self.server.stub.not_modified_count += 1
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        stub.record_request()
+        time.sleep(stub.latency)
+        if stub.should_throttle():
+            self._send_json(429, {"status": 429, "type": "RateLimitException"}, {"Retry-After": "0"} if stub.retry_after_zero else None)
+            return
+        path = self.path.split("?", 1)[0]
+        for pattern, name in self.routes:
+            match = pattern.match(path)
+            if match:
+                getattr(self, f"_route_{name}")(match)
+                return
+        self._send_json(404, {"status": 404, "message": "Resource does not exist"})
+
+    def do_POST(self):
+        # Webhook receiver for the notification webhook backend
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.split("?", 1)[0] != "/webhook":
+            self._send_json(404, {"status": 404, "message": "Resource does not exist"})
+            return
+        with stub._lock:
+            stub.webhook_payloads.append(payload)
+        self._send_json(200, {"received": True})
+
+    def _route_anime(self, match):
+        mal_id = int(match.group(1))
+        self._send_json(200, {"data": fake_airing_anime(mal_id) if mal_id in self.server.stub.airing_ids else fake_anime(mal_id)})
+
+    def _page_params(self):
+        params = parse_qs(urlsplit(self.path).query)
+        return params, int(params.get("page", ["1"])[0]), int(params.get("limit", [str(LISTING_PAGE_LIMIT)])[0])
+
+    def _route_season_now(self, match):
+        params, page, limit = self._page_params()
+        stub = self.server.stub
+        ids = range(SEASON_FIRST_MAL_ID, SEASON_FIRST_MAL_ID + stub.season_size)
+        self._send_json(200, paginate([listing_entry(mal_id) for mal_id in ids], page, limit))
+
+    def _route_schedules(self, match):
+        # Titles with a known broadcast day, optionally filtered by ?filter=<weekday>
+        params, page, limit = self._page_params()
+        stub = self.server.stub
+        day = params.get("filter", [None])[0]
+        entries = [listing_entry(mal_id) for mal_id in sorted(stub.airing_ids)]
+        entries = [anime for anime in entries if anime["broadcast"]["day"]
+                   and (day is None or anime["broadcast"]["day"].lower() == day.lower() + "s")]
+        self._send_json(200, paginate(entries, page, limit))
+
+    def _route_anime_search(self, match):
+        # Deterministic results whose title contains the query, with MAL ids derived from it
+        params = parse_qs(urlsplit(self.path).query)
+        query = params.get("q", [""])[0].strip()
+        limit = min(int(params.get("limit", ["3"])[0]), 25)
+        base = 100000 + int(hashlib.sha1(query.lower().encode()).hexdigest()[:6], 16) * 10
+        results = []
+        for offset in range(min(limit, 3) if query else 0):
+            anime = fake_anime(base + offset)
+            anime["title"] = anime["titles"][0]["title"] = f"{query.title()} {offset + 1}"
+            results.append(anime)
+        self._send_json(200, {"data": results, "pagination": {"last_visible_page": 1, "has_next_page": False}})
+
+class StubJikanServer:
+    """Threaded local Jikan stub with configurable latency and 429 throttling.
+
+    Throttling happens randomly with probability `throttle_rate` and always
+    once more than `max_per_second` requests arrive within one second.
+    /seasons/now lists `season_size` airing titles; /schedules lists them plus
+    `continuing` older shows still airing.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 throttle_rate: float = 0.0, max_per_second: int = None, retry_after_zero: bool = True, seed: int = 0,
+                 season_size: int = 300, continuing: int = 40):
+        self.latency = latency
+        self.season_size = season_size
+        self.airing_ids = set(range(SEASON_FIRST_MAL_ID, SEASON_FIRST_MAL_ID + season_size)) | \
+            set(range(CONTINUING_FIRST_MAL_ID, CONTINUING_FIRST_MAL_ID + continuing))
+        self.throttle_rate = throttle_rate
+        self.max_per_second = max_per_second
+        self.retry_after_zero = retry_after_zero
+        self.request_count = 0
+        self.not_modified_count = 0
+        self.webhook_payloads = []
+        self._rng = random.Random(seed)
+        self._window = []
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v4"
+
+    @property
+    def webhook_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+
+    def record_request(self):
+        with self._lock:
+            self.request_count += 1
+            now = time.monotonic()
+            self._window = [t for t in self._window if now - t < 1.0] + [now]
+
+    def should_throttle(self) -> bool:
+        with self._lock:
+            if self.max_per_second is not None and len(self._window) > self.max_per_second:
+                return True
+            return self._rng.random() < self.throttle_rate
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+# ----------------------------------------------------------------------
+# If file ran directly, serve the stub until interrupted
+# ----------------------------------------------------------------------
+
+@click.command()
+@click.option('--port', type=int, default=8765, help='Port to listen on')
+@click.option('--latency', type=float, default=0.0, help='Seconds of artificial latency per request')
+@click.option('--throttle-rate', type=float, default=0.0, help='Probability of answering 429')
+@click.option('--max-per-second', type=int, default=None, help='Answer 429 above this many requests per second')
+def main(port, latency, throttle_rate, max_per_second):
+    """Serve the stub Jikan API."""
+    server = StubJikanServer(port=port, latency=latency, throttle_rate=throttle_rate, max_per_second=max_per_second)
+    click.echo(f"Stub Jikan API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# ======================================================================
+# File: watching_stats.py
+# Description: This file contains the watching statistics shown by the
+# `watching-stats` command: episodes watched, backlog, completion rate and
+# airing-day histogram per user and for everyone, read from aggregates the
+# database keeps up to date instead of rescanning watchlists.
+#
+# How the statistics are maintained:
+#
+# - stats_anime holds what each anime brings to the aggregates: its aired
+#   episodes (latest announced release, or the episode count of finished
+#   shows), the episode count it is complete at, and the UTC weekday of
+#   its broadcast slot while airing.
+# - user_stats holds one row of sums per user, global_stats one row for
+#   everyone. Triggers (migration 12 in db.py) move them on every write,
+#   whichever code makes it: a watchlist insert, update or delete adjusts
+#   its user's row; an anime or announced-release change recomputes the
+#   stats_anime row and applies the difference to the rows of its watchers
+#   only; user_stats changes are summed into global_stats.
+# - Reading statistics is a single primary-key lookup, however long the
+#   watchlist is.
+# - rebuild() recomputes everything from the base tables in one transaction
+#   and reports the users whose maintained row had drifted.
+#
+# Backlog counts announced episodes, so it grows when the release checker
+# announces an episode rather than at the broadcast minute like the
+# watchlist view. Sharded layouts are not covered: triggers of a shard
+# cannot see the catalog's anime and releases.
+# ======================================================================
+
+import json
+import time
+from collections import namedtuple
+from db import WATCHING_STATS_COLUMNS, Database, stats_anime_values, stats_contribution, rebuild_watching_stats
+
+# Weekdays of the airing-day histogram (UTC), in day_0..day_6 order
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Statistics of one user or of everyone; airing_days counts the entries airing on each of WEEKDAYS
+WatchingStats = namedtuple("WatchingStats", ["users", "entries", "episodes_watched", "backlog", "completed",
+                                             "completion_rate", "airing_days"])
+
+# Outcome of rebuild(): users with statistics, users whose maintained row differed from the recomputed one
+RebuildReport = namedtuple("RebuildReport", ["users", "drifted", "elapsed"])
+
+def _summary(users: int, row) -> WatchingStats:
+    entries, watched, backlog, completed, *days = row
+    return WatchingStats(users=users, entries=entries, episodes_watched=watched, backlog=backlog, completed=completed,
+                         completion_rate=completed / entries if entries else 0.0, airing_days=tuple(days))
+
+# ----------------------------------------------------------------------
+# Statistics Engine
+# ----------------------------------------------------------------------
+
+class StatsEngine:
+    """Read the maintained watching statistics of a Database, and rebuild them."""
+    def __init__(self, db: Database = None):
+        self.db = db or Database()
+
+    def user(self, user_id: int) -> WatchingStats:
+        """Statistics of user_id from its user_stats row (zeros for a user without entries)."""
+        with self.db.transaction() as cursor:
+            row = cursor.execute(f"SELECT {', '.join(WATCHING_STATS_COLUMNS)} FROM user_stats WHERE user_id = ?",
+                                 (user_id,)).fetchone()
+        row = row or (0,) * len(WATCHING_STATS_COLUMNS)
+        return _summary(int(row[0] > 0), row)
+
+    def overall(self) -> WatchingStats:
+        """Statistics of every user together, from the global_stats row."""
+        with self.db.transaction() as cursor:
+            row = cursor.execute(f"SELECT users, {', '.join(WATCHING_STATS_COLUMNS)} FROM global_stats").fetchone()
+        row = row or (0,) * (len(WATCHING_STATS_COLUMNS) + 1)
+        return _summary(row[0], row[1:])
+
+    def scan(self, user_id: int) -> WatchingStats:
+        """Statistics of user_id computed from watchlist, anime and releases, as without maintained aggregates."""
+        aired, finished, airing_day = stats_anime_values("a")
+        contribution = stats_contribution("w", "s")
+        with self.db.transaction() as cursor:
+            row = cursor.execute(f'''
+            SELECT {", ".join(f"COALESCE(SUM({contribution[column]}), 0)" for column in WATCHING_STATS_COLUMNS)}
+            FROM watchlist w
+            LEFT JOIN (SELECT a.id AS anime_id, {aired} AS aired, {finished} AS finished_episodes,
+                              {airing_day} AS airing_day FROM anime a) s ON s.anime_id = w.anime_id
+            WHERE w.user_id = ?
+            ''', (user_id,)).fetchone()
+        return _summary(int(row[0] > 0), row)
+
+    def rebuild(self) -> RebuildReport:
+        """Recompute every aggregate from the base tables. Returns a RebuildReport."""
+        start = time.perf_counter()
+        select = f"SELECT user_id, {', '.join(WATCHING_STATS_COLUMNS)} FROM user_stats"
+        with self.db.transaction() as cursor:
+            before = {row[0]: row[1:] for row in cursor.execute(select)}
+            rebuild_watching_stats(cursor)
+            after = {row[0]: row[1:] for row in cursor.execute(select)}
+        drifted = sum(1 for user_id in before.keys() | after.keys() if before.get(user_id) != after.get(user_id))
+        return RebuildReport(users=len(after), drifted=drifted, elapsed=time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    print(json.dumps(StatsEngine().overall()._asdict(), indent=2))